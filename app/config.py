@@ -15,6 +15,29 @@ class Settings(BaseSettings):
     redis_host: str
     redis_port: str
     sentry_dsn : str
+    price_store_dir : str = "data/prices" # local daily price history used by fetch_historical_prices
+    price_fetch_threads : int = 8 # max tickers downloaded in parallel
+    price_fetch_timeout : int = 10 # seconds before a single ticker request gives up
+    market_data_provider : str = "yfinance" # yfinance, alpha_vantage or synthetic
+    market_data_fixture_dir : str | None = None # optional <TICKER>.csv files used by the synthetic provider
+    covariance_method : str = "sample" # sample, ledoit_wolf or constant_correlation
+    covariance_cache_size : int = 256 # covariance matrices kept in memory
+    analysis_job_workers : int = 2 # processes running background analysis jobs
+    analysis_job_timeout : int = 3600 # seconds after which a running job found at startup is marked failed
+    analysis_threads : int = 4 # analysis requests running at the same time
+    analysis_queue_size : int = 16 # analysis requests waiting, more are rejected with 503
+    analysis_retry_after : int = 5 # seconds sent in Retry-After when the analysis queue is full
+    optimizer_processes : int = 2 # processes running the optimizers, 0 runs them in the API process
+    simulation_chunk_mb : int = 32 # memory used by one chunk of Monte Carlo paths
+    db_pool_size : int = 5 # connections kept open per engine and process
+    db_max_overflow : int = 10 # extra connections opened under load, closed when returned
+    db_pool_timeout : int = 30 # seconds a request waits for a free connection before failing
+    db_pool_recycle : int = -1 # seconds after which a connection is replaced, -1 never
+    db_pool_pre_ping : bool = False # test every connection with a ping before handing it out
+    db_pgbouncer : bool = False # behind PgBouncer in transaction mode: no local pool, no cached prepared statements
+    user_cache_backend : str = "memory" # memory (per process) or redis (shared by all workers)
+    user_cache_ttl : int = 60 # seconds an authenticated user is served from the cache, 0 disables the cache
+    user_cache_size : int = 10000 # users kept in the memory cache
 
     model_config = SettingsConfigDict(env_file = ".env")
 
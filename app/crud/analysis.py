@@ -1,5 +1,10 @@
-from ..models.analysis import AnalysisResult, TickerMetric, OptimizedAllocation
-from sqlalchemy.orm import Session
+from ..models.analysis import AnalysisResult, TickerMetric, OptimizedAllocation, AnalysisJob
+from sqlalchemy.sql import func
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import tuple_, insert
+from datetime import datetime, timedelta
+import base64
+import binascii
 import logging
 
 
@@ -17,7 +22,8 @@ This file:
  '''
 
 
-# Function signature
+# Parent row with INSERT .. RETURNING, then the ticker metrics and allocations as multi-row inserts,
+# everything in one transaction. Much cheaper than flushing one ORM object per child row on large portfolios.
 def create_analysis_result(
     db : Session,
     portfolio_id : int,
@@ -25,28 +31,44 @@ def create_analysis_result(
     ticker_metrics : list[dict],
     allocations : list[dict]
 ):
-    new_analysis = AnalysisResult(portfolio_id=portfolio_id, **analysis_data)
-    db.add(new_analysis)
-    db.commit()
-    db.refresh(new_analysis)
-    logger.info(f"Analysis result with id {new_analysis.id} sucessfully created for portfolio id {portfolio_id}")
-    
-    # now we have new_analysis.id , use in the loop to create new_analysis
+    try:
+        analysis_id = _insert_analysis(db, portfolio_id, analysis_data, ticker_metrics, allocations)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"Analysis result with id {analysis_id} sucessfully created for portfolio id {portfolio_id}")
+    return db.get(AnalysisResult, analysis_id)
+
 
-    for metric in ticker_metrics:
-        new_ticker_metric = TickerMetric(analysis_id=new_analysis.id, **metric)
-        db.add(new_ticker_metric)
+def _insert_analysis(db : Session, portfolio_id : int, analysis_data : dict, ticker_metrics : list[dict], allocations : list[dict]) -> int:
+    analysis_id = db.execute(
+        insert(AnalysisResult).values(portfolio_id=portfolio_id, **analysis_data).returning(AnalysisResult.id)
+    ).scalar_one()
 
+    # A list of parameter sets runs as executemany, batched into multi-row VALUES by the driver
+    if ticker_metrics:
+        db.execute(insert(TickerMetric), [{"analysis_id": analysis_id, **metric} for metric in ticker_metrics])
+    if allocations:
+        db.execute(insert(OptimizedAllocation), [{"analysis_id": analysis_id, **allocation} for allocation in allocations])
+    return analysis_id
         
-       # now we have new_analysis.id , use in the loop to create new_allocations
 
-    for allocation in allocations:
-        new_allocation = OptimizedAllocation(analysis_id=new_analysis.id, **allocation)
-        db.add(new_allocation)
+# Store the analyses of several portfolios in one transaction, results is a list of
+# (portfolio_id, analysis_data, ticker_metrics, allocations). Either all of them are saved or none.
+def create_analysis_results(db : Session, results : list[tuple]):
+    try:
+        analysis_ids = [
+            _insert_analysis(db, portfolio_id, analysis_data, ticker_metrics, allocations)
+            for portfolio_id, analysis_data, ticker_metrics, allocations in results
+        ]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"{len(analysis_ids)} analysis results successfully created in one transaction.")
+    return [db.get(AnalysisResult, analysis_id) for analysis_id in analysis_ids]
 
-    db.commit()
-    return new_analysis
-        
 
 def get_latest_analysis(db : Session, portfolio_id : int):
     latest_analysis = db.query(AnalysisResult).filter(AnalysisResult.portfolio_id == portfolio_id).order_by(AnalysisResult.calculated_at.desc()).first()
@@ -58,9 +80,121 @@ def get_latest_analysis(db : Session, portfolio_id : int):
     return latest_analysis
 
 
-def get_analysis_history(db : Session, portfolio_id : int):
-    analysis_history = db.query(AnalysisResult).filter(AnalysisResult.portfolio_id == portfolio_id).order_by(AnalysisResult.calculated_at.desc()).all()
+# The history cursor is the (calculated_at, id) of the last row of a page, encoded as an opaque string
+def encode_history_cursor(analysis_result : AnalysisResult) -> str:
+    raw = f"{analysis_result.calculated_at.isoformat()}|{analysis_result.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+# Raises ValueError when the cursor was not made by encode_history_cursor
+def decode_history_cursor(cursor : str):
+    try:
+        calculated_at, analysis_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(calculated_at), int(analysis_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+# One page of analysis history, newest first, with the ticker metrics and allocations loaded in two extra queries.
+# Keyset pagination on (calculated_at, id) keeps every page as fast as the first one however long the history is.
+# start and end filter calculated_at (start inclusive, end exclusive). Returns (analyses, next_cursor or None).
+def get_analysis_history(db : Session, portfolio_id : int, limit : int = 50, cursor : str | None = None, start : datetime | None = None, end : datetime | None = None):
+    query = db.query(AnalysisResult).options(
+        selectinload(AnalysisResult.ticker_metrics),
+        selectinload(AnalysisResult.optimized_allocations),
+    ).filter(AnalysisResult.portfolio_id == portfolio_id)
+
+    if start is not None:
+        query = query.filter(AnalysisResult.calculated_at >= start)
+    if end is not None:
+        query = query.filter(AnalysisResult.calculated_at < end)
+    if cursor is not None:
+        calculated_at, analysis_id = decode_history_cursor(cursor)
+        query = query.filter(tuple_(AnalysisResult.calculated_at, AnalysisResult.id) < tuple_(calculated_at, analysis_id))
+
+    # One extra row tells whether there is a next page
+    analysis_history = query.order_by(AnalysisResult.calculated_at.desc(), AnalysisResult.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(analysis_history) > limit:
+        analysis_history = analysis_history[:limit]
+        next_cursor = encode_history_cursor(analysis_history[-1])
+
     logger.info(f"Analysis history succesfully for portfolio id {portfolio_id} successfully retrieved.")
-    return analysis_history
+    return analysis_history, next_cursor
+
+
+# Full analysis history, oldest first, streamed from a server-side cursor in batches of batch_size rows.
+# with_children also loads the ticker metrics and allocations of every batch (one extra query each).
+def iter_analysis_history(db : Session, portfolio_id : int, start : datetime | None = None, end : datetime | None = None, with_children : bool = True, batch_size : int = 500):
+    query = db.query(AnalysisResult).filter(AnalysisResult.portfolio_id == portfolio_id)
+    if with_children:
+        query = query.options(selectinload(AnalysisResult.ticker_metrics), selectinload(AnalysisResult.optimized_allocations))
+    if start is not None:
+        query = query.filter(AnalysisResult.calculated_at >= start)
+    if end is not None:
+        query = query.filter(AnalysisResult.calculated_at < end)
+    logger.info(f"Streaming analysis history for portfolio id {portfolio_id}.")
+    return query.order_by(AnalysisResult.calculated_at, AnalysisResult.id).yield_per(batch_size)
+
+
+# Weights of the most recent analysis, used to warm start the optimizers
+# Returns a dict of ticker -> (optimized_weight, min_vol_weight), empty if the portfolio was never analyzed
+def get_latest_allocations(db : Session, portfolio_id : int):
+    latest_analysis_id = db.query(AnalysisResult.id).filter(AnalysisResult.portfolio_id == portfolio_id).order_by(AnalysisResult.calculated_at.desc()).limit(1).scalar_subquery()
+    rows = db.query(OptimizedAllocation.ticker, OptimizedAllocation.optimized_weight, OptimizedAllocation.min_vol_weight).filter(OptimizedAllocation.analysis_id == latest_analysis_id).all()
+    logger.info(f"Retrieved {len(rows)} previous allocations for portfolio id {portfolio_id}.")
+    return {ticker: (float(optimized_weight), float(min_vol_weight)) for ticker, optimized_weight, min_vol_weight in rows}
 
-    
\ No newline at end of file
+
+# Background analysis jobs
+def create_analysis_job(db : Session, portfolio_id : int, user_id : int, force : bool = False):
+    new_job = AnalysisJob(portfolio_id=portfolio_id, user_id=user_id, force=force)
+    db.add(new_job)
+    db.commit()
+    db.refresh(new_job)
+    logger.info(f"Analysis job with id {new_job.id} queued for portfolio id {portfolio_id}.")
+    return new_job
+
+
+def get_analysis_job(db : Session, job_id : int):
+    return db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+
+
+# Move a job to a new status, started_at and finished_at are set by the database clock
+def update_analysis_job(db : Session, job : AnalysisJob, status : str, analysis_id : int | None = None, error : str | None = None):
+    job.status = status
+    if status == "running":
+        job.started_at = func.now()
+    elif status in ("completed", "failed"):
+        job.finished_at = func.now()
+        job.analysis_id = analysis_id
+        job.error = error
+    db.commit()
+    db.refresh(job)
+    logger.info(f"Analysis job with id {job.id} is {status}.")
+    return job
+
+
+# Move a queued job to running in one statement, False when another worker already took it
+# (a queued job can be submitted again by the startup sweep of another API process)
+def start_analysis_job(db : Session, job_id : int) -> bool:
+    started = db.query(AnalysisJob).filter(AnalysisJob.id == job_id, AnalysisJob.status == "queued").update(
+        {AnalysisJob.status: "running", AnalysisJob.started_at: func.now()}, synchronize_session=False)
+    db.commit()
+    if started:
+        logger.info(f"Analysis job with id {job_id} is running.")
+    return started == 1
+
+
+def get_queued_analysis_job_ids(db : Session):
+    return [job_id for job_id, in db.query(AnalysisJob.id).filter(AnalysisJob.status == "queued").order_by(AnalysisJob.created_at)]
+
+
+# Mark the jobs running for longer than timeout seconds as failed, their worker is gone. Returns how many were failed.
+def fail_stale_analysis_jobs(db : Session, timeout : int, error : str) -> int:
+    stale = db.query(AnalysisJob).filter(AnalysisJob.status == "running", AnalysisJob.started_at < func.now() - timedelta(seconds=timeout)).update(
+        {AnalysisJob.status: "failed", AnalysisJob.finished_at: func.now(), AnalysisJob.error: error}, synchronize_session=False)
+    db.commit()
+    if stale:
+        logger.warning(f"{stale} stale analysis jobs marked as failed.")
+    return stale
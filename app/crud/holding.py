@@ -1,6 +1,7 @@
 from ..models.holding import Holding
 from ..schemas.holding import HoldingCreate, HoldingUpdate
 from sqlalchemy.orm import Session
+from sqlalchemy import insert, select, cast, Float
 import logging
 
 
@@ -15,6 +16,23 @@ def create_holding(db: Session, holding : HoldingCreate, portfolio_id : int):
     logger.info(f"Holding with id {new_holding.id} succesfully created for portfolio id {portfolio_id}.")
     return new_holding
 
+# Insert many holdings with multi-row INSERT .. RETURNING statements in a single transaction
+def create_holdings(db : Session, holdings : list[HoldingCreate], portfolio_id : int):
+    if not holdings:
+        return []
+    rows = [{"ticker": holding.ticker, "num_shares": holding.num_shares, "average_cost": holding.average_cost, "portfolio_id": portfolio_id}
+            for holding in holdings]
+    try:
+        holding_ids = db.scalars(insert(Holding).returning(Holding.id, sort_by_parameter_order=True), rows).all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    # Reload all of them in one query, the committed objects would otherwise be refreshed one by one
+    new_holdings = db.query(Holding).filter(Holding.id.in_(holding_ids)).order_by(Holding.id).all()
+    logger.info(f"{len(new_holdings)} holdings succesfully created for portfolio id {portfolio_id}.")
+    return new_holdings
+
 def get_holdings(db : Session, portfolio_id : int):
     # here i'm filtering the holding model to get all the holding in a given portfolio
     # so I need to call the Holdig and pass the portfolio_id that is in the holding model
@@ -23,6 +41,28 @@ def get_holdings(db : Session, portfolio_id : int):
     return holdings
 
 
+# Holdings of several portfolios in one query, grouped by portfolio id
+def get_holdings_by_portfolio(db : Session, portfolio_ids : list[int]):
+    holdings = db.query(Holding).filter(Holding.portfolio_id.in_(portfolio_ids)).order_by(Holding.id).all()
+    holdings_by_portfolio = {portfolio_id: [] for portfolio_id in portfolio_ids}
+    for holding in holdings:
+        holdings_by_portfolio[holding.portfolio_id].append(holding)
+    logger.info(f"Holdings successfully retrieved for {len(portfolio_ids)} portfolios.")
+    return holdings_by_portfolio
+
+
+# Holdings of the given portfolios as plain (id, portfolio_id, ticker, num_shares, average_cost, created_at) rows,
+# streamed from a server-side cursor in lists of batch_size rows
+def iter_holding_batches(db : Session, portfolio_ids : list[int], batch_size : int = 1000):
+    query = select(
+        Holding.id, Holding.portfolio_id, Holding.ticker,
+        cast(Holding.num_shares, Float).label("num_shares"), cast(Holding.average_cost, Float).label("average_cost"),
+        Holding.created_at,
+    ).where(Holding.portfolio_id.in_(portfolio_ids)).order_by(Holding.portfolio_id, Holding.id)
+    logger.info(f"Streaming holdings for {len(portfolio_ids)} portfolios.")
+    yield from db.execute(query.execution_options(yield_per=batch_size)).partitions()
+
+
 def get_holding_by_id(db : Session, holding_id : int):
     holding = db.query(Holding).filter(Holding.id == holding_id).first()
 
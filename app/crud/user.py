@@ -1,6 +1,7 @@
-"""Create two functions:
+"""Create the user functions:
 1- create_user
 2- get_user_by_email
+3- update_user
 """
 
 from ..models.user import User
@@ -54,5 +55,3 @@ def update_user(db : Session, email : str, user_data : UserUpdate):
     logger.info("User successfully updated.")
     return user
 
-    
-
@@ -1,17 +1,50 @@
 
 from sqlalchemy import create_engine 
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from .config import settings
+from .pool_metrics import instrument_engine, InstrumentedQueuePool, InstrumentedAsyncQueuePool, InstrumentedNullPool
+from uuid import uuid4
 
 # Database connection
 SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
 
+
+# Pool options of both engines from the DB_POOL_* settings. Behind PgBouncer the connections are pooled by
+# PgBouncer itself, every checkout opens a fresh connection and asyncpg must not reuse prepared statement names.
+def engine_options(is_async : bool = False) -> dict:
+    if settings.db_pgbouncer:
+        options = {"poolclass": InstrumentedNullPool}
+        if is_async:
+            options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__"}
+        return options
+
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
 # Create an engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options())
+instrument_engine(engine, "sync")
 
 # Session (replaces cursor + conn)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine (asyncpg) for the async routes, the sync engine above stays for Alembic, the analysis workers and tests
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
+
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(is_async=True))
+instrument_engine(async_engine.sync_engine, "async")
+
+# Objects stay loaded after commit, an expired attribute can not be loaded lazily outside of the session
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Base class for models
 Base = declarative_base()
 
@@ -21,4 +54,17 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Async session for the async routes. The CRUD functions are shared with the sync code and are called
+# with await db.run_sync(crud_function, *args), which runs them on the asyncpg connection without a thread.
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Sessions opened outside of the request, e.g. by the body of a StreamingResponse: the request session is
+# already closed when the body is sent. Routes get the factory as a dependency and use `with session_factory() as db:`.
+def get_session_factory():
+    return SessionLocal
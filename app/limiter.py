@@ -2,25 +2,16 @@ from slowapi import Limiter
 from slowapi.util import get_remote_address
 from .config import settings
 from fastapi import Request
-from .oauth2 import verify_access_token
+from .oauth2 import get_request_token_data
 
 # Defina a limite with an IP-based function for unauthenticated endpoints like auth
 limiter = Limiter(key_func=get_remote_address, default_limits=["200/minute"], storage_uri=f"redis://{settings.redis_host}:{settings.redis_port}" )
 
 # Built the user ID-based key function for authenticated endpoints like analysis, portfolios, holdings
+# The token is decoded once per request and shared with get_current_user
 def get_current_user_key(request: Request):
-    # extract token from header
-    token = request.headers.get("Authorization")
-    if not token:
+    token_data = get_request_token_data(request)
+    if token_data is None:
+        # no or invalid token, extracts the client's IP address and returns a string
         return get_remote_address(request)
-    # Strip the Bearer prefix from the token
-    token = token.replace("Bearer ", "")
-    # decode the token
-    try:
-        token_data = verify_access_token(token, Exception()) # this comes from oauth2 and it contains the email
-        return token_data.email # simply return the email sting contained inside token_data
-    except Exception:
-        # return email as the key
-        return get_remote_address(request) # extracts the client's IP address and returns a string
-
-    
+    return token_data.email # simply return the email sting contained inside token_data
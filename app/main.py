@@ -6,7 +6,7 @@
 
 
 from fastapi import FastAPI
-from .routers import analysis, auth, holdings, portfolios, users
+from .routers import analysis, auth, holdings, portfolios, users, metrics, jobs
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from .logger import setup_logging
@@ -17,6 +17,12 @@ from slowapi.errors import RateLimitExceeded
 # Sentry
 import sentry_sdk
 from .config import settings
+# Background analysis jobs
+from contextlib import asynccontextmanager
+from .services.jobs import shutdown_job_pool, recover_analysis_jobs
+from .services.executor import shutdown_executors
+from .database import async_engine
+from .services.user_cache import user_cache
 
 
 # Initialize Sentry
@@ -36,11 +42,27 @@ logger = logging.getLogger("app.main")
 # Create database tables 
 # Base.metadata.create_all(bind=engine) no longer needed since the database in now under Alembic's control
 
+# Recover the analysis jobs left behind by a stopped process when the API starts.
+# Stop the analysis workers and executors and close the async database and Redis connections when the API shuts down
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        recover_analysis_jobs()
+    except Exception as e:
+        logger.error(f"Analysis jobs could not be recovered: {e}")
+    yield
+    shutdown_job_pool()
+    shutdown_executors()
+    await async_engine.dispose()
+    await user_cache.close()
+
+
 # Initialize the App
 app = FastAPI(
     title="Portfolio Analyzer API",
     description="Analyze and optimize stock portfolios",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 # Log app start up after initialization
 logger.info("Portfolio Analyzer API starting up.")
@@ -77,6 +99,9 @@ def root():
 app.include_router(analysis.router, prefix="/portfolios" )
 logger.info("Analysis router successfully registered.")
 
+app.include_router(jobs.router, prefix="/analysis" )
+logger.info("Analysis jobs router successfully registered.")
+
 app.include_router(holdings.router, prefix="/portfolios" )
 logger.info("Holdings router successfully registered.")
 
@@ -87,4 +112,7 @@ app.include_router(users.router, prefix="/users" )
 logger.info("Users router successfully registered.")
 
 app.include_router(portfolios.router, prefix="/portfolios" )
-logger.info("Portfolios router successfully registered.")
\ No newline at end of file
+logger.info("Portfolios router successfully registered.")
+
+app.include_router(metrics.router, prefix="/metrics" )
+logger.info("Metrics router successfully registered.")
\ No newline at end of file
@@ -1,5 +1,5 @@
 from .user import User
 from .portfolio import Portfolio
 from .holding import Holding
-from .analysis import AnalysisResult, TickerMetric, OptimizedAllocation
+from .analysis import AnalysisResult, TickerMetric, OptimizedAllocation, AnalysisJob
 
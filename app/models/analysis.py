@@ -1,11 +1,13 @@
 from ..database import Base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Numeric
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Numeric, Boolean, Index, false
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 
 class AnalysisResult(Base):
     __tablename__ = "analysis_results"
+    # History pages and the latest analysis are read newest first per portfolio
+    __table_args__ = (Index("ix_analysis_results_portfolio_calculated", "portfolio_id", "calculated_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     portfolio_id = Column(Integer, ForeignKey("portfolios.id", ondelete="CASCADE") , nullable=False)
@@ -17,6 +19,17 @@ class AnalysisResult(Base):
     annualized_volatility = Column(Numeric, nullable=False)
     sharpe_ratio = Column(Numeric, nullable=False)
     max_drawdown = Column(Numeric, nullable=False)
+    # Hash of the inputs (holdings, price date, risk free rate, settings), used to skip unchanged re-runs
+    fingerprint = Column(String(64), nullable=True, index=True)
+    # Daily Value-at-Risk and Expected Shortfall of the portfolio, as positive loss fractions
+    historical_var_95 = Column(Numeric, nullable=True)
+    historical_cvar_95 = Column(Numeric, nullable=True)
+    historical_var_99 = Column(Numeric, nullable=True)
+    historical_cvar_99 = Column(Numeric, nullable=True)
+    parametric_var_95 = Column(Numeric, nullable=True)
+    parametric_cvar_95 = Column(Numeric, nullable=True)
+    parametric_var_99 = Column(Numeric, nullable=True)
+    parametric_cvar_99 = Column(Numeric, nullable=True)
 
     # Relationship
     portfolio = relationship("Portfolio", back_populates="analysis_result")
@@ -26,7 +39,7 @@ class AnalysisResult(Base):
 class TickerMetric(Base):
     __tablename__ = "ticker_metrics"
     id = Column(Integer, primary_key=True, index=True)
-    analysis_id = Column(Integer, ForeignKey("analysis_results.id", ondelete="CASCADE") , nullable=False)
+    analysis_id = Column(Integer, ForeignKey("analysis_results.id", ondelete="CASCADE") , nullable=False, index=True)
     ticker = Column(String, nullable=False)
     current_price = Column(Numeric, nullable=False)
     position_value = Column(Numeric, nullable=False)
@@ -35,6 +48,14 @@ class TickerMetric(Base):
     annualized_volatility = Column(Numeric, nullable=False)
     sharpe_ratio = Column(Numeric, nullable=False)
     max_drawdown = Column(Numeric, nullable=False)
+    historical_var_95 = Column(Numeric, nullable=True)
+    historical_cvar_95 = Column(Numeric, nullable=True)
+    historical_var_99 = Column(Numeric, nullable=True)
+    historical_cvar_99 = Column(Numeric, nullable=True)
+    parametric_var_95 = Column(Numeric, nullable=True)
+    parametric_cvar_95 = Column(Numeric, nullable=True)
+    parametric_var_99 = Column(Numeric, nullable=True)
+    parametric_cvar_99 = Column(Numeric, nullable=True)
 
     
     # Relationship
@@ -45,7 +66,7 @@ class TickerMetric(Base):
 class OptimizedAllocation(Base):
     __tablename__ = "optimized_allocations"
     id = Column(Integer, primary_key=True, index=True)
-    analysis_id = Column(Integer, ForeignKey("analysis_results.id", ondelete="CASCADE") , nullable=False)
+    analysis_id = Column(Integer, ForeignKey("analysis_results.id", ondelete="CASCADE") , nullable=False, index=True)
     ticker = Column(String, nullable=False)
     current_weight = Column(Numeric(precision=12, scale=4), nullable=False)
     optimized_weight = Column(Numeric(precision=12, scale=4), nullable=False)
@@ -58,5 +79,20 @@ class OptimizedAllocation(Base):
 
 
 
+# Analysis run in the background worker pool, status is queued -> running -> completed or failed
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String, nullable=False, server_default="queued")
+    force = Column(Boolean, nullable=False, server_default=false())
+    analysis_id = Column(Integer, ForeignKey("analysis_results.id", ondelete="SET NULL"), nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
 
 
+    # Relationship
+    analysis_result = relationship("AnalysisResult")
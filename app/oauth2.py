@@ -2,13 +2,13 @@ import jwt
 from jwt.exceptions import InvalidTokenError
 from datetime import datetime, timezone, timedelta
 from fastapi.security import OAuth2PasswordBearer
-from .schemas.user import TokenData
-from fastapi import status, HTTPException, Depends
-from .models.user import User
-from .database import get_db
-from sqlalchemy.orm import Session
-
-from sqlalchemy.orm import Session 
+from fastapi.security.utils import get_authorization_scheme_param
+from .schemas.user import TokenData, CurrentUser
+from fastapi import status, HTTPException, Depends, Request
+from .database import get_async_db
+from .crud.user import get_user_by_email
+from .services.user_cache import user_cache
+from sqlalchemy.ext.asyncio import AsyncSession
 from .config import settings
 import logging
 
@@ -48,7 +48,7 @@ def verify_access_token(token: str, credentials_exception):
         if email is None:
             raise credentials_exception
         token_data = TokenData(email=email)
-        logger.info("Token decoded and validated.") # Happy path log
+        logger.debug("Token decoded and validated.") # Happy path log, once per request
     except InvalidTokenError:
         logger.warning("Token could not be  validated.") # Invalid or expired token
         raise credentials_exception
@@ -57,8 +57,27 @@ def verify_access_token(token: str, credentials_exception):
     return token_data
 
 
+# Decode the bearer token of a request only once. The rate limiter key function and get_current_user both
+# need the claims, the result (None for a missing or invalid token) is kept on request.state.
+def get_request_token_data(request: Request) -> TokenData | None:
+    if hasattr(request.state, "token_data"):
+        return request.state.token_data
+
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    token_data = None
+    if scheme.lower() == "bearer" and token:
+        try:
+            token_data = verify_access_token(token, InvalidTokenError())
+        except InvalidTokenError:
+            pass
+    request.state.token_data = token_data
+    return token_data
+
+
 # Create a get_current_user function
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Async so the user lookup never needs a thread, the sync routes can depend on it as well
+# oauth2_scheme rejects requests without a bearer token (and documents the scheme), the claims come from the request
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     
 
     credentials_exception = HTTPException(
@@ -67,11 +86,17 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    token_data = verify_access_token(token, credentials_exception) # this was created above
-    user = db.query(User).filter(User.email == token_data.email).first()
-    logger.info("User successfully validated.")
-
-    if user is None:
-        logger.warning("Authenticated token references a user that does not exist in the database.")
+    token_data = get_request_token_data(request) # decoded once per request, see above
+    if token_data is None:
         raise credentials_exception
+    # Most requests are answered from the user cache without touching the database
+    user = await user_cache.get(token_data.email)
+    if user is None:
+        db_user = await db.run_sync(get_user_by_email, token_data.email)
+        if db_user is None:
+            logger.warning("Authenticated token references a user that does not exist in the database.")
+            raise credentials_exception
+        user = CurrentUser.model_validate(db_user)
+        await user_cache.put(user)
+    logger.info("User successfully validated.")
     return user
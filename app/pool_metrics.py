@@ -0,0 +1,147 @@
+import time
+import threading
+import logging
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
+
+
+# Get a logger instance
+logger = logging.getLogger("app.pool_metrics")
+
+'''
+Connection pool instrumentation.
+The engines in database.py use the pool classes below, they time every
+checkout (the wait for a free connection, or the connect itself with
+NullPool) and count timeouts. Checkout and checkin events keep the number of
+connections in use and how far the pool went into its overflow.
+GET /metrics reports the numbers of every instrumented engine, which is what
+DB_POOL_SIZE and DB_MAX_OVERFLOW should be sized from.
+'''
+
+# Upper bounds in seconds of the checkout wait histogram, slower checkouts land in "+Inf"
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolStats:
+    def __init__(self, name : str):
+        self.name = name
+        self.pool = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.peak_overflow = 0
+
+
+    def record_wait(self, seconds : float, timed_out : bool = False):
+        bucket = next((i for i, bound in enumerate(WAIT_BUCKETS) if seconds <= bound), len(WAIT_BUCKETS))
+        with self._lock:
+            self.wait_buckets[bucket] += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.peak_overflow = max(self.peak_overflow, self.in_use - self._pool_size())
+
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use -= 1
+
+
+    def _pool_size(self) -> int:
+        return self.pool.size() if isinstance(self.pool, QueuePool) else 0
+
+
+    def stats(self):
+        with self._lock:
+            waits = self.checkouts + self.timeouts
+            buckets = {f"<={bound}": count for bound, count in zip(WAIT_BUCKETS, self.wait_buckets)}
+            buckets["+Inf"] = self.wait_buckets[-1]
+            stats = {
+                "pool": type(self.pool).__name__,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_total, 6),
+                "wait_seconds_mean": round(self.wait_total / waits, 6) if waits else 0.0,
+                "wait_seconds_max": round(self.wait_max, 6),
+                "wait_buckets": buckets,
+            }
+        if isinstance(self.pool, QueuePool):
+            stats.update({
+                "size": self.pool.size(),
+                "max_overflow": self.pool._max_overflow,
+                "idle": self.pool.checkedin(),
+                "overflow_in_use": max(0, self.pool.overflow()),
+                "peak_overflow": max(0, self.peak_overflow),
+            })
+        return stats
+
+
+# Times _do_get, which is where a checkout waits for a free connection (or connects)
+class _InstrumentedPool:
+    pool_stats : PoolStats | None = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            if self.pool_stats is not None:
+                self.pool_stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        if self.pool_stats is not None:
+            self.pool_stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+    # engine.dispose() replaces the pool, the new one keeps counting into the same stats
+    def recreate(self):
+        new_pool = super().recreate()
+        if self.pool_stats is not None:
+            new_pool.pool_stats = self.pool_stats
+            self.pool_stats.pool = new_pool
+        return new_pool
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class InstrumentedNullPool(_InstrumentedPool, NullPool):
+    pass
+
+
+# Stats of every instrumented engine by name, reported by GET /metrics
+pool_stats = {}
+
+
+def instrument_engine(engine, name : str) -> PoolStats:
+    stats = PoolStats(name)
+    stats.pool = engine.pool
+    engine.pool.pool_stats = stats
+    # Pool events registered on the engine follow it to recreated pools
+    event.listen(engine, "checkout", stats._on_checkout)
+    event.listen(engine, "checkin", stats._on_checkin)
+    pool_stats[name] = stats
+    logger.info(f"Connection pool of the {name} engine instrumented ({type(engine.pool).__name__}).")
+    return stats
@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from ..schemas.analysis import  AnalysisResponse
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Response
+from ..schemas.analysis import  AnalysisResponse, AnalysisSummary, AnalysisJobResponse, BatchAnalysisResponse, FrontierResponse, SimulationRequest, SimulationResponse, RollingResponse
 from ..oauth2 import get_current_user
-from ..database import get_db
+from ..database import get_db, get_session_factory
 from sqlalchemy.orm import Session
 from ..crud import analysis
 from ..crud import portfolio
 from ..crud import holding
-from ..services.analysis_service import run_portfolio_analysis
+from ..services.analysis_service import run_portfolio_analysis, run_batch_analysis, analysis_fingerprint, run_rolling_analysis, load_price_panel, load_return_inputs, ticker_values, get_risk_free_rate, compute_efficient_frontier
+from ..services.metrics import TRADING_DAYS
+from ..services.market_data import PriceFetchError
+from ..services.simulation import simulate_portfolio
+from ..services.jobs import submit_analysis_job
+from ..services.executor import analysis_executor, AnalysisQueueFullError
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+import csv
+import io
+from ..config import settings
+import math
+from datetime import datetime
 import logging
 # SlowAPI
 from fastapi import Request
@@ -19,10 +31,71 @@ logger = logging.getLogger("app.routers.analysis")
 
 router = APIRouter(tags=['Analysis'])
 
+
+# The heavy routes are async and run their work on the dedicated analysis executor,
+# so they never take threads from the default pool used by the CRUD routes.
+# Results are converted to response models inside the executor, lazy loads never run on the event loop.
+async def run_in_analysis_executor(func, *args):
+    try:
+        return await analysis_executor.run(func, *args)
+    except AnalysisQueueFullError:
+        logger.warning("Analysis queue is full, request rejected.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many analyses in progress, try again later",
+                            headers={"Retry-After": str(settings.analysis_retry_after)})
+
+
+# Analyze every portfolio of the current user, prices and returns are computed once for all of them
+@router.post("/analyze-all", status_code=status.HTTP_201_CREATED, response_model=BatchAnalysisResponse)
+@limiter.limit("5/minute", key_func=get_current_user_key)
+async def run_analysis_all(request:Request, force:bool = False, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    return await run_in_analysis_executor(_run_analysis_all, force, db, current_user)
+
+
+def _run_analysis_all(force, db, current_user):
+    user_portfolios = portfolio.get_portfolios(db, current_user.id)
+    holdings_by_portfolio = holding.get_holdings_by_portfolio(db, [p.id for p in user_portfolios])
+
+    skipped = []
+    to_analyze = {}
+    latest_analyses = {}
+    for portfolio_id, holdings_check in holdings_by_portfolio.items():
+        if not holdings_check:
+            skipped.append({"portfolio_id": portfolio_id, "reason": "No holdings to analyze"})
+            continue
+        to_analyze[portfolio_id] = holdings_check
+        # Same memoization as the single portfolio route, the fingerprints are compared once the prices are loaded
+        latest_analysis = None if force else analysis.get_latest_analysis(db, portfolio_id)
+        if latest_analysis is not None:
+            latest_analyses[portfolio_id] = latest_analysis
+
+    new_analyses = []
+    unchanged = []
+    if to_analyze:
+        previous_allocations = {portfolio_id: analysis.get_latest_allocations(db, portfolio_id) for portfolio_id in to_analyze}
+        latest_fingerprints = {portfolio_id: latest_analysis.fingerprint for portfolio_id, latest_analysis in latest_analyses.items()}
+        results, failed, unchanged_ids = run_batch_analysis(to_analyze, previous_allocations, latest_fingerprints)
+        unchanged = [latest_analyses[portfolio_id] for portfolio_id in unchanged_ids]
+        # A portfolio with missing prices is skipped, the other portfolios are still analyzed
+        for portfolio_id, error in failed.items():
+            logger.error(f"Price data could not be fetched for portfolio id {portfolio_id}.")
+            skipped.append({"portfolio_id": portfolio_id, "reason": str(error)})
+
+        rows = [(portfolio_id, analysis_data, ticker_metrics, allocations) for portfolio_id, (analysis_data, ticker_metrics, allocations) in results.items()]
+        new_analyses = analysis.create_analysis_results(db, rows)
+
+    logger.info(f"Batch analysis for user id {current_user.id}: {len(new_analyses)} created, {len(unchanged)} unchanged, {len(skipped)} skipped.")
+    return BatchAnalysisResponse.model_validate({"analyses": [*new_analyses, *unchanged], "skipped": skipped}, from_attributes=True)
+
+
 # Run analysis on a portfolio
 @router.post("/{portfolio_id}/analyze", status_code=status.HTTP_201_CREATED, response_model=AnalysisResponse)
 @limiter.limit("30/minute", key_func=get_current_user_key)
-def run_analysis(request:Request, portfolio_id:int, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+async def run_analysis(request:Request, response:Response, portfolio_id:int, force:bool = False, run_async:bool = Query(False, alias="async"), db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    return await run_in_analysis_executor(_run_analysis, response, portfolio_id, force, run_async, db, current_user)
+
+
+def _run_analysis(response, portfolio_id, force, run_async, db, current_user):
     
     # Fetch portfolio to check for ownership
     portfolio_check = portfolio.get_portfolio_by_id(db, portfolio_id)
@@ -50,12 +123,40 @@ def run_analysis(request:Request, portfolio_id:int, db: Session = Depends(get_db
                             detail=f"No holdings to analyze")
    
 
+    # Async mode: queue a job for the worker pool and return its id, the client polls /analysis/jobs/{id}.
+    # The job loads the prices and returns the stored analysis itself when nothing changed.
+    if run_async:
+        job = analysis.create_analysis_job(db, portfolio_id, current_user.id, force)
+        submit_analysis_job(job.id)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(AnalysisJobResponse.model_validate(job)))
+
+    try:
+        panel = load_price_panel([holding.ticker for holding in holdings_check])
+    except PriceFetchError as e:
+        # Report every ticker that failed so the client can fix them all at once
+        logger.error(f"Price data could not be fetched for portfolio id {portfolio_id}.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail={"message": "Could not fetch price data", "failures": e.failures})
+
+    # Nothing changed since the last run (retries, double clicks, no new price bar): return the stored analysis unless forced
+    dates, _, _ = panel
+    fingerprint = analysis_fingerprint(holdings_check, dates[-1].date())
+    if not force:
+        latest_analysis = analysis.get_latest_analysis(db, portfolio_id)
+        if latest_analysis is not None and latest_analysis.fingerprint == fingerprint:
+            logger.info(f"Analysis with id {latest_analysis.id} is up to date, returning it.")
+            response.status_code = status.HTTP_200_OK
+            return AnalysisResponse.model_validate(latest_analysis)
+
     # Save the analysis result (this comes from analysis_service.py)
-    analysis_data, ticker_metrics, allocations = run_portfolio_analysis(holdings_check)
+    # The last stored allocation is usually close to the new optimum, use it to warm start the optimizers
+    previous_allocations = analysis.get_latest_allocations(db, portfolio_id)
+    analysis_data, ticker_metrics, allocations = run_portfolio_analysis(holdings_check, previous_allocations, panel)
 
+    analysis_data["fingerprint"] = fingerprint
     new_analysis = analysis.create_analysis_result(db, portfolio_id, analysis_data, ticker_metrics, allocations)
     logger.info(f"Analysis with id {new_analysis.id} successfully performed.")
-    return new_analysis
+    return AnalysisResponse.model_validate(new_analysis)
 
 
 # Get latest analysis
@@ -91,7 +192,8 @@ def get_latest_analysis(request:Request,portfolio_id:int, db:Session = Depends(g
 # Get all analyses
 @router.get("/{portfolio_id}/analysis/history", response_model=list[AnalysisResponse])
 @limiter.limit("30/minute", key_func=get_current_user_key)
-def get_historical_analysis(request:Request,portfolio_id:int, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+def get_historical_analysis(request:Request, response:Response, portfolio_id:int, limit:int = Query(50, ge=1, le=200), cursor:str | None = None,
+                            start:datetime | None = None, end:datetime | None = None, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
     portfolio_check = portfolio.get_portfolio_by_id(db,portfolio_id)
 
     if not portfolio_check:
@@ -104,10 +206,19 @@ def get_historical_analysis(request:Request,portfolio_id:int, db:Session = Depen
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
     
-    historical_analysis = analysis.get_analysis_history(db, portfolio_id)
+    try:
+        historical_analysis, next_cursor = analysis.get_analysis_history(db, portfolio_id, limit, cursor, start, end)
+    except ValueError:
+        logger.info(f"Invalid history cursor for portfolio id {portfolio_id}.")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid cursor")
 
-    # Check if the historical analysis list is empty
-    if not historical_analysis :
+    # The next page is requested with ?cursor=<X-Next-Cursor>, the header is missing on the last page
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    # Check if the historical analysis list is empty (later pages can be empty)
+    if not historical_analysis and cursor is None:
         # here we use portfolio_id since no analysis was found to get an id
         logger.info(f"Analysis with id {portfolio_id} not found.") 
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -115,5 +226,227 @@ def get_historical_analysis(request:Request,portfolio_id:int, db:Session = Depen
     
     logger.info(f"Retrieved {len(historical_analysis)} analyses for portfolio id {portfolio_id}.")
     return historical_analysis
-    
 
+
+
+# Stream the full analysis history as NDJSON (one analysis with its ticker metrics and allocations per line)
+# or CSV (portfolio level metrics, one analysis per row), oldest first
+@router.get("/{portfolio_id}/analysis/export")
+@limiter.limit("10/minute", key_func=get_current_user_key)
+def export_analysis_history(request:Request, portfolio_id:int, format:str = Query("ndjson", pattern="^(ndjson|csv)$"),
+                            start:datetime | None = None, end:datetime | None = None, db:Session = Depends(get_db), session_factory=Depends(get_session_factory),
+                            current_user=Depends(get_current_user)):
+    portfolio_check = portfolio.get_portfolio_by_id(db, portfolio_id)
+
+    if not portfolio_check:
+        logger.info(f"Portfolio with id {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"portfolio with id: {portfolio_id} not found.")
+
+    if portfolio_check.user_id != current_user.id:
+        logger.warning(f"Access to portfolio with portfolio id: {portfolio_id} not authorized.")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
+
+    def stream_rows():
+        with session_factory() as stream_db:
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=list(AnalysisSummary.model_fields))
+                writer.writeheader()
+                yield buffer.getvalue()
+                for analysis_result in analysis.iter_analysis_history(stream_db, portfolio_id, start, end, with_children=False):
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerow(AnalysisSummary.model_validate(analysis_result).model_dump(mode="json"))
+                    yield buffer.getvalue()
+            else:
+                for analysis_result in analysis.iter_analysis_history(stream_db, portfolio_id, start, end):
+                    yield AnalysisResponse.model_validate(analysis_result).model_dump_json() + "\n"
+
+    logger.info(f"Exporting analysis history of portfolio id {portfolio_id} as {format}.")
+    if format == "csv":
+        return StreamingResponse(stream_rows(), media_type="text/csv",
+                                 headers={"Content-Disposition": f"attachment; filename=portfolio_{portfolio_id}_analysis.csv"})
+    return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
+
+# Rolling volatility, Sharpe ratio and drawdown series for the portfolio and each ticker
+# windows is a comma separated list of window lengths in trading days
+@router.get("/{portfolio_id}/analysis/rolling", response_model=RollingResponse)
+@limiter.limit("30/minute", key_func=get_current_user_key)
+async def get_rolling_analysis(request:Request, portfolio_id:int, windows:str = Query("21,63,126", pattern=r"^\d+(,\d+)*$"), db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+    return await run_in_analysis_executor(_get_rolling_analysis, portfolio_id, windows, db, current_user)
+
+
+def _get_rolling_analysis(portfolio_id, windows, db, current_user):
+    window_lengths = sorted({int(window) for window in windows.split(",")})
+    if len(window_lengths) > 10 or window_lengths[0] < 2 or window_lengths[-1] > 252:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="windows must be at most 10 lengths between 2 and 252 days")
+
+    portfolio_check = portfolio.get_portfolio_by_id(db, portfolio_id)
+
+    if not portfolio_check:
+        logger.info(f"Portfolio with id {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"portfolio with id: {portfolio_id} not found.")
+
+    if portfolio_check.user_id != current_user.id:
+        logger.warning(f"Access to portfolio with portfolio id: {portfolio_id} not authorized.")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
+
+    holdings_check = holding.get_holdings(db, portfolio_id)
+
+    if not holdings_check:
+        logger.info(f"Holdings with portfolio id {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"No holdings to analyze")
+
+    # One year of values for every window, plus the days the longest window needs to fill up
+    lookback_days = 365 + math.ceil(window_lengths[-1] * 365 / 252)
+    try:
+        dates, tickers, rolling = run_rolling_analysis(holdings_check, window_lengths, lookback_days)
+    except PriceFetchError as e:
+        logger.error(f"Price data could not be fetched for portfolio id {portfolio_id}.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail={"message": "Could not fetch price data", "failures": e.failures})
+
+    # Start where the longest window is complete so every series covers the same dates
+    first_row = window_lengths[-1] - 1
+
+    def to_series(metrics, column):
+        return {name: [None if math.isnan(value) else value for value in values[first_row:, column].tolist()] for name, values in metrics.items()}
+
+    logger.info(f"Rolling analysis for windows {window_lengths} successfully calculated for portfolio id {portfolio_id}.")
+    return {
+        "portfolio_id": portfolio_id,
+        "dates": [timestamp.date() for timestamp in dates[first_row:]],
+        "windows": [
+            {
+                "window": window,
+                "portfolio": to_series(rolling[window], -1),
+                "tickers": {ticker: to_series(rolling[window], column) for column, ticker in enumerate(tickers)},
+            }
+            for window in window_lengths
+        ],
+    }
+
+
+# Efficient frontier of the tickers in a portfolio
+@router.get("/{portfolio_id}/frontier", response_model=FrontierResponse)
+@limiter.limit("30/minute", key_func=get_current_user_key)
+async def get_efficient_frontier(request:Request, portfolio_id:int, points:int = Query(25, ge=2, le=200), db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+    return await run_in_analysis_executor(_get_efficient_frontier, portfolio_id, points, db, current_user)
+
+
+def _get_efficient_frontier(portfolio_id, points, db, current_user):
+    portfolio_check = portfolio.get_portfolio_by_id(db, portfolio_id)
+
+    if not portfolio_check:
+        logger.info(f"Portfolio with id {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"portfolio with id: {portfolio_id} not found.")
+
+    if portfolio_check.user_id != current_user.id:
+        logger.warning(f"Access to portfolio with portfolio id: {portfolio_id} not authorized.")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
+
+    holdings_check = holding.get_holdings(db, portfolio_id)
+
+    if not holdings_check:
+        logger.info(f"Holdings with portfolio id {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"No holdings to analyze")
+
+    try:
+        tickers, price_matrix, returns, covariance = load_return_inputs([h.ticker for h in holdings_check])
+    except PriceFetchError as e:
+        logger.error(f"Price data could not be fetched for portfolio id {portfolio_id}.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail={"message": "Could not fetch price data", "failures": e.failures})
+
+    risk_free_rate = get_risk_free_rate()
+    frontier = compute_efficient_frontier(returns.mean(axis=0) * TRADING_DAYS, covariance, risk_free_rate, points)
+
+    def to_point(weights, expected_return, volatility, sharpe_ratio):
+        return {
+            "expected_return": float(expected_return),
+            "volatility": float(volatility),
+            "sharpe_ratio": float(sharpe_ratio),
+            "weights": {ticker: float(weight) for ticker, weight in zip(tickers, weights)},
+        }
+
+    logger.info(f"Efficient frontier with {len(frontier['weights'])} points successfully calculated for portfolio id {portfolio_id}.")
+    return {
+        "portfolio_id": portfolio_id,
+        "risk_free_rate": risk_free_rate,
+        "points": [to_point(*values) for values in zip(frontier["weights"], frontier["expected_returns"], frontier["volatilities"], frontier["sharpe_ratios"])],
+        "tangency": to_point(**frontier["tangency"]),
+        "min_volatility": to_point(**frontier["min_volatility"]),
+    }
+
+
+
+
+# Monte Carlo projection of the current portfolio (buy and hold)
+@router.post("/{portfolio_id}/simulate", response_model=SimulationResponse)
+@limiter.limit("10/minute", key_func=get_current_user_key)
+async def simulate(request:Request, portfolio_id:int, simulation:SimulationRequest, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+    return await run_in_analysis_executor(_simulate, portfolio_id, simulation, db, current_user)
+
+
+def _simulate(portfolio_id, simulation, db, current_user):
+    portfolio_check = portfolio.get_portfolio_by_id(db, portfolio_id)
+
+    if not portfolio_check:
+        logger.info(f"Portfolio with id {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"portfolio with id: {portfolio_id} not found.")
+
+    if portfolio_check.user_id != current_user.id:
+        logger.warning(f"Access to portfolio with portfolio id: {portfolio_id} not authorized.")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
+
+    holdings_check = holding.get_holdings(db, portfolio_id)
+
+    if not holdings_check:
+        logger.info(f"Holdings with portfolio id {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"No holdings to analyze")
+
+    try:
+        tickers, price_matrix, returns, covariance = load_return_inputs([h.ticker for h in holdings_check])
+    except PriceFetchError as e:
+        logger.error(f"Price data could not be fetched for portfolio id {portfolio_id}.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail={"message": "Could not fetch price data", "failures": e.failures})
+
+    values = ticker_values(holdings_check, tickers, price_matrix)
+    initial_value = float(values.sum())
+
+    result = simulate_portfolio(
+        values / initial_value,
+        returns.mean(axis=0) * TRADING_DAYS,
+        covariance,
+        initial_value,
+        num_paths=simulation.num_paths,
+        horizon_days=simulation.horizon_days,
+        percentiles=simulation.percentiles,
+        seed=simulation.seed,
+        chunk_bytes=settings.simulation_chunk_mb * 1024 * 1024,
+    )
+
+    logger.info(f"Simulation with {simulation.num_paths} paths successfully performed for portfolio id {portfolio_id}.")
+    return {
+        "portfolio_id": portfolio_id,
+        "num_paths": simulation.num_paths,
+        "horizon_days": simulation.horizon_days,
+        "seed": result["seed"],
+        "initial_value": initial_value,
+        "percentiles": {f"{percentile:g}": values.tolist() for percentile, values in result["percentiles"].items()},
+        "expected_values": result["expected_values"].tolist(),
+        "probability_of_loss": result["probability_of_loss"],
+    }
@@ -1,14 +1,17 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from ..schemas.holding import HoldingCreate, HoldingUpdate, HoldingResponse
+from fastapi import APIRouter, Depends, status, HTTPException, UploadFile, File, Query
+from fastapi.responses import StreamingResponse
+from ..schemas.holding import HoldingCreate, HoldingUpdate, HoldingResponse, HoldingImportResponse
 from ..crud import portfolio
 from ..oauth2 import get_current_user
-from ..database import get_db
+from ..database import get_db, get_async_db, get_session_factory
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from ..crud import holding
 import logging
-import requests
-from ..config import settings
-import yfinance as yf
+from ..services.market_data import get_market_data_provider
+from ..services.holding_import import prepare_holdings, file_format, HoldingImportFileError
+from ..services.holding_export import export_chunks, EXPORT_FORMATS
 # SlowAPI
 from fastapi import Request
 from ..limiter import limiter, get_current_user_key
@@ -21,52 +24,23 @@ logger = logging.getLogger("app.routers.holdings")
 router = APIRouter(tags=['Holdings'])
 
 def get_current_price(ticker):
-    import yfinance as yf
     try:
-        data = yf.Ticker(ticker)
-        price = data.fast_info["last_price"]
-        if not price:
-            raise ValueError(f"No price found for {ticker}")
+        price = get_market_data_provider().get_quote(ticker)
         logger.info(f"Current price successfully found for {ticker}: {price}")
-        return float(price)
+        return price
     except Exception as e:
         logger.error(f"Failed to fetch price for {ticker}: {e}")
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                             detail=f"Could not fetch price for {ticker}")
 
 
-
-'''
-def get_current_price(ticker):
-    api_key = settings.alpha_vantage_api_key
-    url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={ticker}&apikey={api_key}"
-    
-    try:
-        response = requests.get(url)
-        data = response.json()
-        price = data["Global Quote"]["05. price"]
-
-        if not price:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail=f"Price data not found for {ticker}")
-        
-        logger.info("Current price successfully found.")
-        return float(price)
-    
-    except Exception as e:
-        logger.error(f"Failed to fetch price for {ticker}: {e}")
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                            detail=f"Could not fetch price for {ticker}")
-'''
-
-
 # Add a holding to a portfolio
 @router.post("/{portfolio_id}/holdings", status_code=status.HTTP_201_CREATED, response_model=HoldingResponse)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def create_holding(request:Request,portfolio_id:int, holding_data: HoldingCreate, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+async def create_holding(request:Request,portfolio_id:int, holding_data: HoldingCreate, db: AsyncSession = Depends(get_async_db), current_user = Depends(get_current_user)):
     
     # Fetch portfolio by id
-    portfolio_check = portfolio.get_portfolio_by_id(db,portfolio_id)
+    portfolio_check = await db.run_sync(portfolio.get_portfolio_by_id, portfolio_id)
 
      # Check if the portfolio exists
     if not portfolio_check:
@@ -84,22 +58,50 @@ def create_holding(request:Request,portfolio_id:int, holding_data: HoldingCreate
     # Check if average price is provided, if not fetch current price
     if holding_data.average_cost is None:
         logger.info(f"Average cost not provided for {holding_data.ticker}, fetching current market price.")
-        price = get_current_price(holding_data.ticker)
+        # The quote is a blocking network call, keep it off the event loop
+        price = await run_in_threadpool(get_current_price, holding_data.ticker)
         holding_data.average_cost = price
 
     # Create a new holding in the portfolio
-    new_holding = holding.create_holding(db,holding_data, portfolio_id)
+    new_holding = await db.run_sync(holding.create_holding, holding_data, portfolio_id)
     logger.info(f"New holding with id {new_holding.id} successfully created at portfolio with id {portfolio_id}")
     return new_holding
 
 
 
+# Import many holdings from a CSV or JSON upload, rows that fail are reported and the others are still imported
+@router.post("/{portfolio_id}/holdings/import", status_code=status.HTTP_201_CREATED, response_model=HoldingImportResponse)
+@limiter.limit("10/minute", key_func=get_current_user_key)
+def import_holdings(request:Request, portfolio_id:int, file: UploadFile = File(...), db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    portfolio_check = portfolio.get_portfolio_by_id(db,portfolio_id)
+
+    if not portfolio_check:
+        logger.info(f"portfolio with id: {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"portfolio with id: {portfolio_id} not found.")
+
+    if portfolio_check.user_id != current_user.id:
+        logger.warning(f"Acess to portfolio with  id: {portfolio_id} not authorized")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
+
+    try:
+        holdings, errors = prepare_holdings(file.file, file_format(file.filename, file.content_type))
+    except HoldingImportFileError as e:
+        logger.info(f"Holdings import for portfolio id {portfolio_id} rejected: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    new_holdings = holding.create_holdings(db, [holding_data for _, holding_data in holdings], portfolio_id)
+    logger.info(f"{len(new_holdings)} holdings imported at portfolio with id {portfolio_id}, {len(errors)} rows rejected.")
+    return {"imported": len(new_holdings), "holdings": new_holdings, "errors": errors}
+
+
 # List all holdings in a portfolio
 @router.get("/{portfolio_id}/holdings", status_code= status.HTTP_200_OK, response_model=list[HoldingResponse])
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def get_holdings(request:Request,portfolio_id:int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_holdings(request:Request,portfolio_id:int, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
     # Fetch portfolio by id
-    portfolio_check = portfolio.get_portfolio_by_id(db,portfolio_id)
+    portfolio_check = await db.run_sync(portfolio.get_portfolio_by_id, portfolio_id)
 
      # Check if the portfolio exists
     if not portfolio_check:
@@ -113,20 +115,68 @@ def get_holdings(request:Request,portfolio_id:int, db: Session = Depends(get_db)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
     
-    holdings = holding.get_holdings(db, portfolio_id)
+    holdings = await db.run_sync(holding.get_holdings, portfolio_id)
     logger.info(f"Retrieved {len(holdings)} holdings for portfolio id {portfolio_id}.")
 
     return holdings
 
+
+# Stream the holdings of the given portfolios, the rows are read in batches after the response has started
+def export_response(session_factory, portfolio_ids : list[int], export_format : str, filename : str):
+    if export_format != "csv":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.error("pyarrow is not installed, Arrow and Parquet exports are not available.")
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                                detail=f"{export_format} export is not available")
+
+    def stream_chunks():
+        with session_factory() as stream_db:
+            yield from export_chunks(holding.iter_holding_batches(stream_db, portfolio_ids), export_format)
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    return StreamingResponse(stream_chunks(), media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename={filename}.{extension}"})
+
+
+# Export the holdings of all the user's portfolios as CSV, Arrow IPC stream or Parquet
+@router.get("/holdings/export")
+@limiter.limit("10/minute", key_func=get_current_user_key)
+def export_all_holdings(request:Request, format:str = Query("csv", pattern="^(csv|arrow|parquet)$"), db: Session = Depends(get_db), session_factory=Depends(get_session_factory), current_user=Depends(get_current_user)):
+    portfolio_ids = [user_portfolio.id for user_portfolio in portfolio.get_portfolios(db, current_user.id)]
+    logger.info(f"Exporting holdings of {len(portfolio_ids)} portfolios for user id {current_user.id} as {format}.")
+    return export_response(session_factory, portfolio_ids, format, f"user_{current_user.id}_holdings")
+
+
+# Export the holdings of one portfolio as CSV, Arrow IPC stream or Parquet
+@router.get("/{portfolio_id}/holdings/export")
+@limiter.limit("10/minute", key_func=get_current_user_key)
+def export_holdings(request:Request, portfolio_id:int, format:str = Query("csv", pattern="^(csv|arrow|parquet)$"), db: Session = Depends(get_db), session_factory=Depends(get_session_factory), current_user=Depends(get_current_user)):
+    portfolio_check = portfolio.get_portfolio_by_id(db,portfolio_id)
+
+    if not portfolio_check:
+        logger.info(f"portfolio with id: {portfolio_id} not found.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"portfolio with id: {portfolio_id} not found.")
+
+    if portfolio_check.user_id != current_user.id:
+        logger.warning(f"Acess to portfolio with  id: {portfolio_id} not authorized")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
+
+    logger.info(f"Exporting holdings of portfolio id {portfolio_id} as {format}.")
+    return export_response(session_factory, [portfolio_id], format, f"portfolio_{portfolio_id}_holdings")
+
 # Update a specific holding in a portfolio
 # Sice we are acting on an specific holding with need its id along with the portfolio_id
 @router.put("/{portfolio_id}/holdings/{holding_id}", response_model=HoldingResponse)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def update_holding(request:Request,portfolio_id:int, holding_id:int, holding_data : HoldingUpdate, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def update_holding(request:Request,portfolio_id:int, holding_id:int, holding_data : HoldingUpdate, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
     # Fetch the portfolio by its id, then check ownership
-    portfolio_check = portfolio.get_portfolio_by_id(db, portfolio_id)
+    portfolio_check = await db.run_sync(portfolio.get_portfolio_by_id, portfolio_id)
     # Fetch holdings by its id, then check ownership
-    holding_check = holding.get_holding_by_id(db, holding_id)
+    holding_check = await db.run_sync(holding.get_holding_by_id, holding_id)
 
 
     if not portfolio_check:
@@ -145,7 +195,7 @@ def update_holding(request:Request,portfolio_id:int, holding_id:int, holding_dat
                             detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
     
     # Update the portfolio using its id and the data received
-    holding_update = holding.update_holding(db, holding_id, holding_data)
+    holding_update = await db.run_sync(holding.update_holding, holding_id, holding_data)
     logger.info(f"Holding with {holding_id} sucessfully updated.")
 
     return holding_update
@@ -154,11 +204,11 @@ def update_holding(request:Request,portfolio_id:int, holding_id:int, holding_dat
 # Delete holding
 @router.delete("/{portfolio_id}/holdings/{holding_id}", status_code=status.HTTP_204_NO_CONTENT)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def delete_holding(request:Request,portfolio_id:int, holding_id:int, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def delete_holding(request:Request,portfolio_id:int, holding_id:int, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
     # Fetch the portfolio by its id, then check ownership
-    portfolio_check = portfolio.get_portfolio_by_id(db, portfolio_id)
+    portfolio_check = await db.run_sync(portfolio.get_portfolio_by_id, portfolio_id)
     # Fetch holdings by its id, then check ownership
-    holding_check = holding.get_holding_by_id(db, holding_id)
+    holding_check = await db.run_sync(holding.get_holding_by_id, holding_id)
 
     if not portfolio_check:
         logger.info(f"portfolio with id: {portfolio_id} not found.")
@@ -176,5 +226,5 @@ def delete_holding(request:Request,portfolio_id:int, holding_id:int, db:Session
                             detail=f"Acess to portfolio with  id: {portfolio_id} not authorized")
     
     # Delete the portfolio
-    holding.delete_holding(db, holding_id)
+    await db.run_sync(holding.delete_holding, holding_id)
     logger.info(f"Holding with id {holding_id} successfully deleted")
\ No newline at end of file
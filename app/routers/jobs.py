@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, status, HTTPException
+from ..schemas.analysis import AnalysisJobResponse
+from ..oauth2 import get_current_user
+from ..database import get_db
+from sqlalchemy.orm import Session
+from ..crud import analysis
+import logging
+# SlowAPI
+from fastapi import Request
+from ..limiter import limiter, get_current_user_key
+
+
+# Get a logger instance
+logger = logging.getLogger("app.routers.jobs")
+
+
+router = APIRouter(tags=['Analysis Jobs'])
+
+# Status of a background analysis job, the analysis result is included once the job is completed
+@router.get("/jobs/{job_id}", response_model=AnalysisJobResponse)
+@limiter.limit("120/minute", key_func=get_current_user_key)
+def get_analysis_job(request:Request, job_id:int, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+    job = analysis.get_analysis_job(db, job_id)
+
+    if not job:
+        logger.info(f"Analysis job with id {job_id} not found.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Analysis job with id: {job_id} not found.")
+
+    if job.user_id != current_user.id:
+        logger.warning(f"Access to analysis job with id: {job_id} not authorized.")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Acess to analysis job with id: {job_id} not authorized")
+
+    logger.info(f"Analysis job with id {job_id} successfully retrieved.")
+    return job
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Request
+from ..services.covariance import covariance_cache
+from ..services.executor import analysis_executor
+from ..pool_metrics import pool_stats
+from ..services.user_cache import user_cache
+import logging
+from ..limiter import limiter
+
+
+# Get a logger instance
+logger = logging.getLogger("app.routers.metrics")
+
+
+router = APIRouter(tags=['Metrics'])
+
+# Cache counters (including the authenticated user cache), analysis queue depth and connection pool usage for monitoring, no user data is exposed so no authentication is needed
+@router.get("")
+@limiter.limit("60/minute")
+def get_metrics(request: Request):
+    logger.debug("Service metrics retrieved.")
+    return {
+        "covariance_cache": covariance_cache.stats(),
+        "analysis_executor": analysis_executor.stats(),
+        "user_cache": user_cache.stats(),
+        "database_pools": {name: stats.stats() for name, stats in pool_stats.items()},
+    }
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from ..schemas.portfolio import  PortfolioCreate, PortfolioUpdate, PortfolioResponse
 from ..oauth2 import get_current_user
-from ..database import get_db
-from sqlalchemy.orm import Session
+from ..database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..crud import portfolio
 import logging
 # SlowAPI
@@ -19,16 +19,16 @@ router = APIRouter(tags=['Portfolios'])
 # Create portfolio
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=PortfolioResponse)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def create_portfolio(request:Request,portfolio_data: PortfolioCreate, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    new_portfolio = portfolio.create_portfolio(db,portfolio_data, current_user.id)
+async def create_portfolio(request:Request,portfolio_data: PortfolioCreate, db: AsyncSession = Depends(get_async_db), current_user = Depends(get_current_user)):
+    new_portfolio = await db.run_sync(portfolio.create_portfolio, portfolio_data, current_user.id)
     logger.info(f"Portfolio with id {new_portfolio.id} successfully created for user with id {current_user.id}.")
     return new_portfolio
 
 # List all the portfolios for the user
 @router.get("/", status_code= status.HTTP_200_OK, response_model=list[PortfolioResponse]) # return a list of portfolios
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def get_portfolios(request:Request,db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    all_portfolios = portfolio.get_portfolios(db, current_user.id)
+async def get_portfolios(request:Request,db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    all_portfolios = await db.run_sync(portfolio.get_portfolios, current_user.id)
     logger.info(f"Retrieved {len(all_portfolios)} portfolios with user id {current_user.id}.")
     return all_portfolios
 
@@ -36,8 +36,8 @@ def get_portfolios(request:Request,db: Session = Depends(get_db), current_user=D
 # List a single portfolio by user id
 @router.get("/{id}", response_model=PortfolioResponse)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def get_portfolio_id(request:Request,id:int, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
-    portfolio_id = portfolio.get_portfolio_by_id(db,id)
+async def get_portfolio_id(request:Request,id:int, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    portfolio_id = await db.run_sync(portfolio.get_portfolio_by_id, id)
 
     if not portfolio_id:
         logger.info(f"portfolio with id: {id} not found.")
@@ -57,10 +57,10 @@ def get_portfolio_id(request:Request,id:int, db:Session = Depends(get_db), curre
 # Update portfolio
 @router.put("/{id}", response_model=PortfolioResponse)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def update_portfolio(request:Request,id:int, portfolio_data : PortfolioUpdate, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def update_portfolio(request:Request,id:int, portfolio_data : PortfolioUpdate, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
     
     # Fetch the portfolio by its id, then check ownership
-    portfolio_check = portfolio.get_portfolio_by_id(db, id)
+    portfolio_check = await db.run_sync(portfolio.get_portfolio_by_id, id)
 
     if not portfolio_check:
         logger.info(f"portfolio with id: {id} not found.")
@@ -73,7 +73,7 @@ def update_portfolio(request:Request,id:int, portfolio_data : PortfolioUpdate, d
                             detail=f"Acess to portfolio with  id: {id} not authorized")
     
     # Update the portfolio using its id and the data received
-    portfolio_update = portfolio.update_portfolio(db, id, portfolio_data)
+    portfolio_update = await db.run_sync(portfolio.update_portfolio, id, portfolio_data)
     logger.info(f"Portfolio with id {id} successfully updated. ")
 
     return portfolio_update
@@ -82,9 +82,9 @@ def update_portfolio(request:Request,id:int, portfolio_data : PortfolioUpdate, d
 # Delete portfolio
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def delete_portfolio(request:Request,id:int, db:Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def delete_portfolio(request:Request,id:int, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
     # Fetch the portfolio by its id, then check ownership
-    portfolio_check = portfolio.get_portfolio_by_id(db, id)
+    portfolio_check = await db.run_sync(portfolio.get_portfolio_by_id, id)
 
     # Check if the portfolio exists
     if portfolio_check is None:
@@ -98,7 +98,7 @@ def delete_portfolio(request:Request,id:int, db:Session = Depends(get_db), curre
         raise HTTPException(status_code= status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
 
     # Delete the portfolio
-    portfolio.delete_portfolio(db, id)
+    await db.run_sync(portfolio.delete_portfolio, id)
     logger.info(f"Portfolio with id {id} successfully deleted")
 
 
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends
 from ..schemas.user import  UserResponse, UserUpdate
 from ..oauth2 import get_current_user
-from ..database import get_db
-from sqlalchemy.orm import Session
+from ..database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..crud.user import update_user
+from ..services.user_cache import user_cache
 import logging
 # SlowAPI
 from fastapi import Request
@@ -24,7 +25,7 @@ router = APIRouter(tags=['Users'])
 # Return the current user
 @router.get("/me", response_model=UserResponse)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def get_current_user_profile(request:Request,current_user = Depends(get_current_user)):
+async def get_current_user_profile(request:Request,current_user = Depends(get_current_user)):
     logger.info(f"Current user with id {current_user.id} successfully retrieved.")
     return current_user
 
@@ -32,8 +33,10 @@ def get_current_user_profile(request:Request,current_user = Depends(get_current_
 # Update user
 @router.put("/me", response_model=UserResponse)
 @limiter.limit("100/minute", key_func=get_current_user_key)
-def update_user_profile(request:Request,user_data : UserUpdate, db: Session =Depends(get_db), current_user = Depends(get_current_user)):
-    updated_user = update_user(db, current_user.email, user_data)
+async def update_user_profile(request:Request,user_data : UserUpdate, db: AsyncSession = Depends(get_async_db), current_user = Depends(get_current_user)):
+    updated_user = await db.run_sync(update_user, current_user.email, user_data)
+    # The cached user is keyed by email, drop the old and the new one
+    await user_cache.invalidate(current_user.email, updated_user.email)
     logger.info(f"User profile successfully updated for user id {current_user.id}.")
     return updated_user
 
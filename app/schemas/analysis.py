@@ -1,5 +1,6 @@
-from pydantic import BaseModel, ConfigDict
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import datetime, date
+from typing import Annotated
 
 
 class TickerMetricResponse(BaseModel):
@@ -12,6 +13,14 @@ class TickerMetricResponse(BaseModel):
     annualized_volatility : float
     sharpe_ratio : float
     max_drawdown : float
+    historical_var_95 : float | None = None
+    historical_cvar_95 : float | None = None
+    historical_var_99 : float | None = None
+    historical_cvar_99 : float | None = None
+    parametric_var_95 : float | None = None
+    parametric_cvar_95 : float | None = None
+    parametric_var_99 : float | None = None
+    parametric_cvar_99 : float | None = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -26,7 +35,8 @@ class OptimizedAllocationResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
-class AnalysisResponse(BaseModel):
+# Portfolio level fields of an analysis, also the columns of the CSV export
+class AnalysisSummary(BaseModel):
     id : int
     portfolio_id : int
     calculated_at : datetime
@@ -37,7 +47,94 @@ class AnalysisResponse(BaseModel):
     annualized_volatility : float
     sharpe_ratio : float
     max_drawdown : float
+    historical_var_95 : float | None = None
+    historical_cvar_95 : float | None = None
+    historical_var_99 : float | None = None
+    historical_cvar_99 : float | None = None
+    parametric_var_95 : float | None = None
+    parametric_cvar_95 : float | None = None
+    parametric_var_99 : float | None = None
+    parametric_cvar_99 : float | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class AnalysisResponse(AnalysisSummary):
     ticker_metrics : list[TickerMetricResponse]
     optimized_allocations : list[OptimizedAllocationResponse]
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class SkippedPortfolio(BaseModel):
+    portfolio_id : int
+    reason : str
+
+
+class BatchAnalysisResponse(BaseModel):
+    analyses : list[AnalysisResponse]
+    skipped : list[SkippedPortfolio]
+
+
+class AnalysisJobResponse(BaseModel):
+    id : int
+    portfolio_id : int
+    status : str
+    analysis_id : int | None = None
+    error : str | None = None
+    created_at : datetime
+    started_at : datetime | None = None
+    finished_at : datetime | None = None
+    analysis_result : AnalysisResponse | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class FrontierPoint(BaseModel):
+    expected_return : float
+    volatility : float
+    sharpe_ratio : float
+    weights : dict[str, float]
+
+
+class FrontierResponse(BaseModel):
+    portfolio_id : int
+    risk_free_rate : float
+    points : list[FrontierPoint]
+    tangency : FrontierPoint
+    min_volatility : FrontierPoint
+
+
+class SimulationRequest(BaseModel):
+    num_paths : int = Field(10000, ge=100, le=1_000_000)
+    horizon_days : int = Field(252, ge=1, le=2520)
+    seed : int | None = Field(None, ge=0)
+    percentiles : list[Annotated[float, Field(ge=0, le=100)]] = Field([5, 25, 50, 75, 95], min_length=1, max_length=20)
+
+
+class SimulationResponse(BaseModel):
+    portfolio_id : int
+    num_paths : int
+    horizon_days : int
+    seed : int
+    initial_value : float
+    percentiles : dict[str, list[float]]
+    expected_values : list[float]
+    probability_of_loss : float
+
+
+class RollingSeries(BaseModel):
+    volatility : list[float | None]
+    sharpe_ratio : list[float | None]
+    drawdown : list[float | None]
+
+
+class RollingWindow(BaseModel):
+    window : int
+    portfolio : RollingSeries
+    tickers : dict[str, RollingSeries]
+
+
+class RollingResponse(BaseModel):
+    portfolio_id : int
+    dates : list[date]
+    windows : list[RollingWindow]
@@ -21,4 +21,16 @@ class HoldingResponse(BaseModel):
     average_cost : float
     created_at : datetime
 
-    model_config = ConfigDict(from_attributes=True) 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True) 
+
+# Row of an import file that was not imported, row numbers start at 1 (first data row)
+class HoldingImportError(BaseModel):
+    row : int
+    ticker : str | None = None
+    error : str
+
+
+class HoldingImportResponse(BaseModel):
+    imported : int
+    holdings : list[HoldingResponse]
+    errors : list[HoldingImportError]
@@ -20,6 +20,17 @@ class UserResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+# The authenticated user returned by get_current_user, also what the user cache stores
+class CurrentUser(BaseModel):
+    id : int
+    email : str
+    first_name : str | None = None
+    last_name : str | None = None
+    created_at : datetime | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class UserUpdate(BaseModel):
     email : EmailStr | None = None
     first_name : str | None = None
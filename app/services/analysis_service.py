@@ -3,47 +3,100 @@ import numpy as np
 from datetime import datetime, timedelta
 from scipy.optimize import minimize
 import logging
-import requests
-from ..config import settings
 import time
-import yfinance as yf
+import json
+import hashlib
+from .price_store import price_store
+from .market_data import get_market_data_provider, PriceFetchError
+from ..config import settings
+from .metrics import forward_fill, daily_returns, asset_metrics, tail_risk, rolling_metrics
+from .covariance import get_covariance
+from .optimization import solve_min_variance_qp, QPSolveError
+from .executor import run_optimizers
 
 
 # Get a logger instance
 logger = logging.getLogger("app.services.analysis_service")
 
-def fetch_historical_prices(tickers, start_date, end_date):
-    import yfinance as yf
-    frames = {}
+# Read tickers from the local price store and only download the days that are missing.
+# Tickers that need the same window are downloaded together with one batch call to the provider.
+def load_close_prices(tickers, start_date, end_date):
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date).normalize()
+
+    series_by_ticker = {}
+    failures = {}
+    full_downloads = []
+    tail_downloads = {} # tail start -> tickers
+    stored_by_ticker = {}
+    provider = get_market_data_provider()
+
     for ticker in tickers:
-        df = yf.download(ticker, start=start_date, end=end_date, progress=False)
-        if df.empty:
-            logger.error(f"No data returned for {ticker}")
-            raise ValueError(f"No data returned for {ticker}")
-        frames[ticker] = df["Close"].squeeze()
-        logger.info(f"Successfully fetched data for {ticker}")
-    return pd.DataFrame(frames)
-
-'''
+        stored, fetched_from, fetched_through = price_store.load(provider.name, ticker)
+
+        if stored is None or start < fetched_from or fetched_through < start:
+            # Nothing usable stored, download the whole window
+            full_downloads.append(ticker)
+        elif fetched_through < end:
+            # Download the missing tail starting at the last stored day, so the overlap can be compared
+            tail_start = stored.index[-1] if len(stored) else fetched_through
+            tail_downloads.setdefault(tail_start, []).append(ticker)
+            stored_by_ticker[ticker] = (stored, fetched_from)
+        else:
+            series_by_ticker[ticker] = stored
+            logger.info(f"Prices for {ticker} read from the local price store")
+
+    for tail_start, group in tail_downloads.items():
+        tails, tail_failures = provider.get_histories(group, tail_start, end)
+        failures.update(tail_failures)
+        for ticker, tail in tails.items():
+            stored, fetched_from = stored_by_ticker[ticker]
+            overlap = stored.index.intersection(tail.index)
+
+            if len(overlap) and not np.allclose(stored[overlap].to_numpy(), tail[overlap].to_numpy(), rtol=1e-6):
+                # Adjusted closes changed (split or dividend), the stored history is no longer valid
+                logger.info(f"Stored prices for {ticker} were adjusted upstream, downloading full history")
+                full_downloads.append(ticker)
+                continue
+
+            series = pd.concat([stored, tail])
+            series = series[~series.index.duplicated(keep="last")].sort_index()
+            price_store.save(provider.name, ticker, series, fetched_from, end)
+            series_by_ticker[ticker] = series
+            logger.info(f"Downloaded {len(tail.index.difference(stored.index))} new prices for {ticker}")
+
+    if full_downloads:
+        histories, full_failures = provider.get_histories(full_downloads, start, end)
+        failures.update(full_failures)
+        for ticker, series in histories.items():
+            if not series.empty:
+                price_store.save(provider.name, ticker, series, start, end)
+            series_by_ticker[ticker] = series
+            logger.info(f"Downloaded full price history for {ticker}")
+
+    for ticker, series in series_by_ticker.items():
+        series = series[(series.index >= start) & (series.index < end)]
+        if series.empty:
+            failures[ticker] = "No data returned"
+        series_by_ticker[ticker] = series
+
+    return series_by_ticker, failures
+
+
 def fetch_historical_prices(tickers, start_date, end_date):
-    api_key = settings.alpha_vantage_api_key
-    frames = {}
-    for ticker in tickers:
-        url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={ticker}&outputsize=compact&apikey={api_key}"
-        response = requests.get(url)
-        data = response.json()
-        series = data.get("Time Series (Daily)", {})
-        if not series:
-            logger.error(f"Alpha Vantage response for {ticker}: {data}")
-            raise ValueError(f"No data returned for {ticker}: {data}")
-        df_ticker = pd.DataFrame.from_dict(series, orient="index")
-        df_ticker.index = pd.to_datetime(df_ticker.index)
-        df_ticker = df_ticker.sort_index()
-        df_ticker = df_ticker[(df_ticker.index >= pd.Timestamp(start_date)) & (df_ticker.index <= pd.Timestamp(end_date))]
-        frames[ticker] = df_ticker["4. close"].astype(float)
-        time.sleep(1)
-    return pd.DataFrame(frames)
-'''
+    # Holdings can repeat a ticker, every ticker is fetched once
+    unique_tickers = list(dict.fromkeys(tickers))
+    series_by_ticker, failures = load_close_prices(unique_tickers, start_date, end_date)
+
+    # Report every failed ticker at once instead of stopping at the first one
+    if failures:
+        for ticker, reason in failures.items():
+            logger.error(f"Could not fetch prices for {ticker}: {reason}")
+        raise PriceFetchError(failures)
+
+    logger.info(f"Successfully fetched data for {len(unique_tickers)} tickers")
+    return pd.DataFrame({ticker: series_by_ticker[ticker] for ticker in unique_tickers})
+
 
 # Fetches risk free rate from FRED Api
 def get_risk_free_rate():
@@ -52,22 +105,42 @@ def get_risk_free_rate():
     return risk_free_rate
 
 
-# Run analysis
-def run_portfolio_analysis(holdings):
-    # Call the risk free rate function
-    risk_free_rate = get_risk_free_rate()
+# Starting weights for the optimizers built from a previous allocation (ticker -> weight).
+# Tickers that were not in the previous allocation get an equal share, the result is rescaled to sum to 1.
+# Returns None when nothing overlaps, the optimizers then use their default start.
+def warm_start_weights(tickers, previous_weights):
+    if not previous_weights:
+        return None
+    known = [ticker in previous_weights for ticker in tickers]
+    if not any(known):
+        return None
+
+    equal_share = 1 / len(tickers)
+    weights = np.array([max(previous_weights[ticker], 0.0) if is_known else equal_share for ticker, is_known in zip(tickers, known)])
+    if weights.sum() <= 0:
+        return None
+    return weights / weights.sum()
 
-    # Extract tickers from holdings
-    tickers = [holding.ticker for holding in holdings]
-    logger.info("Tickers successfully retrieved.")
 
-    # Fetch price data
+# Fetch one year of prices and return (tickers, price matrix).
+# The matrix is a contiguous (days x assets) float64 array, forward filled, with columns in ticker order.
+def load_price_matrix(tickers, lookback_days=365):
+    _, tickers, price_matrix = load_price_panel(tickers, lookback_days)
+    return tickers, price_matrix
+
+
+# Same as load_price_matrix but also returns the dates of the rows: (dates, tickers, price matrix)
+def load_price_panel(tickers, lookback_days=365):
     end_date = datetime.now()
-    start_date = end_date - timedelta(days=365)
+    start_date = end_date - timedelta(days=lookback_days)
 
     prices = fetch_historical_prices(tickers, start_date, end_date)
     logger.info("Ticker data successfully retrieved.")
+    return price_panel(prices)
+
 
+# (dates, tickers, price matrix) of a frame of close prices with one column per ticker
+def price_panel(prices):
     if prices.empty:
         logger.error("Could not fetch price data for tickers")
         raise ValueError("Could not fetch price data for tickers")
@@ -76,133 +149,408 @@ def run_portfolio_analysis(holdings):
     prices = prices.dropna(how="all")
     logger.info("Missing data prices successfully dropped.")
 
-    # Calculate metrics
+    price_matrix = forward_fill(np.ascontiguousarray(prices.to_numpy(dtype=np.float64)))
+    return prices.index, list(prices.columns), price_matrix
 
-    # Daily returns
-    daily_returns = prices.pct_change().dropna()
 
-    # Cumulative returns
-    cumulative_returns = (1 + daily_returns).cumprod().dropna()
+# Prices, daily returns and annualized covariance of tickers: (tickers, price matrix, returns, covariance)
+# The covariance comes from the shared cache, so portfolios sharing tickers on the same day reuse it
+def load_return_inputs(tickers, lookback_days=365):
+    return return_inputs(*load_price_panel(tickers, lookback_days), lookback_days)
 
-    # Annualized volatility
-    std_daily_returns = daily_returns.std()
-    annualized_volatility = std_daily_returns * np.sqrt(252)
 
-    # Annualized return
-    average_daily_returns = daily_returns.mean()
-    annualized_returns = average_daily_returns * 252
+# Same as load_return_inputs from an already loaded price panel
+def return_inputs(dates, tickers, price_matrix, lookback_days=365):
+    returns = daily_returns(price_matrix)
+    covariance = get_covariance(tickers, dates[0].date(), dates[-1].date(), returns)
+    return tickers, price_matrix, returns, covariance
 
-    # Sharpe Ratio
-    sharpe_ratio = (annualized_returns - risk_free_rate) / annualized_volatility
 
-    # Max Drawdown
-    running_max = cumulative_returns.cummax()
-    drawdown = (running_max - cumulative_returns) / running_max
-    max_drawdown = drawdown.max()
+# Current market value of every ticker in the price matrix (a ticker can be held more than once)
+def ticker_values(holdings, tickers, price_matrix):
+    ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+    positions = np.array([ticker_index[holding.ticker] for holding in holdings])
+    num_shares = np.array([float(holding.num_shares) for holding in holdings])
+    return np.bincount(positions, weights=num_shares * price_matrix[-1][positions], minlength=len(tickers))
 
-    
-    # Covariance matrix
-    covariance = daily_returns.cov() * 252
 
-    # Get last prices for each ticker from the prices DataFrame
-    current_prices = prices.iloc[-1]
+# Deterministic fingerprint of everything an analysis depends on: the holdings, the as-of date of the prices
+# (the date of the last price bar of the loaded panel), the risk free rate and the settings that change the calculations.
+# Two runs with the same fingerprint give the same result, so the stored one can be returned.
+def analysis_fingerprint(holdings, as_of, lookback_days=365):
+    payload = {
+        "holdings": sorted((holding.ticker, float(holding.num_shares), float(holding.average_cost)) for holding in holdings),
+        "as_of": as_of.isoformat(),
+        "risk_free_rate": get_risk_free_rate(),
+        "lookback_days": lookback_days,
+        "market_data_provider": settings.market_data_provider,
+        "covariance_method": settings.covariance_method,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
 
-    # Calculate total cost
-    total_cost = sum(float(holding.num_shares) * float(holding.average_cost) for holding in holdings)
 
-    # Calculate total value
-    total_value = sum(float(holding.num_shares) * float(current_prices[holding.ticker]) for holding in holdings)
+# Per ticker metrics (annualized return, volatility, Sharpe ratio, max drawdown, VaR and CVaR) of every column
+def ticker_statistics(returns, risk_free_rate):
+    return {**asset_metrics(returns, risk_free_rate), **tail_risk(returns)}
 
-    # Calculate unrealized profit/loss
-    unrealized_profit_loss = total_value - total_cost
 
-    # Call the optimizer functions
-    optimized_weights = optimize_sharpe(annualized_returns, covariance, risk_free_rate)
-    min_vol_weights = optimize_min_volatility(annualized_returns, covariance)
+# Run analysis
+# previous_allocations (ticker -> (optimized_weight, min_vol_weight)) warm starts the optimizers
+# panel is the (dates, tickers, price matrix) of load_price_panel when the caller already loaded the prices
+def run_portfolio_analysis(holdings, previous_allocations=None, panel=None):
+    # Call the risk free rate function
+    risk_free_rate = get_risk_free_rate()
+
+    # Extract tickers from holdings and fetch their prices
+    if panel is None:
+        panel = load_price_panel([holding.ticker for holding in holdings])
+    tickers, price_matrix, daily_return_matrix, covariance = return_inputs(*panel)
+    statistics = ticker_statistics(daily_return_matrix, risk_free_rate)
+    return analyze_holdings(holdings, tickers, price_matrix, daily_return_matrix, covariance, statistics, risk_free_rate, previous_allocations)
+
+
+# Analyze every portfolio of a user from one price panel.
+# holdings_by_portfolio maps portfolio id -> holdings, previous_allocations_by_portfolio maps portfolio id -> previous allocations.
+# The union of the tickers is fetched once and its daily returns are computed once, incomplete days included.
+# Every portfolio then takes its own columns and the days on which its own tickers have prices, which are
+# exactly the returns run_portfolio_analysis computes, so a portfolio never depends on the other portfolios.
+# latest_fingerprints maps portfolio id -> fingerprint of its latest stored analysis, a portfolio whose
+# fingerprint (as of the last day of its own prices) has not changed is not analyzed again.
+# With the sample estimator the covariance of the union is estimated once and every portfolio over the same
+# days gets its sub-matrix from the covariance cache. Portfolios are analyzed one after the other on the
+# calling analysis thread, each one runs its two optimizers side by side in the optimizer pool.
+# Returns (portfolio id -> (analysis_data, ticker_metrics, allocations), portfolio id -> PriceFetchError, unchanged portfolio ids)
+# where the second dict holds the portfolios that could not be analyzed because some of their prices are missing.
+# Every analysis_data holds the fingerprint of its portfolio.
+def run_batch_analysis(holdings_by_portfolio, previous_allocations_by_portfolio=None, latest_fingerprints=None, lookback_days=365):
+    previous_allocations_by_portfolio = previous_allocations_by_portfolio or {}
+    latest_fingerprints = latest_fingerprints or {}
+    risk_free_rate = get_risk_free_rate()
+
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=lookback_days)
+    all_tickers = list(dict.fromkeys(holding.ticker for holdings in holdings_by_portfolio.values() for holding in holdings))
+    series_by_ticker, failures = load_close_prices(all_tickers, start_date, end_date)
+    for ticker, reason in failures.items():
+        logger.error(f"Could not fetch prices for {ticker}: {reason}")
+
+    tickers_by_portfolio = {}
+    failed = {}
+    for portfolio_id, holdings in holdings_by_portfolio.items():
+        portfolio_tickers = list(dict.fromkeys(holding.ticker for holding in holdings))
+        portfolio_failures = {ticker: failures[ticker] for ticker in portfolio_tickers if ticker in failures}
+        if portfolio_failures:
+            failed[portfolio_id] = PriceFetchError(portfolio_failures)
+        else:
+            tickers_by_portfolio[portfolio_id] = portfolio_tickers
+
+    results = {}
+    unchanged = []
+    if tickers_by_portfolio:
+        union_tickers = list(dict.fromkeys(ticker for portfolio_tickers in tickers_by_portfolio.values() for ticker in portfolio_tickers))
+        prices = pd.DataFrame({ticker: series_by_ticker[ticker] for ticker in union_tickers}).dropna(how="all")
+        observed = prices.notna().to_numpy()
+        dates, union_tickers, price_matrix = price_panel(prices)
+        ticker_index = {ticker: i for i, ticker in enumerate(union_tickers)}
+
+        # The days of each portfolio's own panel, its last day is the as-of date of the fingerprint
+        to_analyze = {}
+        for portfolio_id, portfolio_tickers in tickers_by_portfolio.items():
+            columns = np.array([ticker_index[ticker] for ticker in portfolio_tickers])
+            days = observed[:, columns].any(axis=1)
+            fingerprint = analysis_fingerprint(holdings_by_portfolio[portfolio_id], dates[days][-1].date(), lookback_days)
+            if latest_fingerprints.get(portfolio_id) == fingerprint:
+                unchanged.append(portfolio_id)
+            else:
+                to_analyze[portfolio_id] = (columns, days, fingerprint)
+
+        # Returns of every union day, a day a ticker has no price yet stays NaN
+        union_returns = price_matrix[1:] / price_matrix[:-1] - 1.0
+        if settings.covariance_method == "sample" and len(to_analyze) > 1:
+            get_covariance(union_tickers, dates[0].date(), dates[-1].date(), daily_returns(price_matrix))
+
+        for portfolio_id, (columns, days, fingerprint) in to_analyze.items():
+            portfolio_tickers = tickers_by_portfolio[portfolio_id]
+            # The complete days of returns of the portfolio's own panel
+            returns = union_returns[days[1:]][:, columns]
+            returns = np.ascontiguousarray(returns[~np.isnan(returns).any(axis=1)])
+            portfolio_dates = dates[days]
+            covariance = get_covariance(portfolio_tickers, portfolio_dates[0].date(), portfolio_dates[-1].date(), returns)
+            analysis_data, ticker_metrics, allocations = analyze_holdings(
+                holdings_by_portfolio[portfolio_id],
+                portfolio_tickers,
+                price_matrix[days][:, columns],
+                returns,
+                covariance,
+                ticker_statistics(returns, risk_free_rate),
+                risk_free_rate,
+                previous_allocations_by_portfolio.get(portfolio_id),
+            )
+            analysis_data["fingerprint"] = fingerprint
+            results[portfolio_id] = (analysis_data, ticker_metrics, allocations)
+
+    logger.info(f"Batch analysis of {len(results)} portfolios with {len(all_tickers)} distinct tickers successfully calculated, {len(unchanged)} unchanged, {len(failed)} skipped.")
+    return results, failed, unchanged
+
+
+# Metrics and optimized allocations of one portfolio from an already loaded price panel.
+# tickers, price_matrix, returns, covariance and statistics (from ticker_statistics) share the same column order.
+def analyze_holdings(holdings, tickers, price_matrix, daily_return_matrix, covariance, statistics, risk_free_rate, previous_allocations=None):
+    ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+    positions = np.array([ticker_index[holding.ticker] for holding in holdings])
+
+    # Calculate metrics
+    annualized_returns = statistics["annualized_return"]
+    annualized_volatility = statistics["annualized_volatility"]
+    sharpe_ratio = statistics["sharpe_ratio"]
+    max_drawdown = statistics["max_drawdown"]
+    ticker_risk = {name: values for name, values in statistics.items() if name.startswith(("historical_", "parametric_"))}
+
+    # Last price of each ticker
+    current_prices = price_matrix[-1]
+
+    # Position values for every holding
+    num_shares = np.array([float(holding.num_shares) for holding in holdings])
+    average_costs = np.array([float(holding.average_cost) for holding in holdings])
+    holding_prices = current_prices[positions]
+    position_values = num_shares * holding_prices
+
+    # Calculate total cost, total value and unrealized profit/loss
+    total_cost = float(np.dot(num_shares, average_costs))
+    total_value = float(position_values.sum())
+    unrealized_profit_loss = total_value - total_cost
+    current_weights = position_values / total_value
+
+    # Value-at-Risk and Expected Shortfall of the current portfolio, from the same daily returns matrix as the tickers
+    ticker_weights = np.bincount(positions, weights=current_weights, minlength=len(tickers))
+    portfolio_returns = daily_return_matrix @ ticker_weights
+    portfolio_risk = tail_risk(portfolio_returns[:, None])
+
+    # Call the optimizer functions, starting from the last stored allocation when there is one
+    previous_allocations = previous_allocations or {}
+    sharpe_start = warm_start_weights(tickers, {ticker: weights[0] for ticker, weights in previous_allocations.items()})
+    min_vol_start = warm_start_weights(tickers, {ticker: weights[1] for ticker, weights in previous_allocations.items()})
+    # Both optimizers run side by side in the optimizer process pool when there is one
+    (optimized_weights, _), (min_vol_weights, _) = run_optimizers([
+        (optimize_sharpe, (annualized_returns, covariance, risk_free_rate, sharpe_start)),
+        (optimize_min_volatility, (annualized_returns, covariance, min_vol_start)),
+    ])
 
     logger.info("Portfolio metrics successfully calculated.")
 
     # Portfolio level metrics (averages)
     analysis_data = {
-        "total_value": float(total_value),
-        "total_cost": float(total_cost),
-        "unrealized_profit_loss": float(unrealized_profit_loss),
+        "total_value": total_value,
+        "total_cost": total_cost,
+        "unrealized_profit_loss": unrealized_profit_loss,
         "annualized_return": float(annualized_returns.mean()),
         "annualized_volatility": float(annualized_volatility.mean()),
         "sharpe_ratio": float(sharpe_ratio.mean()),
-        "max_drawdown": float(max_drawdown.mean())
+        "max_drawdown": float(max_drawdown.mean()),
+        **{name: float(values[0]) for name, values in portfolio_risk.items()}
     }
 
     # Ticker level metrics (individual values)
     ticker_metrics = []
-    for holding in holdings:
-        position_value = float(holding.num_shares) * float(current_prices[holding.ticker])
+    for i, holding in enumerate(holdings):
+        position = positions[i]
         metric = {
             "ticker": holding.ticker,
-            "current_price": float(current_prices[holding.ticker]),
-            "position_value": float(position_value),
-            "weight": float(position_value / total_value),
-            "annualized_return": float(annualized_returns[holding.ticker]),
-            "annualized_volatility": float(annualized_volatility[holding.ticker]),
-            "sharpe_ratio": float(sharpe_ratio[holding.ticker]),
-            "max_drawdown": float(max_drawdown[holding.ticker])
+            "current_price": float(holding_prices[i]),
+            "position_value": float(position_values[i]),
+            "weight": float(current_weights[i]),
+            "annualized_return": float(annualized_returns[position]),
+            "annualized_volatility": float(annualized_volatility[position]),
+            "sharpe_ratio": float(sharpe_ratio[position]),
+            "max_drawdown": float(max_drawdown[position]),
+            **{name: float(values[position]) for name, values in ticker_risk.items()}
         }
         ticker_metrics.append(metric)
 
     allocations = []
     logger.info(f"Holdings count: {len(holdings)}, Optimized weights count: {len(optimized_weights)}")
     for i, holding in enumerate(holdings):
-        position_value = float(holding.num_shares) * float(current_prices[holding.ticker])
         allocation = {
             "ticker": holding.ticker,
-            "current_weight": float(position_value / total_value),
-            "optimized_weight": float(optimized_weights[i]),
-            "min_vol_weight": float(min_vol_weights[i])
+            "current_weight": float(current_weights[i]),
+            "optimized_weight": float(optimized_weights[positions[i]]),
+            "min_vol_weight": float(min_vol_weights[positions[i]])
         }
         allocations.append(allocation)
 
     return analysis_data, ticker_metrics, allocations
 
 
-def optimize_sharpe(annualized_returns, covariance, risk_free_rate):
-    num_assets = len(annualized_returns)
+# Rolling volatility, Sharpe ratio and drawdown of every ticker and of the current portfolio.
+# Returns (dates, tickers, {window: metrics}), the last column of every metric array is the portfolio.
+def run_rolling_analysis(holdings, windows, lookback_days=365):
+    risk_free_rate = get_risk_free_rate()
+    dates, tickers, price_matrix = load_price_panel([holding.ticker for holding in holdings], lookback_days)
 
-    def neg_sharpe(weights):
-        portfolio_return = np.dot(weights, annualized_returns)
-        portfolio_vol = np.sqrt(weights.T @ covariance @ weights)
-        return -(portfolio_return - risk_free_rate) / portfolio_vol
+    values = ticker_values(holdings, tickers, price_matrix)
+    returns = daily_returns(price_matrix)
+    portfolio_returns = returns @ (values / values.sum())
 
-    initial_weights = np.ones(num_assets) / num_assets
+    # Leading gaps are the only NaNs left after the forward fill, a return exists once its start day is complete
+    return_dates = dates[1:][~np.isnan(price_matrix[:-1]).any(axis=1)]
+
+    rolling = rolling_metrics(np.column_stack([returns, portfolio_returns]), windows, risk_free_rate)
+    logger.info(f"Rolling metrics for windows {list(windows)} successfully calculated.")
+    return return_dates, tickers, rolling
+
+
+# Both optimizers return (weights, stats), stats holds the solver, iteration count and solve time for monitoring
+# initial_weights (summing to 1) warm starts the solver, usually the previous optimum
+def optimize_sharpe(annualized_returns, covariance, risk_free_rate, initial_weights=None):
+    annualized_returns = np.asarray(annualized_returns, dtype=np.float64)
+    covariance = np.asarray(covariance, dtype=np.float64)
+    num_assets = len(annualized_returns)
+    excess_returns = annualized_returns - risk_free_rate
+
+    start_time = time.perf_counter()
+
+    # When some asset beats the risk free rate the long-only max Sharpe portfolio is a QP:
+    # minimize y' C y subject to excess' y = 1, y >= 0, then w = y / sum(y)
+    if excess_returns.max() > 0:
+        best_asset = int(np.argmax(excess_returns))
+        fallback = np.zeros(num_assets)
+        fallback[best_asset] = 1 / excess_returns[best_asset]
+        # A warm start is only feasible in the rescaled problem when it beats the risk free rate
+        scaled_start = None
+        if initial_weights is not None and initial_weights @ excess_returns > 0:
+            scaled_start = initial_weights / (initial_weights @ excess_returns)
+        try:
+            scaled_weights, iterations = solve_min_variance_qp(covariance, excess_returns[None, :], np.ones(1), initial_weights=scaled_start, fallback_weights=fallback)
+            stats = {"solver": "active_set", "iterations": iterations, "solve_time_ms": (time.perf_counter() - start_time) * 1000}
+            logger.info(f"Sharpe ratio optimization successful ({stats['iterations']} iterations, {stats['solve_time_ms']:.1f} ms)")
+            return scaled_weights / scaled_weights.sum(), stats
+        except QPSolveError as e:
+            logger.warning(f"Sharpe ratio QP did not converge, falling back to SLSQP: {e}")
+
+    # Negative Sharpe ratio and its gradient:
+    # d/dw -(mu'w - rf) / sigma = -mu / sigma + (mu'w - rf) * C w / sigma^3
+    def neg_sharpe_and_gradient(weights):
+        cov_weights = covariance @ weights
+        portfolio_vol = np.sqrt(weights @ cov_weights)
+        portfolio_excess = weights @ excess_returns
+        value = -portfolio_excess / portfolio_vol
+        gradient = -excess_returns / portfolio_vol + portfolio_excess * cov_weights / portfolio_vol ** 3
+        return value, gradient
+
+    if initial_weights is None:
+        initial_weights = np.ones(num_assets) / num_assets
     bounds = tuple((0, 1) for _ in range(num_assets))
-    constraints = {'type': 'eq', 'fun': lambda w: np.sum(w) - 1}
+    constraints = {'type': 'eq', 'fun': lambda w: np.sum(w) - 1, 'jac': lambda w: np.ones_like(w)}
 
-    result = minimize(neg_sharpe, initial_weights, method='SLSQP', bounds=bounds, constraints=constraints)
+    result = minimize(neg_sharpe_and_gradient, initial_weights, method='SLSQP', jac=True, bounds=bounds, constraints=constraints)
+    stats = {"solver": "slsqp", "iterations": int(result.nit), "solve_time_ms": (time.perf_counter() - start_time) * 1000}
 
     if result.success:
-        logger.info(f"Sharpe ratio optimization successful: {result.message}")
+        logger.info(f"Sharpe ratio optimization successful: {result.message} ({stats['iterations']} iterations, {stats['solve_time_ms']:.1f} ms)")
     else:
         logger.error(f"Sharpe ratio optimization failed: {result.message}")
         raise ValueError(f"Sharpe ratio optimization failed: {result.message}")
 
-    return result.x
+    return result.x, stats
 
 
-def optimize_min_volatility(annualized_returns, covariance):
+# Minimum variance has a quadratic objective, so it is solved exactly with the active-set QP solver
+def optimize_min_volatility(annualized_returns, covariance, initial_weights=None):
     num_assets = len(annualized_returns)
 
-    def portfolio_volatility(weights):
-        return np.sqrt(weights.T @ covariance @ weights)
-
-    initial_weights = np.ones(num_assets) / num_assets
-    bounds = tuple((0, 1) for _ in range(num_assets))
-    constraints = {'type': 'eq', 'fun': lambda w: np.sum(w) - 1}
-
-    result = minimize(portfolio_volatility, initial_weights, method='SLSQP', bounds=bounds, constraints=constraints)
+    start_time = time.perf_counter()
+    try:
+        weights, iterations = solve_min_variance_qp(covariance, np.ones((1, num_assets)), np.ones(1), initial_weights=initial_weights)
+    except QPSolveError as e:
+        logger.error(f"Portfolio volatility optimization failed: {e}")
+        raise ValueError(f"Portfolio volatility optimization failed: {e}")
+    stats = {"solver": "active_set", "iterations": iterations, "solve_time_ms": (time.perf_counter() - start_time) * 1000}
+
+    logger.info(f"Portfolio volatility optimization successful ({stats['iterations']} iterations, {stats['solve_time_ms']:.1f} ms)")
+    return weights, stats
+
+
+# sqrt(w' C w) of every row of weights, rounding can make w' C w slightly negative for a singular covariance
+def portfolio_volatilities(weights, covariance):
+    return np.sqrt(np.maximum(np.einsum("...i,ij,...j->...", weights, covariance, weights), 0.0))
+
+
+# Efficient frontier: num_points minimum variance portfolios for target returns between the
+# minimum volatility portfolio and the highest returning asset.
+# Each point is warm started from its neighbor so the active set only changes a little between
+# solves (every solve still builds its own KKT system on the free assets). A target whose solve does
+# not converge is left out, so the frontier can hold fewer than num_points points.
+# Returns a dict with the weights, expected returns, volatilities and Sharpe ratios of every point
+# plus the tangency (max Sharpe) and minimum volatility portfolios.
+def compute_efficient_frontier(annualized_returns, covariance, risk_free_rate, num_points=25):
+    annualized_returns = np.asarray(annualized_returns, dtype=np.float64)
+    covariance = np.ascontiguousarray(covariance, dtype=np.float64)
+    num_assets = len(annualized_returns)
 
-    if result.success:
-        logger.info(f"Portfolio volatility optimization successful: {result.message}")
-    else:
-        logger.error(f"Portfolio volatility optimization failed: {result.message}")
-        raise ValueError(f"Portfolio volatility optimization failed: {result.message}")
+    start_time = time.perf_counter()
+    total_iterations = 0
+
+    min_vol_weights, min_vol_stats = optimize_min_volatility(annualized_returns, covariance)
+    tangency_weights, tangency_stats = optimize_sharpe(annualized_returns, covariance, risk_free_rate)
+    total_iterations += min_vol_stats["iterations"] + tangency_stats["iterations"]
+
+    best_asset = int(np.argmax(annualized_returns))
+    max_return = annualized_returns[best_asset]
+    targets = np.linspace(min_vol_weights @ annualized_returns, max_return, num_points)
+
+    constraints = np.vstack([np.ones(num_assets), annualized_returns])
+    frontier_weights = [min_vol_weights]
+    weights = min_vol_weights
+
+    for target in targets[1:]:
+        previous_return = weights @ annualized_returns
+        if max_return - previous_return <= 1e-12:
+            # Only the highest returning asset reaches this target
+            weights = np.zeros(num_assets)
+            weights[best_asset] = 1.0
+        else:
+            # Move the neighbor towards the best asset just enough to hit the new target,
+            # which gives a feasible starting point that is already close to the answer
+            theta = min(max((target - previous_return) / (max_return - previous_return), 0.0), 1.0)
+            start = (1 - theta) * weights
+            start[best_asset] += theta
+            try:
+                weights, iterations = solve_min_variance_qp(covariance, constraints, np.array([1.0, target]), initial_weights=start)
+                total_iterations += iterations
+            except QPSolveError as e:
+                # The start is feasible but not minimum variance, it is no frontier point. The next target
+                # starts again from the last point that converged.
+                logger.warning(f"Frontier point for target return {target:.4f} did not converge and is left out: {e}")
+                continue
+        frontier_weights.append(weights)
+
+    frontier_weights = np.array(frontier_weights)
+    expected_returns = frontier_weights @ annualized_returns
+    volatilities = portfolio_volatilities(frontier_weights, covariance)
+
+    tangency_return = tangency_weights @ annualized_returns
+    tangency_volatility = portfolio_volatilities(tangency_weights, covariance)
+    min_vol_return = min_vol_weights @ annualized_returns
+    min_vol_volatility = portfolio_volatilities(min_vol_weights, covariance)
+
+    logger.info(f"Efficient frontier with {len(frontier_weights)} of {num_points} points calculated ({total_iterations} iterations, {(time.perf_counter() - start_time) * 1000:.1f} ms)")
+
+    return {
+        "weights": frontier_weights,
+        "expected_returns": expected_returns,
+        "volatilities": volatilities,
+        "sharpe_ratios": (expected_returns - risk_free_rate) / volatilities,
+        "tangency": {
+            "weights": tangency_weights,
+            "expected_return": tangency_return,
+            "volatility": tangency_volatility,
+            "sharpe_ratio": (tangency_return - risk_free_rate) / tangency_volatility,
+        },
+        "min_volatility": {
+            "weights": min_vol_weights,
+            "expected_return": min_vol_return,
+            "volatility": min_vol_volatility,
+            "sharpe_ratio": (min_vol_return - risk_free_rate) / min_vol_volatility,
+        },
+    }
 
-    return result.x
\ No newline at end of file
@@ -0,0 +1,171 @@
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from ..config import settings
+from .metrics import TRADING_DAYS
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.covariance")
+
+'''
+Covariance service used by the analysis pipeline.
+Estimators (chosen with the COVARIANCE_METHOD setting):
+- sample                -> plain sample covariance (np.cov)
+- ledoit_wolf           -> Ledoit-Wolf shrinkage towards a scaled identity
+- constant_correlation  -> Ledoit-Wolf shrinkage towards a constant correlation matrix
+Shrinkage keeps the matrix well conditioned when there are many tickers for
+few observations, which also makes the optimizers converge faster.
+
+Annualized matrices are kept in an LRU cache keyed by (sorted tickers, first
+and last date of the window, number of return rows, method), so windows that
+are aligned differently never share an entry. With the sample estimator, when
+a portfolio asks for tickers that are all part of a cached superset over the
+same rows, the sub-matrix is sliced out of the superset instead of being
+computed again: every entry of a sample covariance only depends on its two
+columns. The shrinkage estimators depend on all of the columns, a subset is
+always estimated on its own.
+'''
+
+def sample_covariance(returns : np.ndarray) -> np.ndarray:
+    return np.atleast_2d(np.cov(returns, rowvar=False))
+
+
+# Ledoit & Wolf (2004), "A well-conditioned estimator for large-dimensional covariance matrices"
+def ledoit_wolf_covariance(returns : np.ndarray) -> np.ndarray:
+    num_days, num_assets = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T @ centered / num_days
+
+    target_variance = np.trace(sample) / num_assets
+    distance = sample.copy()
+    distance[np.diag_indices(num_assets)] -= target_variance
+    distance_norm = np.einsum("ij,ij->", distance, distance)
+
+    # Sum over days of ||x x' - S||^2 = sum ||x||^4 - T ||S||^2
+    squared_norms = np.einsum("ij,ij->i", centered, centered)
+    spread = (squared_norms @ squared_norms - num_days * np.einsum("ij,ij->", sample, sample)) / num_days ** 2
+    shrinkage = 0.0 if distance_norm == 0 else min(spread, distance_norm) / distance_norm
+
+    covariance = (1 - shrinkage) * sample
+    covariance[np.diag_indices(num_assets)] += shrinkage * target_variance
+    return covariance
+
+
+# Ledoit & Wolf (2003), "Honey, I shrunk the sample covariance matrix"
+def constant_correlation_covariance(returns : np.ndarray) -> np.ndarray:
+    num_days, num_assets = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T @ centered / num_days
+    if num_assets == 1:
+        return sample
+
+    variances = np.diag(sample)
+    std = np.sqrt(variances)
+    correlation = sample / np.outer(std, std)
+    mean_correlation = (correlation.sum() - num_assets) / (num_assets * (num_assets - 1))
+    target = mean_correlation * np.outer(std, std)
+    target[np.diag_indices(num_assets)] = variances
+
+    # Asymptotic variances of the sample entries (pi) and covariances with the target (rho)
+    squared = centered * centered
+    pi_matrix = squared.T @ squared / num_days - sample * sample
+    theta = (squared * centered).T @ centered / num_days - variances[:, None] * sample
+    rho_off = (std[None, :] / std[:, None]) * theta
+    rho_off = rho_off + rho_off.T
+    np.fill_diagonal(rho_off, 0.0)
+    rho = np.trace(pi_matrix) + mean_correlation / 2 * rho_off.sum()
+    gamma = np.einsum("ij,ij->", target - sample, target - sample)
+
+    shrinkage = 0.0 if gamma == 0 else max(0.0, min(1.0, (pi_matrix.sum() - rho) / gamma / num_days))
+    return shrinkage * target + (1 - shrinkage) * sample
+
+
+_estimators = {
+    "sample": sample_covariance,
+    "ledoit_wolf": ledoit_wolf_covariance,
+    "constant_correlation": constant_correlation_covariance,
+}
+
+
+# Annualized covariance of a daily returns matrix with the given estimator
+def estimate_covariance(returns : np.ndarray, method : str = "sample") -> np.ndarray:
+    if method not in _estimators:
+        raise ValueError(f"Unknown covariance method: {method}")
+    return _estimators[method](returns) * TRADING_DAYS
+
+
+
+class CovarianceCache:
+    def __init__(self, max_entries : int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.subset_hits = 0
+        self.misses = 0
+
+
+    # Exact match first, then for the sample estimator any cached superset over the same rows
+    def get(self, tickers, start_date, end_date, num_rows, method):
+        key = (tuple(sorted(tickers)), start_date, end_date, num_rows, method)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                index, covariance = entry
+                positions = [index[ticker] for ticker in tickers]
+                return covariance[np.ix_(positions, positions)]
+
+            if method == "sample":
+                wanted = set(tickers)
+                for other_key, (index, covariance) in reversed(self._entries.items()):
+                    if other_key[1:] == key[1:] and wanted.issubset(index):
+                        self._entries.move_to_end(other_key)
+                        self.subset_hits += 1
+                        positions = [index[ticker] for ticker in tickers]
+                        return covariance[np.ix_(positions, positions)]
+
+            self.misses += 1
+            return None
+
+
+    def put(self, tickers, start_date, end_date, num_rows, method, covariance):
+        key = (tuple(sorted(tickers)), start_date, end_date, num_rows, method)
+        # Cached matrices are shared between requests, nobody may change them in place
+        covariance.setflags(write=False)
+        with self._lock:
+            self._entries[key] = ({ticker: i for i, ticker in enumerate(tickers)}, covariance)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.subset_hits = self.misses = 0
+
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "subset_hits": self.subset_hits, "misses": self.misses}
+
+
+covariance_cache = CovarianceCache(settings.covariance_cache_size)
+
+
+# Annualized covariance for tickers (in the column order of returns), served from the cache when possible.
+# start_date and end_date are the first and last price dates the returns were computed from.
+def get_covariance(tickers, start_date, end_date, returns, method=None):
+    method = method or settings.covariance_method
+    covariance = covariance_cache.get(tickers, start_date, end_date, len(returns), method)
+    if covariance is not None:
+        logger.debug(f"Covariance for {len(tickers)} tickers served from the cache.")
+        return covariance
+
+    covariance = estimate_covariance(returns, method)
+    covariance_cache.put(tickers, start_date, end_date, len(returns), method, covariance)
+    return covariance
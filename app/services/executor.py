@@ -0,0 +1,141 @@
+import asyncio
+import multiprocessing
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ..config import settings
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.executor")
+
+'''
+Dedicated executors for the CPU heavy analysis endpoints.
+The analysis routes are async and hand their work to AnalysisExecutor, a
+thread pool of its own size, so slow price fetches and optimizations never
+take threads away from the cheap CRUD routes running on the default AnyIO
+pool. Admission control keeps at most ANALYSIS_THREADS running plus
+ANALYSIS_QUEUE_SIZE waiting requests, anything above that is rejected
+straight away so the client can retry later.
+The optimizers themselves run in a small process pool, which keeps SciPy and
+NumPy work off the API process. A pool broken by a dead worker is replaced,
+the optimization that hit it runs in the API process instead.
+'''
+
+
+# Raised when the analysis queue is full
+class AnalysisQueueFullError(RuntimeError):
+    pass
+
+
+class AnalysisExecutor:
+    def __init__(self, max_workers : int, max_queue : int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+
+
+    # Run func(*args) on the analysis threads and wait for it without blocking the event loop
+    async def run(self, func, *args):
+        with self._lock:
+            if self.running + self.queued >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise AnalysisQueueFullError(f"Analysis queue is full ({self.max_queue} waiting)")
+            self.queued += 1
+
+        future = self._executor.submit(self._call, func, args)
+        # A request cancelled before its work started never reaches _call, release its queue slot here
+        future.add_done_callback(self._release_if_cancelled)
+        return await asyncio.wrap_future(future)
+
+
+    def _call(self, func, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+
+    def _release_if_cancelled(self, future):
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "queued": self.queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+analysis_executor = AnalysisExecutor(settings.analysis_threads, settings.analysis_queue_size)
+
+
+# Process pool for the optimizers, created on first use (OPTIMIZER_PROCESSES = 0 runs them in process)
+_optimizer_pool = None
+_optimizer_pool_lock = threading.Lock()
+
+
+def get_optimizer_pool() -> ProcessPoolExecutor | None:
+    global _optimizer_pool
+    if settings.optimizer_processes <= 0:
+        return None
+    with _optimizer_pool_lock:
+        if _optimizer_pool is None:
+            _optimizer_pool = ProcessPoolExecutor(max_workers=settings.optimizer_processes, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Optimizer pool started with {settings.optimizer_processes} processes.")
+        return _optimizer_pool
+
+
+# Run func(*args) for every (func, args) call on the optimizer pool and return the results in order.
+# Without a pool, or when the pool is broken, the calls run in this process (a broken pool is dropped
+# so the next call starts a new one).
+def run_optimizers(calls):
+    pool = get_optimizer_pool()
+    if pool is not None:
+        try:
+            futures = [pool.submit(func, *args) for func, args in calls]
+            return [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            logger.warning(f"Optimizer pool is broken, optimizing in process: {e}")
+            _discard_optimizer_pool(pool)
+    return [func(*args) for func, args in calls]
+
+
+def _discard_optimizer_pool(pool):
+    global _optimizer_pool
+    with _optimizer_pool_lock:
+        if _optimizer_pool is pool:
+            _optimizer_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_executors():
+    global _optimizer_pool
+    analysis_executor.shutdown()
+    with _optimizer_pool_lock:
+        if _optimizer_pool is not None:
+            _optimizer_pool.shutdown(wait=False, cancel_futures=True)
+            _optimizer_pool = None
+    logger.info("Analysis executors stopped.")
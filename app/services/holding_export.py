@@ -0,0 +1,111 @@
+import csv
+import io
+import logging
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.holding_export")
+
+'''
+Bulk export of holdings.
+Rows come in batches from a server-side cursor and every batch is turned into
+one chunk of the response body, so memory only depends on the batch size:
+- csv      -> text/csv, header first
+- arrow    -> Arrow IPC stream, one zstd compressed record batch per chunk
+- parquet  -> Parquet file, one zstd compressed row group per chunk
+pyarrow is only imported for the Arrow and Parquet formats.
+'''
+
+EXPORT_COLUMNS = ("id", "portfolio_id", "ticker", "num_shares", "average_cost", "created_at")
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((*row[:-1], row[-1].isoformat()) for row in batch)
+        yield buffer.getvalue()
+
+
+# Write only file object handed to pyarrow, the bytes written so far are taken out after every batch
+class _ChunkSink:
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    # Parquet keeps file offsets in its footer, tell() must count every byte ever written
+    def tell(self):
+        return self._position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()),
+        ("portfolio_id", pa.int64()),
+        ("ticker", pa.string()),
+        ("num_shares", pa.float64()),
+        ("average_cost", pa.float64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+def arrow_chunks(batches, export_format : str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    output = pa.PythonFile(sink, mode="w")
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(output, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(output, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    try:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield sink.drain()
+    finally:
+        # Also writes the end of stream marker or the Parquet footer
+        writer.close()
+    yield sink.drain()
+
+
+# Response body chunks of the holdings in batches, in the given format
+def export_chunks(batches, export_format : str):
+    if export_format == "csv":
+        return csv_chunks(batches)
+    return arrow_chunks(batches, export_format)
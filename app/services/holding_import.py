@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import logging
+from itertools import islice
+from pydantic import ValidationError
+from ..schemas.holding import HoldingCreate
+from .market_data import get_market_data_provider
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.holding_import")
+
+'''
+Bulk import of holdings from an uploaded file.
+CSV files need a header with at least ticker and num_shares (average_cost is
+optional), JSON files hold an array of objects with the same fields.
+CSV rows are read from the upload as a stream and validated in batches. A bad
+row is reported with its row number and never stops the rest of the file.
+Missing average costs are filled with one batched quote request for all of the
+distinct tickers, the rows are then inserted together by the router.
+'''
+
+IMPORT_BATCH_SIZE = 500
+REQUIRED_COLUMNS = {"ticker", "num_shares"}
+
+
+# Raised when the file as a whole cannot be read (bad JSON, missing CSV columns)
+class HoldingImportFileError(ValueError):
+    pass
+
+
+def file_format(filename : str | None, content_type : str | None) -> str:
+    if (content_type or "").startswith("application/json") or (filename or "").lower().endswith(".json"):
+        return "json"
+    return "csv"
+
+
+# (row number, raw row) for every data row of the file
+def iter_import_rows(file, import_format : str):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if import_format == "json":
+            try:
+                rows = json.load(text)
+            except json.JSONDecodeError as e:
+                raise HoldingImportFileError(f"Invalid JSON: {e}") from e
+            if not isinstance(rows, list):
+                raise HoldingImportFileError("JSON import must be an array of holdings")
+            yield from enumerate(rows, start=1)
+            return
+
+        reader = csv.DictReader(text)
+        columns = {column.strip().lower() for column in reader.fieldnames or []}
+        if not REQUIRED_COLUMNS.issubset(columns):
+            raise HoldingImportFileError(f"CSV import needs the columns: {', '.join(sorted(REQUIRED_COLUMNS))}")
+        for row_number, row in enumerate(reader, start=1):
+            # Empty cells are missing values, so an empty average_cost is filled from the quote
+            yield row_number, {key.strip().lower(): (value.strip() or None) if isinstance(value, str) else value
+                               for key, value in row.items() if key is not None}
+    except UnicodeDecodeError as e:
+        raise HoldingImportFileError("Import file must be UTF-8 encoded") from e
+    finally:
+        # The upload stays open, it is closed by FastAPI
+        text.detach()
+
+
+def _validate_batch(batch, holdings, errors):
+    for row_number, row in batch:
+        try:
+            holdings.append((row_number, HoldingCreate.model_validate(row)))
+        except ValidationError as e:
+            ticker = row.get("ticker") if isinstance(row, dict) else None
+            message = "; ".join(f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in e.errors())
+            errors.append({"row": row_number, "ticker": ticker, "error": message})
+
+
+# Validated holdings [(row number, HoldingCreate)] with every average cost filled, and the rows that failed
+def prepare_holdings(file, import_format : str):
+    holdings = []
+    errors = []
+    rows = iter_import_rows(file, import_format)
+    while batch := list(islice(rows, IMPORT_BATCH_SIZE)):
+        _validate_batch(batch, holdings, errors)
+
+    missing_cost = sorted({holding.ticker for _, holding in holdings if holding.average_cost is None})
+    if missing_cost:
+        logger.info(f"Fetching current prices for {len(missing_cost)} tickers without an average cost.")
+        quotes, failures = get_market_data_provider().get_quotes(missing_cost)
+        for ticker, reason in failures.items():
+            logger.error(f"Failed to fetch price for {ticker}: {reason}")
+
+        priced = []
+        for row_number, holding in holdings:
+            if holding.average_cost is None:
+                if holding.ticker not in quotes:
+                    errors.append({"row": row_number, "ticker": holding.ticker, "error": f"Could not fetch price for {holding.ticker}"})
+                    continue
+                holding.average_cost = quotes[holding.ticker]
+            priced.append((row_number, holding))
+        holdings = priced
+
+    errors.sort(key=lambda error: error["row"])
+    return holdings, errors
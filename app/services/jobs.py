@@ -0,0 +1,170 @@
+import multiprocessing
+import threading
+import logging
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ..config import settings
+from ..logger import setup_logging
+from ..database import SessionLocal
+from ..crud import analysis
+from ..crud import holding
+from .analysis_service import run_portfolio_analysis, analysis_fingerprint, load_price_panel
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.jobs")
+
+'''
+Background analysis jobs.
+POST /portfolios/{id}/analyze?async=true stores an AnalysisJob row and hands
+its id to a process pool, the request returns straight away with 202.
+The worker process opens its own database session, runs the same analysis as
+the synchronous route and records the outcome on the job row, which is what
+GET /analysis/jobs/{id} reports. Processes are started with "spawn" so they
+never inherit the API's open connections or threads.
+A job row never stays queued or running for good: a job that cannot be
+submitted, is cancelled or whose worker dies is marked failed, and when the
+API starts it submits the jobs left queued again and fails the jobs that have
+been running for longer than ANALYSIS_JOB_TIMEOUT seconds.
+'''
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_job_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.analysis_job_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            logger.info(f"Analysis job pool started with {settings.analysis_job_workers} workers.")
+        return _pool
+
+
+def shutdown_job_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+            logger.info("Analysis job pool stopped.")
+
+
+# A worker that died breaks the whole pool, drop it so the next job starts a new one
+def _discard_broken_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            logger.warning("Analysis job pool is broken, a new one is started for the next job.")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Workers log to the same files as the API and run the optimizers themselves,
+# a job worker is already a separate process
+def _init_worker():
+    setup_logging()
+    settings.optimizer_processes = 0
+
+
+def submit_analysis_job(job_id : int):
+    try:
+        pool = get_job_pool()
+        future = pool.submit(run_analysis_job, job_id)
+    except Exception as e:
+        logger.error(f"Analysis job with id {job_id} could not be submitted: {e}")
+        if isinstance(e, BrokenProcessPool):
+            _discard_broken_pool(pool)
+        fail_analysis_job(job_id, f"Analysis job could not be started: {e}")
+        return
+    future.add_done_callback(partial(_job_done, job_id, pool))
+
+
+# Runs in the API process when the future of a job is done. execute_analysis_job records its own
+# outcome, so only a job that was cancelled or whose worker raised is left to mark as failed.
+def _job_done(job_id, pool, future):
+    if future.cancelled():
+        error = "Analysis job was cancelled"
+    elif future.exception() is not None:
+        error = f"Analysis job worker failed: {future.exception()}"
+        if isinstance(future.exception(), BrokenProcessPool):
+            _discard_broken_pool(pool)
+    else:
+        return
+    logger.error(f"Analysis job with id {job_id} failed: {error}")
+    fail_analysis_job(job_id, error)
+
+
+# Mark a job failed unless it already finished
+def fail_analysis_job(job_id : int, error : str):
+    db = SessionLocal()
+    try:
+        job = analysis.get_analysis_job(db, job_id)
+        if job is not None and job.status in ("queued", "running"):
+            analysis.update_analysis_job(db, job, "failed", error=error)
+    except Exception as e:
+        logger.error(f"Analysis job with id {job_id} could not be marked as failed: {e}")
+    finally:
+        db.close()
+
+
+# Startup sweep: the pool of a stopped API process took its queued jobs with it, they are submitted again.
+# Jobs running for longer than ANALYSIS_JOB_TIMEOUT lost their worker and are marked failed.
+def recover_analysis_jobs():
+    db = SessionLocal()
+    try:
+        analysis.fail_stale_analysis_jobs(db, settings.analysis_job_timeout, "Analysis job did not finish")
+        queued_job_ids = analysis.get_queued_analysis_job_ids(db)
+    finally:
+        db.close()
+    for job_id in queued_job_ids:
+        submit_analysis_job(job_id)
+    if queued_job_ids:
+        logger.info(f"{len(queued_job_ids)} queued analysis jobs submitted again.")
+
+
+# Entry point inside the worker process
+def run_analysis_job(job_id : int):
+    db = SessionLocal()
+    try:
+        execute_analysis_job(db, job_id)
+    finally:
+        db.close()
+
+
+# Run the analysis of a job with the given session, the job row always ends completed or failed
+def execute_analysis_job(db, job_id : int):
+    # Another worker may have taken the job already
+    if not analysis.start_analysis_job(db, job_id):
+        logger.warning(f"Analysis job with id {job_id} not found or already started.")
+        return
+    job = analysis.get_analysis_job(db, job_id)
+
+    try:
+        holdings = holding.get_holdings(db, job.portfolio_id)
+        if not holdings:
+            raise ValueError("No holdings to analyze")
+
+        # The holdings or the prices may have changed while the job was queued, check the fingerprint again
+        panel = load_price_panel([holding.ticker for holding in holdings])
+        dates, _, _ = panel
+        fingerprint = analysis_fingerprint(holdings, dates[-1].date())
+        latest_analysis = None if job.force else analysis.get_latest_analysis(db, job.portfolio_id)
+        if latest_analysis is not None and latest_analysis.fingerprint == fingerprint:
+            analysis.update_analysis_job(db, job, "completed", analysis_id=latest_analysis.id)
+            return
+
+        previous_allocations = analysis.get_latest_allocations(db, job.portfolio_id)
+        analysis_data, ticker_metrics, allocations = run_portfolio_analysis(holdings, previous_allocations, panel)
+        analysis_data["fingerprint"] = fingerprint
+        new_analysis = analysis.create_analysis_result(db, job.portfolio_id, analysis_data, ticker_metrics, allocations)
+        analysis.update_analysis_job(db, job, "completed", analysis_id=new_analysis.id)
+    except Exception as e:
+        logger.error(f"Analysis job with id {job_id} failed: {e}")
+        db.rollback()
+        analysis.update_analysis_job(db, job, "failed", error=str(e))
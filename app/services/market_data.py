@@ -0,0 +1,249 @@
+import os
+import zlib
+import threading
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
+import requests
+import yfinance as yf
+from ..config import settings
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.market_data")
+
+'''
+Market data providers.
+The analysis service and the holdings router only talk to a MarketDataProvider,
+the provider used is chosen with the MARKET_DATA_PROVIDER setting:
+- yfinance       -> Yahoo Finance (default)
+- alpha_vantage  -> Alpha Vantage REST API
+- synthetic      -> deterministic offline prices, for tests, benchmarks and load tests
+All history methods return daily close prices and treat the end date as exclusive.
+'''
+
+
+# Raised when one or more tickers could not be fetched, failures maps each ticker to the reason
+class PriceFetchError(ValueError):
+    def __init__(self, failures : dict):
+        self.failures = failures
+        super().__init__(f"Could not fetch prices for {', '.join(failures)}")
+
+
+def empty_close_series(ticker):
+    return pd.Series(dtype=np.float64, index=pd.DatetimeIndex([]), name=ticker)
+
+
+# Providers implement get_history and get_quote, a provider missing one of them cannot be created
+class MarketDataProvider(ABC):
+    name = "base"
+
+    # Daily close prices for one ticker
+    @abstractmethod
+    def get_history(self, ticker : str, start_date, end_date) -> pd.Series:
+        ...
+
+    # Latest price for one ticker
+    @abstractmethod
+    def get_quote(self, ticker : str) -> float:
+        ...
+
+
+    # Batch variants, by default they call the single ticker methods on a bounded thread pool.
+    # Both return (results, failures) so one bad ticker never hides the others.
+    def get_histories(self, tickers : list[str], start_date, end_date):
+        return self._run_batch(lambda ticker: self.get_history(ticker, start_date, end_date), tickers)
+
+    def get_quotes(self, tickers : list[str]):
+        return self._run_batch(self.get_quote, tickers)
+
+
+    def _run_batch(self, fetch, tickers):
+        results = {}
+        failures = {}
+        if not tickers:
+            return results, failures
+
+        workers = min(len(tickers), settings.price_fetch_threads)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{self.name}-fetch")
+        futures = {executor.submit(fetch, ticker): ticker for ticker in tickers}
+        # Every ticker gets its own timeout, the batch as a whole waits for the slowest one
+        batches = -(-len(tickers) // workers)
+        done, not_done = wait(futures, timeout=settings.price_fetch_timeout * batches)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        for future, ticker in futures.items():
+            if future in not_done:
+                failures[ticker] = "Timed out"
+                continue
+            try:
+                results[ticker] = future.result()
+            except Exception as e:
+                failures[ticker] = str(e)
+
+        return results, failures
+
+
+
+class YFinanceProvider(MarketDataProvider):
+    name = "yfinance"
+
+    # yf.download keeps its results in module level state, so two downloads must never overlap.
+    # Each call is still a single batched request that fetches its tickers in parallel.
+    _download_lock = threading.Lock()
+
+    def get_history(self, ticker, start_date, end_date):
+        closes, failures = self.get_histories([ticker], start_date, end_date)
+        if failures:
+            raise ValueError(failures[ticker])
+        return closes[ticker]
+
+
+    def get_histories(self, tickers, start_date, end_date):
+        closes = {}
+        failures = {}
+        if not tickers:
+            return closes, failures
+
+        try:
+            with self._download_lock:
+                df = yf.download(
+                    tickers,
+                    start=start_date,
+                    end=end_date,
+                    progress=False,
+                    threads=min(len(tickers), settings.price_fetch_threads),
+                    timeout=settings.price_fetch_timeout, # per ticker request timeout in seconds
+                )
+        except Exception as e:
+            logger.error(f"Price download failed for {len(tickers)} tickers: {e}")
+            return closes, {ticker: f"Download failed: {e}" for ticker in tickers}
+
+        close = df["Close"] if df is not None and not df.empty else pd.DataFrame()
+        if isinstance(close, pd.Series):
+            close = close.to_frame(tickers[0])
+        # yfinance upper cases the ticker columns
+        columns = {str(column).upper(): column for column in close.columns}
+        for ticker in tickers:
+            column = columns.get(ticker.upper())
+            if column is None:
+                closes[ticker] = empty_close_series(ticker)
+            else:
+                closes[ticker] = close[column].dropna().astype(np.float64).rename(ticker)
+        return closes, failures
+
+
+    def get_quote(self, ticker):
+        price = yf.Ticker(ticker).fast_info["last_price"]
+        if not price:
+            raise ValueError(f"No price found for {ticker}")
+        return float(price)
+
+
+
+class AlphaVantageProvider(MarketDataProvider):
+    name = "alpha_vantage"
+    base_url = "https://www.alphavantage.co/query"
+
+    def _query(self, **params):
+        params["apikey"] = settings.alpha_vantage_api_key
+        response = requests.get(self.base_url, params=params, timeout=settings.price_fetch_timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+    def get_history(self, ticker, start_date, end_date):
+        start = pd.Timestamp(start_date).normalize()
+        end = pd.Timestamp(end_date).normalize()
+        # compact only returns the last 100 trading days
+        output_size = "compact" if (pd.Timestamp.today() - start).days < 140 else "full"
+        data = self._query(function="TIME_SERIES_DAILY", symbol=ticker, outputsize=output_size)
+
+        series = data.get("Time Series (Daily)", {})
+        if not series:
+            logger.error(f"Alpha Vantage returned no time series for {ticker}")
+            raise ValueError(f"No data returned for {ticker}")
+
+        df_ticker = pd.DataFrame.from_dict(series, orient="index")
+        df_ticker.index = pd.to_datetime(df_ticker.index)
+        df_ticker = df_ticker.sort_index()
+        df_ticker = df_ticker[(df_ticker.index >= start) & (df_ticker.index < end)]
+        return df_ticker["4. close"].astype(np.float64).rename(ticker)
+
+
+    def get_quote(self, ticker):
+        data = self._query(function="GLOBAL_QUOTE", symbol=ticker)
+        price = data.get("Global Quote", {}).get("05. price")
+        if not price:
+            raise ValueError(f"No price found for {ticker}")
+        return float(price)
+
+
+
+class SyntheticProvider(MarketDataProvider):
+    name = "synthetic"
+    # Every synthetic series starts here, so the same ticker and date always give the same price
+    epoch = pd.Timestamp("2000-01-03")
+
+    def __init__(self, fixture_dir : str | None = None):
+        self.fixture_dir = fixture_dir
+
+
+    # A <TICKER>.csv file with date and close columns in the fixture folder wins over generated prices
+    def _fixture_prices(self, ticker):
+        if not self.fixture_dir:
+            return None
+        path = os.path.join(self.fixture_dir, f"{ticker.upper()}.csv")
+        if not os.path.exists(path):
+            return None
+        df = pd.read_csv(path, parse_dates=["date"], index_col="date").sort_index()
+        return df["close"].astype(np.float64).rename(ticker)
+
+
+    # Geometric brownian motion seeded from the ticker name
+    def _generated_prices(self, ticker, end):
+        dates = pd.bdate_range(self.epoch, max(end, self.epoch + pd.Timedelta(days=1)), inclusive="left")
+        rng = np.random.default_rng(zlib.crc32(ticker.upper().encode()))
+        daily_drift = rng.uniform(-0.05, 0.20) / 252
+        daily_vol = rng.uniform(0.15, 0.45) / np.sqrt(252)
+        start_price = rng.uniform(20, 500)
+        log_returns = rng.normal(daily_drift - 0.5 * daily_vol ** 2, daily_vol, len(dates))
+        return pd.Series(start_price * np.exp(np.cumsum(log_returns)), index=dates, name=ticker)
+
+
+    def get_history(self, ticker, start_date, end_date):
+        start = pd.Timestamp(start_date).normalize()
+        end = pd.Timestamp(end_date).normalize()
+        prices = self._fixture_prices(ticker)
+        if prices is None:
+            prices = self._generated_prices(ticker, end)
+        return prices[(prices.index >= start) & (prices.index < end)]
+
+
+    def get_quote(self, ticker):
+        today = pd.Timestamp.today().normalize()
+        prices = self.get_history(ticker, today - pd.Timedelta(days=10), today)
+        if prices.empty:
+            raise ValueError(f"No price found for {ticker}")
+        return float(prices.iloc[-1])
+
+
+
+# Providers are created once and reused
+_providers = {}
+
+def get_market_data_provider() -> MarketDataProvider:
+    name = settings.market_data_provider
+    if name not in _providers:
+        if name == "yfinance":
+            _providers[name] = YFinanceProvider()
+        elif name == "alpha_vantage":
+            _providers[name] = AlphaVantageProvider()
+        elif name == "synthetic":
+            _providers[name] = SyntheticProvider(settings.market_data_fixture_dir)
+        else:
+            raise ValueError(f"Unknown market data provider: {name}")
+        logger.info(f"Market data provider {name} initialized.")
+    return _providers[name]
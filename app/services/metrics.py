@@ -0,0 +1,157 @@
+import numpy as np
+from scipy.stats import norm
+
+
+'''
+NumPy metrics kernel used by the analysis service.
+Everything works on one contiguous float64 array shaped (days, assets) and
+returns plain arrays indexed by asset position, no DataFrames are created.
+'''
+
+TRADING_DAYS = 252
+
+
+# Carry the last valid price forward inside each column, leading gaps stay NaN
+def forward_fill(prices : np.ndarray) -> np.ndarray:
+    missing = np.isnan(prices)
+    if not missing.any():
+        return prices
+    rows = np.where(missing, 0, np.arange(prices.shape[0])[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return prices[rows, np.arange(prices.shape[1])]
+
+
+# Simple daily returns, days where any asset has no return yet are dropped
+# (same result as DataFrame.pct_change().dropna())
+def daily_returns(prices : np.ndarray) -> np.ndarray:
+    prices = forward_fill(np.asarray(prices, dtype=np.float64))
+    returns = prices[1:] / prices[:-1]
+    returns -= 1.0
+    complete = ~np.isnan(returns).any(axis=1)
+    if not complete.all():
+        returns = returns[complete]
+    return np.ascontiguousarray(returns)
+
+
+# Annualized return, volatility, Sharpe ratio and max drawdown for every column of a returns matrix
+def asset_metrics(returns : np.ndarray, risk_free_rate : float) -> dict:
+    num_days = returns.shape[0]
+
+    # Pass 1: mean and sample standard deviation
+    mean_daily = returns.mean(axis=0)
+    centered = returns - mean_daily
+    std_daily = np.sqrt(np.einsum("ij,ij->j", centered, centered) / (num_days - 1))
+
+    annualized_return = mean_daily * TRADING_DAYS
+    annualized_volatility = std_daily * np.sqrt(TRADING_DAYS)
+    sharpe_ratio = (annualized_return - risk_free_rate) / annualized_volatility
+
+    # Pass 2: max drawdown of the growth of 1 dollar, reusing one buffer
+    growth = np.add(returns, 1.0, out=centered)
+    np.cumprod(growth, axis=0, out=growth)
+    running_max = np.maximum.accumulate(growth, axis=0)
+    np.divide(growth, running_max, out=growth)
+    max_drawdown = 1.0 - growth.min(axis=0)
+
+    return {
+        "annualized_return": annualized_return,
+        "annualized_volatility": annualized_volatility,
+        "sharpe_ratio": sharpe_ratio,
+        "max_drawdown": max_drawdown,
+    }
+
+
+# Annualized covariance matrix, always 2D even for a single asset
+def annualized_covariance(returns : np.ndarray) -> np.ndarray:
+    return np.atleast_2d(np.cov(returns, rowvar=False)) * TRADING_DAYS
+
+
+# Confidence levels for Value-at-Risk and Expected Shortfall (CVaR)
+VAR_CONFIDENCE_LEVELS = (0.95, 0.99)
+
+
+# Daily historical and parametric (normal) VaR and CVaR for every column of a returns matrix.
+# Losses are reported as positive fractions, keys look like historical_var_95 or parametric_cvar_99.
+# The historical quantiles come from one np.partition call for all levels instead of a full sort,
+# the quantile is interpolated like np.quantile and CVaR is the mean of the returns at or below it.
+def tail_risk(returns : np.ndarray, confidence_levels=VAR_CONFIDENCE_LEVELS) -> dict:
+    num_days = returns.shape[0]
+    alphas = 1.0 - np.asarray(confidence_levels, dtype=np.float64)
+    positions = (num_days - 1) * alphas
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, num_days - 1)
+
+    partitioned = np.partition(returns, np.unique(np.concatenate([lower, upper])), axis=0)
+    tail_sums = np.cumsum(partitioned[:upper.max() + 1], axis=0)
+
+    mean_daily = returns.mean(axis=0)
+    std_daily = returns.std(axis=0, ddof=1)
+
+    results = {}
+    for level, alpha, position, low, high in zip(confidence_levels, alphas, positions, lower, upper):
+        suffix = f"{round(level * 100):d}"
+        quantile = partitioned[low] + (position - low) * (partitioned[high] - partitioned[low])
+        z = norm.ppf(alpha)
+        results[f"historical_var_{suffix}"] = -quantile
+        results[f"historical_cvar_{suffix}"] = -tail_sums[low] / (low + 1)
+        results[f"parametric_var_{suffix}"] = -(mean_daily + z * std_daily)
+        results[f"parametric_cvar_{suffix}"] = -(mean_daily - std_daily * norm.pdf(z) / alpha)
+    return results
+
+
+# Maximum over a trailing window for every column in O(n) whatever the window length
+# (van Herk / Gil-Werman: prefix maxima inside fixed blocks plus suffix maxima of the block before).
+# Rows before the first full window hold the running maximum so far.
+def rolling_max(values : np.ndarray, window : int) -> np.ndarray:
+    num_rows, num_columns = values.shape
+    num_blocks = -(-num_rows // window)
+    padded = np.full((num_blocks * window, num_columns), -np.inf)
+    padded[:num_rows] = values
+
+    blocks = padded.reshape(num_blocks, window, num_columns)
+    prefix = np.maximum.accumulate(blocks, axis=1).reshape(-1, num_columns)
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1, num_columns)
+
+    result = prefix[:num_rows].copy()
+    # The window ending at row t starts at t - window + 1, in the previous block unless t closes a block
+    if num_rows > window:
+        np.maximum(suffix[1:num_rows - window + 1], prefix[window:num_rows], out=result[window:])
+    return result
+
+
+# Rolling annualized volatility, Sharpe ratio and drawdown for several windows.
+# Running sums of the (centered) returns and squared returns are built once, every window is then
+# a difference of two rows, so all windows come from the same pass over the data.
+# Drawdown is the drop of the growth of 1 dollar from its highest value inside the window.
+# Returns {window: {"volatility", "sharpe_ratio", "drawdown"}}, arrays are (days x assets)
+# and the first window - 1 rows are NaN.
+def rolling_metrics(returns : np.ndarray, windows, risk_free_rate : float) -> dict:
+    num_days, num_assets = returns.shape
+
+    column_mean = returns.mean(axis=0)
+    centered = returns - column_mean
+    sums = np.zeros((num_days + 1, num_assets))
+    squares = np.zeros((num_days + 1, num_assets))
+    np.cumsum(centered, axis=0, out=sums[1:])
+    np.cumsum(centered * centered, axis=0, out=squares[1:])
+
+    growth = np.cumprod(returns + 1.0, axis=0)
+
+    results = {}
+    for window in windows:
+        window_sum = sums[window:] - sums[:-window]
+        window_mean = window_sum / window
+        variance = (squares[window:] - squares[:-window] - window_sum * window_mean) / (window - 1)
+        np.maximum(variance, 0.0, out=variance)
+
+        volatility = np.full((num_days, num_assets), np.nan)
+        sharpe_ratio = np.full((num_days, num_assets), np.nan)
+        volatility[window - 1:] = np.sqrt(variance * TRADING_DAYS)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sharpe_ratio[window - 1:] = ((window_mean + column_mean) * TRADING_DAYS - risk_free_rate) / volatility[window - 1:]
+
+        drawdown = 1.0 - growth / rolling_max(growth, window)
+        drawdown[:window - 1] = np.nan
+
+        results[window] = {"volatility": volatility, "sharpe_ratio": sharpe_ratio, "drawdown": drawdown}
+    return results
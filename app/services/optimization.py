@@ -0,0 +1,124 @@
+import numpy as np
+import logging
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.optimization")
+
+'''
+Active-set solver for long-only minimum variance problems:
+
+    minimize    w' C w
+    subject to  A w = b
+                w >= 0
+
+It is used for the minimum volatility portfolio (A = ones, b = 1), for the
+maximum Sharpe portfolio (A = excess returns, b = 1, then rescaled) and for
+points on the efficient frontier (an extra row for the target return).
+Phase 1 (only when no feasible starting point is given) repeatedly solves the
+equality constrained problem on the free assets and drops every asset that
+comes out negative, which finds a good active set in a handful of solves.
+Phase 2 is the textbook primal active-set method that makes the result exact.
+'''
+
+
+class QPSolveError(ValueError):
+    pass
+
+
+# Solve the KKT system on the free assets:
+#   C_FF x + A_F' y = top
+#   A_F x         = bottom
+# Falls back to least squares when the system is singular (more assets than observations)
+def _solve_kkt(covariance, A, free, top, bottom):
+    num_free = len(free)
+    num_eq = A.shape[0]
+    A_f = A[:, free]
+
+    kkt = np.zeros((num_free + num_eq, num_free + num_eq))
+    kkt[:num_free, :num_free] = covariance[np.ix_(free, free)]
+    kkt[:num_free, num_free:] = A_f.T
+    kkt[num_free:, :num_free] = A_f
+    rhs = np.concatenate([top, bottom])
+
+    try:
+        solution = np.linalg.solve(kkt, rhs)
+    except np.linalg.LinAlgError:
+        solution = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+    return solution[:num_free], solution[num_free:]
+
+
+# Phase 1: equality constrained solutions on a shrinking set of free assets until all weights are positive
+def _initial_active_set(covariance, A, b, tol):
+    num_assets = covariance.shape[0]
+    free = np.arange(num_assets)
+    iterations = 0
+
+    while True:
+        iterations += 1
+        w_free, _ = _solve_kkt(covariance, A, free, np.zeros(len(free)), b)
+        negative = w_free < -tol
+        if not negative.any() or negative.all():
+            break
+        free = free[~negative]
+
+    weights = np.zeros(num_assets)
+    weights[free] = np.clip(w_free, 0.0, None)
+    return weights, iterations
+
+
+# Returns (weights, iterations). initial_weights must be feasible (A w = b, w >= 0) when given.
+# fallback_weights is a feasible point used when phase 1 cannot find one (defaults to equal weights).
+def solve_min_variance_qp(covariance, A, b, initial_weights=None, fallback_weights=None, tol=1e-10, max_iter=None):
+    covariance = np.asarray(covariance, dtype=np.float64)
+    A = np.atleast_2d(np.asarray(A, dtype=np.float64))
+    b = np.atleast_1d(np.asarray(b, dtype=np.float64))
+    num_assets = covariance.shape[0]
+    max_iter = max_iter or 10 * num_assets + 50
+
+    # A tiny ridge keeps the KKT systems solvable when the covariance is singular
+    ridge = 1e-12 * max(np.trace(covariance) / num_assets, 1e-12)
+    covariance = covariance + ridge * np.eye(num_assets)
+
+    iterations = 0
+    if initial_weights is None:
+        weights, iterations = _initial_active_set(covariance, A, b, tol)
+        # Phase 1 can end on a point that misses the constraints (degenerate cases), use the fallback then
+        if np.abs(A @ weights - b).max() > 1e-8:
+            weights = np.ones(num_assets) / num_assets if fallback_weights is None else np.asarray(fallback_weights, dtype=np.float64).copy()
+    else:
+        weights = np.asarray(initial_weights, dtype=np.float64).copy()
+
+    active = weights <= tol
+    weights[active] = 0.0
+
+    # Phase 2: primal active-set iterations
+    while iterations < max_iter:
+        iterations += 1
+        free = np.flatnonzero(~active)
+        gradient = covariance @ weights
+        step, y = _solve_kkt(covariance, A, free, -gradient[free], np.zeros(A.shape[0]))
+
+        if np.abs(step).max(initial=0.0) <= tol:
+            # Multipliers of the active bounds, all of them must be non negative at the optimum
+            bound_multipliers = gradient + A.T @ y
+            bound_multipliers[~active] = np.inf
+            release = int(np.argmin(bound_multipliers))
+            if bound_multipliers[release] >= -tol:
+                return weights, iterations
+            active[release] = False
+            continue
+
+        # Longest step that keeps every free weight non negative
+        shrinking = step < 0
+        ratios = np.full(len(free), np.inf)
+        ratios[shrinking] = -weights[free[shrinking]] / step[shrinking]
+        blocking = int(np.argmin(ratios))
+        alpha = min(1.0, ratios[blocking])
+
+        weights[free] += alpha * step
+        if alpha < 1.0:
+            active[free[blocking]] = True
+            weights[free[blocking]] = 0.0
+
+    raise QPSolveError(f"Active-set solver did not converge in {max_iter} iterations")
@@ -0,0 +1,78 @@
+import os
+import re
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from ..config import settings
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.price_store")
+
+'''
+Local on-disk store for daily close prices.
+Every ticker gets its own .npz file with two columns (dates, closes) plus the
+date range that was already requested from the market data source, so
+fetch_historical_prices only has to download the days that are missing.
+Files live in one folder per market data provider (<directory>/<provider>/),
+providers disagree on adjusted closes and switching MARKET_DATA_PROVIDER must
+never serve the history downloaded from another one.
+'''
+
+
+class PriceStore:
+    def __init__(self, directory : str):
+        self.directory = directory
+
+
+    # Ticker symbols like "BRK.B" or "^GSPC" are turned into safe file names
+    def _path(self, provider : str, ticker : str):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", ticker.upper())
+        return os.path.join(self.directory, provider, f"{safe_name}.npz")
+
+
+    # Returns (close series, fetched_from, fetched_through) or (None, None, None) if the provider has not stored the ticker
+    # fetched_through is exclusive, the same way yfinance treats the end date
+    def load(self, provider : str, ticker : str):
+        path = self._path(provider, ticker)
+        if not os.path.exists(path):
+            return None, None, None
+
+        try:
+            with np.load(path) as data:
+                series = pd.Series(data["closes"], index=pd.DatetimeIndex(data["dates"]), name=ticker)
+                fetched_from = pd.Timestamp(data["fetched_from"][()])
+                fetched_through = pd.Timestamp(data["fetched_through"][()])
+        except Exception as e:
+            logger.warning(f"Stored prices for {ticker} could not be read, ignoring them: {e}")
+            return None, None, None
+
+        return series, fetched_from, fetched_through
+
+
+    def save(self, provider : str, ticker : str, series : pd.Series, fetched_from : pd.Timestamp, fetched_through : pd.Timestamp):
+        path = self._path(provider, ticker)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first then swap it in, so readers never see a half written file
+            with open(temp_path, "wb") as f:
+                np.savez(
+                    f,
+                    dates=series.index.values.astype("datetime64[D]"),
+                    closes=series.to_numpy(dtype=np.float64),
+                    fetched_from=np.datetime64(fetched_from.date(), "D"),
+                    fetched_through=np.datetime64(fetched_through.date(), "D"),
+                )
+            os.replace(temp_path, path)
+            logger.debug(f"Stored {len(series)} prices for {ticker}.")
+        except OSError as e:
+            # The store is only an optimization, a failed write should never fail the analysis
+            logger.warning(f"Prices for {ticker} could not be stored: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+price_store = PriceStore(settings.price_store_dir)
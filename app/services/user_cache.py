@@ -0,0 +1,154 @@
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+import redis
+import redis.asyncio as aioredis
+from ..config import settings
+from ..schemas.user import CurrentUser
+
+
+# Get a logger instance
+logger = logging.getLogger("app.services.user_cache")
+
+'''
+Cache of authenticated users for get_current_user.
+Every authenticated request used to load its user by the token subject (the
+email), the same row over and over. Users are now kept for USER_CACHE_TTL
+seconds, keyed by email:
+- memory  -> bounded LRU per process, invalidation only reaches this process
+- redis   -> shared by all workers, so an update is seen everywhere
+The profile update route invalidates the entries it changes, the TTL bounds
+how long another process can still see an old entry with the memory backend.
+get, put and invalidate are coroutines: the Redis backend uses the asyncio
+client so a lookup never blocks the event loop. A Redis error never fails a
+request, the user is then read from the database.
+'''
+
+KEY_PREFIX = "user_cache:"
+
+
+class UserCache:
+    # redis_factory creates a redis.asyncio client, None keeps the users in memory
+    def __init__(self, ttl : int, max_entries : int, redis_factory=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis_factory = redis_factory
+        self._redis = None
+        self._redis_loop = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    async def get(self, email : str) -> CurrentUser | None:
+        if self.ttl <= 0:
+            return None
+        user = await self._redis_get(email) if self.redis_factory is not None else self._memory_get(email)
+        with self._lock:
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return user
+
+
+    async def put(self, user : CurrentUser):
+        if self.ttl <= 0:
+            return
+        if self.redis_factory is not None:
+            try:
+                await self._redis_client().set(KEY_PREFIX + user.email, user.model_dump_json(), ex=self.ttl)
+            except redis.RedisError as e:
+                logger.warning(f"User cache write failed: {e}")
+            return
+        with self._lock:
+            self._entries[user.email] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    async def invalidate(self, *emails : str):
+        if self.redis_factory is not None:
+            try:
+                await self._redis_client().delete(*(KEY_PREFIX + email for email in emails))
+            except redis.RedisError as e:
+                logger.warning(f"User cache invalidation failed: {e}")
+        with self._lock:
+            for email in emails:
+                self._entries.pop(email, None)
+
+
+    def _memory_get(self, email):
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[email]
+                return None
+            self._entries.move_to_end(email)
+            return entry[1]
+
+
+    async def _redis_get(self, email):
+        try:
+            cached = await self._redis_client().get(KEY_PREFIX + email)
+        except redis.RedisError as e:
+            logger.warning(f"User cache read failed: {e}")
+            return None
+        return None if cached is None else CurrentUser.model_validate_json(cached)
+
+
+    # asyncio connections belong to the event loop that opened them, every loop gets its own client
+    # (one per worker in production, a client of a closed loop is simply dropped)
+    def _redis_client(self):
+        loop = asyncio.get_running_loop()
+        if self._redis_loop is not loop:
+            self._redis = self.redis_factory()
+            self._redis_loop = loop
+        return self._redis
+
+
+    async def close(self):
+        if self._redis is not None and self._redis_loop is asyncio.get_running_loop():
+            await self._redis.aclose()
+        self._redis = self._redis_loop = None
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+    # Entries are only counted for the memory backend, Redis expires its keys on its own
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "backend": "redis" if self.redis_factory is not None else "memory",
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+            if self.redis_factory is None:
+                stats.update({"entries": len(self._entries), "max_entries": self.max_entries})
+            return stats
+
+
+def create_user_cache() -> UserCache:
+    redis_factory = None
+    if settings.user_cache_backend == "redis":
+        # Short timeouts, a slow Redis must not hold up authentication
+        redis_factory = lambda: aioredis.Redis(host=settings.redis_host, port=int(settings.redis_port), socket_timeout=0.25, socket_connect_timeout=0.25)
+    elif settings.user_cache_backend != "memory":
+        raise ValueError(f"Unknown user cache backend: {settings.user_cache_backend}")
+    return UserCache(settings.user_cache_ttl, settings.user_cache_size, redis_factory)
+
+
+user_cache = create_user_cache()
@@ -3,7 +3,7 @@
 
 from app.main import app
 from fastapi.testclient import TestClient
-from app.database import Base, get_db
+from app.database import Base, get_db, get_async_db, get_session_factory
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine 
 from sqlalchemy.orm import sessionmaker
@@ -12,8 +12,12 @@ import pytest
 from app.crud.user import create_user
 from app.schemas.user import UserCreate
 from app.oauth2 import create_access_token
+from app.services.price_store import price_store
+from app.services.covariance import covariance_cache
+from app.services.user_cache import user_cache
 # Import to test analysis
 from unittest.mock import patch
+from contextlib import nullcontext
 import pandas as pd
 import numpy as np
 
@@ -42,14 +46,58 @@ def db_session():
 
 
 
-# Client fixture
-# This is a basic test client with no authentication - use in endpoints that require no login
-@pytest.fixture
-def client(db_session):
+# Point the local price store at a temporary folder so every test starts without stored prices
+@pytest.fixture(autouse=True)
+def temp_price_store(tmp_path):
+    original_directory = price_store.directory
+    price_store.directory = str(tmp_path / "prices")
+    yield price_store
+    price_store.directory = original_directory
+
+
+# Mocked prices change from test to test, never reuse a covariance matrix from another test
+@pytest.fixture(autouse=True)
+def clear_covariance_cache():
+    covariance_cache.clear()
+    yield covariance_cache
+
+
+# Users are created again in every test (with new ids), never serve one from an earlier test
+@pytest.fixture(autouse=True)
+def clear_user_cache():
+    user_cache.clear()
+    yield user_cache
+
+
+
+# The async routes call the CRUD functions with AsyncSession.run_sync, in tests they run on the
+# test session itself so the sync and async routes share one transaction that is rolled back
+class SharedAsyncSession:
+    def __init__(self, session):
+        self.sync_session = session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return fn(self.sync_session, *args, **kwargs)
+
+
+def override_database(db_session):
     def override_get_db():
         yield db_session
 
+    async def override_get_async_db():
+        yield SharedAsyncSession(db_session)
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    # Streamed bodies read from the test session too, it stays open after the stream
+    app.dependency_overrides[get_session_factory] = lambda: lambda: nullcontext(db_session)
+
+
+# Client fixture
+# This is a basic test client with no authentication - use in endpoints that require no login
+@pytest.fixture
+def client(db_session):
+    override_database(db_session)
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -71,9 +119,7 @@ def test_creating_user(db_session):
 def authenticated_client(db_session, test_creating_user):
     user_token = create_access_token({"sub": test_creating_user.email})
 
-    def override_get_db():
-        yield db_session
-    app.dependency_overrides[get_db] = override_get_db
+    override_database(db_session)
 
     client = TestClient(app, headers={"Authorization": f"Bearer {user_token}"})
 
@@ -98,9 +144,7 @@ def test_creating_user_2(db_session):
 def authenticated_client_2(db_session, test_creating_user_2):
     user_token = create_access_token({"sub": test_creating_user_2.email})
 
-    def override_get_db():
-        yield db_session
-    app.dependency_overrides[get_db] = override_get_db
+    override_database(db_session)
 
     client = TestClient(app, headers={"Authorization": f"Bearer {user_token}"})
 
@@ -116,10 +160,11 @@ def authenticated_client_2(db_session, test_creating_user_2):
 @pytest.fixture
 def run_analysis(authenticated_client):
     # Create fake data
-    dates = pd.date_range("2024-01-01", periods=252)  # 252 trading days
+    # The dates end yesterday so they fall inside the one year window the analysis asks for
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize() - pd.Timedelta(days=1), periods=252)  # 252 trading days
     fake_data = pd.DataFrame({
-    ("Adj Close", "AAPL"): np.random.uniform(150, 160, 252),
-    ("Adj Close", "GOOGL"): np.random.uniform(100, 110, 252)
+    ("Close", "AAPL"): np.random.uniform(150, 160, 252),
+    ("Close", "GOOGL"): np.random.uniform(100, 110, 252)
 })
     fake_data.index = dates
     fake_data.columns = pd.MultiIndex.from_tuples(fake_data.columns)
@@ -148,7 +193,7 @@ def run_analysis(authenticated_client):
 
 
     # Mock yf.download to return your fake data
-    with patch("app.services.analysis_service.yf.download") as mock_download:
+    with patch("app.services.market_data.yf.download") as mock_download:
         mock_download.return_value = fake_data
         response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze") # analyze here referst to the endpoint creating an analysis
 
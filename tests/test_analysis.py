@@ -3,6 +3,22 @@
 # run auth test: python -m pytest tests/test_analysis.py
 
 # We will use "Mocking" to replace a API call with fake data
+from unittest.mock import patch, MagicMock
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from sqlalchemy.sql import func
+import pytest
+import csv
+import io
+import json
+from app.crud import analysis
+import pandas as pd
+from app.config import settings
+from app.services import jobs, analysis_service
+from app.services.jobs import execute_analysis_job
+from app.models.analysis import AnalysisJob
+from app.services.market_data import SyntheticProvider, MarketDataProvider, empty_close_series
 
 # Create a test to test run analysis
 # pass the run_analysis fixture as the argument
@@ -17,9 +33,437 @@ def test_get_latest_analysis(run_analysis, authenticated_client):
     response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis") # analysis endpoint here refers to retrieving an analysis
     assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
 
+    # Value-at-Risk is stored with the other metrics, CVaR is never below VaR
+    latest = response.json()
+    for result in [latest, *latest["ticker_metrics"]]:
+        assert result["historical_cvar_95"] >= result["historical_var_95"]
+        assert result["parametric_cvar_99"] >= result["parametric_var_99"] > result["parametric_var_95"]
+
 
 # Create a test to list all the analysis history
 def test_get_analysis_history(run_analysis, authenticated_client):
     portfolio_id = run_analysis
     response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/history")
-    assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
\ No newline at end of file
+    assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+
+
+# Create a test to make sure a second analysis reads the prices from the local price store
+def test_analysis_reuses_price_store(run_analysis, authenticated_client):
+    portfolio_id = run_analysis
+    with patch("app.services.market_data.yf.download") as mock_download:
+        response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze?force=true")
+        assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+        assert not mock_download.called, "Expected the prices to come from the price store"
+
+
+# Create a test to make sure the price store never serves the history of another provider
+def test_price_store_is_kept_per_provider(run_analysis, authenticated_client, monkeypatch):
+    portfolio_id = run_analysis
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    with patch("app.services.market_data.SyntheticProvider.get_history", autospec=True, side_effect=SyntheticProvider.get_history) as mock_history:
+        response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze?force=true")
+        assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+    assert mock_history.called, "Expected the synthetic provider to download its own prices"
+
+
+# Create a test to make sure a provider missing one of the provider methods cannot be created
+def test_incomplete_provider_is_rejected():
+    class HistoryOnlyProvider(MarketDataProvider):
+        def get_history(self, ticker, start_date, end_date):
+            return empty_close_series(ticker)
+
+    with pytest.raises(TypeError):
+        HistoryOnlyProvider()
+
+
+# Create a test to make sure an unchanged portfolio returns the stored analysis
+def test_unchanged_analysis_is_reused(run_analysis, authenticated_client):
+    portfolio_id = run_analysis
+    first = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis").json()
+
+    with patch("app.services.market_data.yf.download") as mock_download:
+        response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+        assert response.json()["id"] == first["id"]
+        assert not mock_download.called
+
+    # Changing the holdings changes the fingerprint
+    authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": "AAPL", "num_shares": 1, "average_cost": 100})
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+    assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+    assert response.json()["id"] != first["id"]
+
+
+# Create a test to make sure the fingerprint is as of the last price bar and not of the day the analysis runs
+def test_unchanged_analysis_across_midnight(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    portfolio_id = authenticated_client.post("/portfolios", json={"name": "Midnight Portfolio"}).json()["id"]
+    for ticker in ["AAA", "BBB"]:
+        authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 10, "average_cost": 50})
+
+    clock = {"now": datetime(2026, 10, 17, 23, 50)} # Saturday, the last bar is Friday's
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock["now"]
+    monkeypatch.setattr(analysis_service, "datetime", FrozenDatetime)
+
+    first = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+    assert first.status_code == 201, f"Expected 201, got {first.status_code} : {first.json()}"
+
+    # Sunday: the date changed but there is no new price bar
+    clock["now"] = datetime(2026, 10, 18, 0, 10)
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+    assert response.json()["id"] == first.json()["id"]
+
+    # Tuesday: Monday's bar is in, the analysis runs again
+    clock["now"] = datetime(2026, 10, 20, 0, 10)
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+    assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+
+
+# Create a test to make sure every ticker without price data is reported
+def test_run_analysis_reports_failed_tickers(authenticated_client):
+    create_response = authenticated_client.post("/portfolios", json={"name": "Bad Tickers"})
+    portfolio_id = create_response.json()["id"]
+    for ticker in ["NOTREAL1", "NOTREAL2"]:
+        authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 1, "average_cost": 10})
+
+    with patch("app.services.market_data.yf.download") as mock_download:
+        mock_download.return_value = pd.DataFrame()
+        response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+
+    assert response.status_code == 503, f"Expected 503, got {response.status_code} : {response.json()}"
+    assert set(response.json()["detail"]["failures"]) == {"NOTREAL1", "NOTREAL2"}
+
+
+# Create a test to run an analysis fully offline with the synthetic market data provider
+def test_run_analysis_synthetic_provider(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    create_response = authenticated_client.post("/portfolios", json={"name": "Offline Portfolio"})
+    portfolio_id = create_response.json()["id"]
+    for ticker in ["AAA", "BBB", "CCC"]:
+        authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 10, "average_cost": 50})
+
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+    assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+    assert len(response.json()["ticker_metrics"]) == 3
+
+
+# Create a test to get the efficient frontier of a portfolio
+def test_get_efficient_frontier(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    create_response = authenticated_client.post("/portfolios", json={"name": "Frontier Portfolio"})
+    portfolio_id = create_response.json()["id"]
+    for ticker in ["AAA", "BBB", "CCC", "DDD"]:
+        authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 10, "average_cost": 50})
+
+    response = authenticated_client.get(f"/portfolios/{portfolio_id}/frontier?points=15")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+
+    frontier = response.json()
+    assert len(frontier["points"]) == 15
+    volatilities = [point["volatility"] for point in frontier["points"]]
+    assert volatilities[0] == min(volatilities)
+    assert abs(sum(frontier["tangency"]["weights"].values()) - 1) < 1e-6
+
+
+# Create a test for the Monte Carlo simulation, the same seed must give the same bands
+def test_simulate_portfolio(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    create_response = authenticated_client.post("/portfolios", json={"name": "Simulation Portfolio"})
+    portfolio_id = create_response.json()["id"]
+    for ticker in ["AAA", "BBB", "CCC"]:
+        authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 10, "average_cost": 50})
+
+    body = {"num_paths": 2000, "horizon_days": 63, "seed": 42, "percentiles": [5, 50, 95]}
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/simulate", json=body)
+    assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+
+    simulation = response.json()
+    assert simulation["seed"] == 42
+    assert set(simulation["percentiles"]) == {"5", "50", "95"}
+    assert all(len(values) == 63 for values in simulation["percentiles"].values())
+    assert simulation["percentiles"]["5"][-1] < simulation["percentiles"]["50"][-1] < simulation["percentiles"]["95"][-1]
+    assert 0 <= simulation["probability_of_loss"] <= 1
+
+    repeat = authenticated_client.post(f"/portfolios/{portfolio_id}/simulate", json=body)
+    assert repeat.json()["percentiles"] == simulation["percentiles"]
+
+
+# Create a test for the rolling metrics series
+def test_get_rolling_analysis(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    create_response = authenticated_client.post("/portfolios", json={"name": "Rolling Portfolio"})
+    portfolio_id = create_response.json()["id"]
+    for ticker in ["AAA", "BBB"]:
+        authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 10, "average_cost": 50})
+
+    response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/rolling?windows=21,63")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+
+    rolling = response.json()
+    assert [window["window"] for window in rolling["windows"]] == [21, 63]
+    for window in rolling["windows"]:
+        assert set(window["tickers"]) == {"AAA", "BBB"}
+        assert len(window["portfolio"]["volatility"]) == len(rolling["dates"])
+        assert all(0 <= value < 1 for value in window["portfolio"]["drawdown"])
+
+    invalid = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/rolling?windows=1")
+    assert invalid.status_code == 422
+
+
+# Create a test to make sure a second portfolio with the same tickers reuses the cached covariance
+def test_shared_covariance_cache(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    for name in ["First Portfolio", "Second Portfolio"]:
+        portfolio_id = authenticated_client.post("/portfolios", json={"name": name}).json()["id"]
+        for ticker in ["AAA", "BBB"]:
+            authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 5, "average_cost": 40})
+        response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+        assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+
+    metrics = authenticated_client.get("/metrics").json()
+    assert metrics["covariance_cache"]["hits"] == 1
+
+
+# Create a test for async analysis jobs, the worker pool is replaced by running the job in the test session
+def test_run_analysis_async_job(authenticated_client, db_session, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    portfolio_id = authenticated_client.post("/portfolios", json={"name": "Async Portfolio"}).json()["id"]
+    authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": "AAA", "num_shares": 10, "average_cost": 50})
+    authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": "BBB", "num_shares": 5, "average_cost": 80})
+
+    with patch("app.routers.analysis.submit_analysis_job") as mock_submit:
+        response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze?async=true")
+    assert response.status_code == 202, f"Expected 202, got {response.status_code} : {response.json()}"
+    job = response.json()
+    assert job["status"] == "queued"
+    mock_submit.assert_called_once_with(job["id"])
+
+    execute_analysis_job(db_session, job["id"])
+
+    response = authenticated_client.get(f"/analysis/jobs/{job['id']}")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+    job = response.json()
+    assert job["status"] == "completed"
+    assert job["analysis_result"]["portfolio_id"] == portfolio_id
+
+
+# Create a test to make sure a job can only be read by its owner
+def test_get_analysis_job_not_authorized(authenticated_client, authenticated_client_2, monkeypatch):
+    portfolio_id = authenticated_client.post("/portfolios", json={"name": "Private Portfolio"}).json()["id"]
+    authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": "AAA", "num_shares": 10, "average_cost": 50})
+
+    with patch("app.routers.analysis.submit_analysis_job"):
+        job_id = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze?async=true").json()["id"]
+
+    response = authenticated_client_2.get(f"/analysis/jobs/{job_id}")
+    assert response.status_code == 403, f"Expected 403, got {response.status_code} : {response.json()}"
+
+
+# The job helpers open their own sessions, they get the test session instead
+@pytest.fixture
+def job_session(db_session, monkeypatch):
+    monkeypatch.setattr(jobs, "SessionLocal", lambda: db_session)
+    monkeypatch.setattr(db_session, "close", lambda: None)
+    return db_session
+
+
+def queue_analysis_job(authenticated_client):
+    portfolio_id = authenticated_client.post("/portfolios", json={"name": "Queued Portfolio"}).json()["id"]
+    authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": "AAA", "num_shares": 10, "average_cost": 50})
+    with patch("app.routers.analysis.submit_analysis_job"):
+        return authenticated_client.post(f"/portfolios/{portfolio_id}/analyze?async=true").json()["id"]
+
+
+# Create a test to make sure a job whose worker dies, or that cannot be submitted, ends failed
+def test_analysis_job_worker_failure(authenticated_client, job_session, monkeypatch):
+    job_ids = [queue_analysis_job(authenticated_client) for _ in range(2)]
+
+    # The worker process died: the job fails and the broken pool is dropped
+    broken_pool = MagicMock()
+    worker_future = Future()
+    broken_pool.submit.return_value = worker_future
+    monkeypatch.setattr(jobs, "_pool", broken_pool)
+    jobs.submit_analysis_job(job_ids[0])
+    worker_future.set_exception(BrokenProcessPool("A worker process terminated abruptly"))
+    assert jobs._pool is None
+
+    # The pool does not accept the job at all
+    monkeypatch.setattr(jobs, "_pool", MagicMock(**{"submit.side_effect": RuntimeError("cannot schedule new futures after shutdown")}))
+    jobs.submit_analysis_job(job_ids[1])
+
+    for job_id in job_ids:
+        job = authenticated_client.get(f"/analysis/jobs/{job_id}").json()
+        assert job["status"] == "failed"
+        assert job["error"]
+
+
+# Create a test for the startup sweep of jobs left behind by a stopped process
+def test_recover_analysis_jobs(authenticated_client, job_session):
+    queued_id, stale_id, running_id = [queue_analysis_job(authenticated_client) for _ in range(3)]
+    job_session.query(AnalysisJob).filter(AnalysisJob.id == stale_id).update(
+        {AnalysisJob.status: "running", AnalysisJob.started_at: func.now() - timedelta(hours=2)}, synchronize_session=False)
+    job_session.query(AnalysisJob).filter(AnalysisJob.id == running_id).update(
+        {AnalysisJob.status: "running", AnalysisJob.started_at: func.now()}, synchronize_session=False)
+    job_session.commit()
+
+    with patch("app.services.jobs.submit_analysis_job") as mock_submit:
+        jobs.recover_analysis_jobs()
+    mock_submit.assert_called_once_with(queued_id)
+    assert authenticated_client.get(f"/analysis/jobs/{stale_id}").json()["status"] == "failed"
+    assert authenticated_client.get(f"/analysis/jobs/{running_id}").json()["status"] == "running"
+
+    # A job already taken by another worker is not run twice
+    analysis.start_analysis_job(job_session, queued_id)
+    with patch("app.services.jobs.run_portfolio_analysis") as mock_analysis:
+        execute_analysis_job(job_session, queued_id)
+    mock_analysis.assert_not_called()
+
+
+# Create a test to analyze all the portfolios of a user at once
+def test_run_analysis_all(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    portfolio_ids = []
+    for name, tickers in [("Tech", ["AAA", "BBB"]), ("Mixed", ["BBB", "CCC"])]:
+        portfolio_id = authenticated_client.post("/portfolios", json={"name": name}).json()["id"]
+        for ticker in tickers:
+            authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 10, "average_cost": 50})
+        portfolio_ids.append(portfolio_id)
+    empty_id = authenticated_client.post("/portfolios", json={"name": "Empty"}).json()["id"]
+
+    with patch("app.services.market_data.SyntheticProvider.get_history", autospec=True, side_effect=SyntheticProvider.get_history) as mock_history:
+        response = authenticated_client.post("/portfolios/analyze-all")
+    assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+    # BBB is shared, every ticker is fetched once
+    assert sorted(call.args[1] for call in mock_history.call_args_list) == ["AAA", "BBB", "CCC"]
+
+    batch = response.json()
+    assert sorted(result["portfolio_id"] for result in batch["analyses"]) == sorted(portfolio_ids)
+    assert batch["skipped"] == [{"portfolio_id": empty_id, "reason": "No holdings to analyze"}]
+    # The covariance of the union is estimated once, both portfolios slice it
+    covariance_stats = authenticated_client.get("/metrics").json()["covariance_cache"]
+    assert (covariance_stats["misses"], covariance_stats["subset_hits"]) == (1, 2)
+
+    # The batch results are the latest analyses of each portfolio
+    for result in batch["analyses"]:
+        latest = authenticated_client.get(f"/portfolios/{result['portfolio_id']}/analysis").json()
+        assert latest["id"] == result["id"]
+        assert len(latest["optimized_allocations"]) == 2
+
+    # Nothing changed, the second batch returns the stored analyses
+    repeat = authenticated_client.post("/portfolios/analyze-all").json()
+    assert sorted(result["id"] for result in repeat["analyses"]) == sorted(result["id"] for result in batch["analyses"])
+
+
+# A portfolio gets the same results in a batch as on its own, whatever the other portfolios hold
+def test_run_analysis_all_matches_single_analysis(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    portfolio_ids = {}
+    for name, tickers in [("Tech", ["AAA", "BBB"]), ("Young", ["BBB", "NEWCO"]), ("Broken", ["AAA", "ZZZ"])]:
+        portfolio_ids[name] = authenticated_client.post("/portfolios", json={"name": name}).json()["id"]
+        for ticker in tickers:
+            authenticated_client.post(f"/portfolios/{portfolio_ids[name]}/holdings", json={"ticker": ticker, "num_shares": 10, "average_cost": 50})
+
+    # NEWCO only has the last 40 days of prices, ZZZ cannot be fetched at all
+    synthetic_history = SyntheticProvider.get_history
+    def get_history(provider, ticker, start_date, end_date):
+        if ticker == "ZZZ":
+            raise ValueError("No data found for ZZZ")
+        prices = synthetic_history(provider, ticker, start_date, end_date)
+        return prices.iloc[-40:] if ticker == "NEWCO" else prices
+
+    with patch("app.services.market_data.SyntheticProvider.get_history", autospec=True, side_effect=get_history):
+        response = authenticated_client.post("/portfolios/analyze-all")
+        assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+        batch = response.json()
+        single = authenticated_client.post(f"/portfolios/{portfolio_ids['Tech']}/analyze?force=true").json()
+
+    # The broken portfolio is reported, the others are still analyzed
+    assert sorted(result["portfolio_id"] for result in batch["analyses"]) == sorted([portfolio_ids["Tech"], portfolio_ids["Young"]])
+    assert batch["skipped"] == [{"portfolio_id": portfolio_ids["Broken"], "reason": "Could not fetch prices for ZZZ"}]
+
+    # The short NEWCO history does not cut the rows Tech is computed on
+    tech = next(result for result in batch["analyses"] if result["portfolio_id"] == portfolio_ids["Tech"])
+    for field in ["annualized_return", "annualized_volatility", "sharpe_ratio", "max_drawdown"]:
+        assert tech[field] == pytest.approx(single[field])
+    batch_allocations = {allocation["ticker"]: allocation["optimized_weight"] for allocation in tech["optimized_allocations"]}
+    single_allocations = {allocation["ticker"]: allocation["optimized_weight"] for allocation in single["optimized_allocations"]}
+    assert batch_allocations == pytest.approx(single_allocations, abs=1e-6)
+
+
+# Create a test to page through the analysis history with the cursor header
+def test_get_analysis_history_pages(run_analysis, authenticated_client):
+    portfolio_id = run_analysis
+    with patch("app.services.market_data.yf.download"):
+        for _ in range(4):
+            authenticated_client.post(f"/portfolios/{portfolio_id}/analyze?force=true")
+
+    seen = []
+    cursor = None
+    while True:
+        url = f"/portfolios/{portfolio_id}/analysis/history?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        response = authenticated_client.get(url)
+        assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+        assert len(response.json()) <= 2
+        seen.extend(result["id"] for result in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert len(seen) == 5
+    assert seen == sorted(seen, reverse=True)
+    assert all(len(result["ticker_metrics"]) == 1 for result in authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/history").json())
+
+    # Date filter and invalid cursor
+    response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/history?end=2000-01-01T00:00:00")
+    assert response.status_code == 404
+    response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/history?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+# Create a test to stream the analysis history as NDJSON and CSV
+def test_export_analysis_history(run_analysis, authenticated_client, authenticated_client_2):
+    portfolio_id = run_analysis
+    with patch("app.services.market_data.yf.download"):
+        authenticated_client.post(f"/portfolios/{portfolio_id}/analyze?force=true")
+
+    response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 2
+    assert lines[0]["id"] < lines[1]["id"]
+    assert all(len(line["ticker_metrics"]) == 1 for line in lines)
+
+    response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/export?format=csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row["id"]) for row in rows] == [line["id"] for line in lines]
+    assert float(rows[0]["sharpe_ratio"]) == lines[0]["sharpe_ratio"]
+
+    # Empty range still returns the CSV header, other users are refused
+    response = authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/export?format=csv&end=2000-01-01T00:00:00")
+    assert response.text.strip() == "id,portfolio_id,calculated_at,total_value,total_cost,unrealized_profit_loss,annualized_return,annualized_volatility,sharpe_ratio,max_drawdown,historical_var_95,historical_cvar_95,historical_var_99,historical_cvar_99,parametric_var_95,parametric_cvar_95,parametric_var_99,parametric_cvar_99"
+    assert authenticated_client.get(f"/portfolios/{portfolio_id}/analysis/export?format=xml").status_code == 422
+    assert authenticated_client_2.get(f"/portfolios/{portfolio_id}/analysis/export").status_code == 403
+
+
+# Create a test to check the analysis and its child rows are written with a single commit
+def test_create_analysis_result_single_commit(run_analysis, db_session):
+    portfolio_id = run_analysis
+    latest = analysis.get_latest_analysis(db_session, portfolio_id)
+    analysis_data = {column: getattr(latest, column) for column in ("total_value", "total_cost", "unrealized_profit_loss", "annualized_return",
+                                                                     "annualized_volatility", "sharpe_ratio", "max_drawdown")}
+    ticker_metrics = [{"ticker": metric.ticker, "current_price": metric.current_price, "position_value": metric.position_value, "weight": metric.weight,
+                       "annualized_return": metric.annualized_return, "annualized_volatility": metric.annualized_volatility,
+                       "sharpe_ratio": metric.sharpe_ratio, "max_drawdown": metric.max_drawdown} for metric in latest.ticker_metrics]
+
+    with patch.object(db_session, "commit", wraps=db_session.commit) as mock_commit:
+        new_analysis = analysis.create_analysis_result(db_session, portfolio_id, analysis_data, ticker_metrics * 3, [])
+    assert mock_commit.call_count == 1
+    assert [metric.ticker for metric in new_analysis.ticker_metrics] == [latest.ticker_metrics[0].ticker] * 3
+    assert new_analysis.optimized_allocations == []
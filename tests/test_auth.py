@@ -2,6 +2,9 @@
 
 # run auth test: python -m pytest tests/test_auth.py
 
+from unittest.mock import patch
+import jwt
+
 # 1- Create a test to register user
 def test_register(client):
     response = client.post(
@@ -103,3 +106,21 @@ def test_login_wrong_email(client, test_creating_user):
 
 
 
+
+
+
+# 6- Create a test to make sure the token is decoded once per request (rate limit key and current user)
+def test_token_decoded_once(authenticated_client):
+    with patch("app.oauth2.jwt.decode", wraps=jwt.decode) as mock_decode:
+        response = authenticated_client.get("/portfolios/")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.json()}"
+    assert mock_decode.call_count == 1
+
+
+# 7- Create a test to reject an invalid token, the rate limiter falls back to the client address
+def test_invalid_token(client):
+    with patch("app.oauth2.jwt.decode", wraps=jwt.decode) as mock_decode:
+        response = client.get("/portfolios/", headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401, f"Expected 401, got {response.status_code}: {response.json()}"
+    assert mock_decode.call_count == 1
+    assert client.get("/portfolios/").status_code == 401
@@ -0,0 +1,52 @@
+# Test the covariance service
+
+# run covariance test: python -m pytest tests/test_covariance.py
+
+import numpy as np
+from datetime import date
+from app.services.covariance import estimate_covariance, get_covariance
+
+
+def fake_returns(num_days, num_assets, seed=5):
+    rng = np.random.default_rng(seed)
+    market = rng.normal(0.0004, 0.01, size=(num_days, 1))
+    return market + rng.normal(0.0, 0.015, size=(num_days, num_assets))
+
+
+# 1- Shrinkage keeps the matrix well conditioned when there are more tickers than days
+def test_shrinkage_is_well_conditioned():
+    returns = fake_returns(60, 120)
+    sample = estimate_covariance(returns, "sample")
+    for method in ["ledoit_wolf", "constant_correlation"]:
+        shrunk = estimate_covariance(returns, method)
+        np.testing.assert_allclose(shrunk, shrunk.T)
+        assert np.linalg.eigvalsh(shrunk).min() > 0
+        assert np.linalg.cond(shrunk) < np.linalg.cond(sample)
+
+
+# 2- A subset of cached tickers is sliced out of the superset, in the requested order
+def test_cache_serves_subsets(clear_covariance_cache):
+    returns = fake_returns(252, 4)
+    tickers = ["AAA", "BBB", "CCC", "DDD"]
+    full = get_covariance(tickers, date(2025, 1, 2), date(2026, 1, 2), returns, method="sample")
+
+    subset = get_covariance(["DDD", "BBB"], date(2025, 1, 2), date(2026, 1, 2), returns[:, [3, 1]], method="sample")
+    np.testing.assert_array_equal(subset, full[np.ix_([3, 1], [3, 1])])
+
+    # A different end date or a different number of rows is a different window, it must not reuse the matrix
+    get_covariance(tickers, date(2025, 1, 2), date(2026, 1, 5), returns, method="sample")
+    get_covariance(["DDD", "BBB"], date(2025, 1, 2), date(2026, 1, 2), returns[:200, [3, 1]], method="sample")
+    stats = clear_covariance_cache.stats()
+    assert (stats["hits"], stats["subset_hits"], stats["misses"]) == (0, 1, 3)
+
+
+# 3- A shrunk subset is estimated on its own, slicing the superset would give a different matrix
+def test_cache_never_slices_shrinkage(clear_covariance_cache):
+    returns = fake_returns(60, 6)
+    tickers = ["AAA", "BBB", "CCC", "DDD", "EEE", "FFF"]
+    get_covariance(tickers, date(2025, 10, 1), date(2026, 1, 2), returns, method="ledoit_wolf")
+
+    subset = get_covariance(["BBB", "DDD"], date(2025, 10, 1), date(2026, 1, 2), returns[:, [1, 3]], method="ledoit_wolf")
+    np.testing.assert_allclose(subset, estimate_covariance(returns[:, [1, 3]], "ledoit_wolf"))
+    stats = clear_covariance_cache.stats()
+    assert (stats["hits"], stats["subset_hits"], stats["misses"]) == (0, 0, 2)
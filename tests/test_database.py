@@ -0,0 +1,144 @@
+# Test the connection pool instrumentation and the async routes on a real asyncpg session
+
+# run database test: python -m pytest tests/test_database.py
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.pool_metrics import instrument_engine, pool_stats, InstrumentedQueuePool, InstrumentedNullPool
+from app.config import settings
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from fastapi.testclient import TestClient
+from app import database, main
+from app.main import app
+from app.crud.user import create_user
+from app.schemas.user import UserCreate
+from app.oauth2 import create_access_token
+
+
+SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name_test}"
+ASYNC_SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+@pytest.fixture
+def instrumented_engine():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=1, pool_timeout=0.1)
+    yield engine, instrument_engine(engine, "test")
+    pool_stats.pop("test", None)
+    engine.dispose()
+
+
+# 1- Checkouts, connections in use, overflow and timeouts are counted
+def test_pool_stats(instrumented_engine):
+    engine, stats = instrumented_engine
+    first = engine.connect()
+    second = engine.connect()
+    assert second.execute(text("select 1")).scalar() == 1
+    assert stats.stats()["in_use"] == 2
+    assert stats.stats()["overflow_in_use"] == 1
+
+    # Pool and overflow are both used, the next checkout waits pool_timeout and fails
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+
+    first.close()
+    second.close()
+    result = stats.stats()
+    assert result["in_use"] == 0
+    assert result["peak_in_use"] == 2
+    assert result["peak_overflow"] == 1
+    assert result["checkouts"] == 2
+    assert result["timeouts"] == 1
+    assert result["wait_seconds_max"] >= 0.1
+    assert sum(result["wait_buckets"].values()) == 3
+    assert result["size"] == 1 and result["max_overflow"] == 1
+
+
+# 2- A disposed engine gets a new pool that keeps counting into the same stats
+def test_pool_stats_survive_dispose(instrumented_engine):
+    engine, stats = instrumented_engine
+    engine.connect().close()
+    engine.dispose()
+    engine.connect().close()
+    assert stats.stats()["checkouts"] == 2
+    assert stats.pool is engine.pool
+
+
+# 3- Without a local pool (PgBouncer mode) every checkout is a new connection and is still timed
+def test_null_pool_stats():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedNullPool)
+    stats = instrument_engine(engine, "test")
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("select 1"))
+            assert stats.stats()["in_use"] == 1
+        result = stats.stats()
+        assert result["pool"] == "InstrumentedNullPool"
+        assert result["checkouts"] == 1 and result["in_use"] == 0
+        assert "size" not in result
+    finally:
+        pool_stats.pop("test", None)
+        engine.dispose()
+
+
+# 4- The metrics endpoint reports the application engines
+def test_pool_metrics_endpoint(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert set(response.json()["database_pools"]) == {"sync", "async"}
+
+
+# 5- The async routes on a real asyncpg session: get_async_db is not overridden, only pointed at the test
+# database, so run_sync, the commits and expire_on_commit=False are exercised as in production. The rows are
+# committed, the user is deleted at the end and its portfolios and holdings go with it (ON DELETE CASCADE)
+def test_async_session_routes(monkeypatch):
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    monkeypatch.setattr(database, "AsyncSessionLocal", async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False))
+    # The lifespan runs with the client, keep it away from the application database and the shared executors
+    monkeypatch.setattr(main, "recover_analysis_jobs", lambda: None)
+    monkeypatch.setattr(main, "shutdown_job_pool", lambda: None)
+    monkeypatch.setattr(main, "shutdown_executors", lambda: None)
+
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    with Session(engine) as db:
+        user = create_user(db, UserCreate(email="async_user@example.com", password="pass123", first_name="Async", last_name="User"))
+        user_id = user.id
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'async_user@example.com'})}"}
+
+    try:
+        with TestClient(app, headers=headers) as client:
+            response = client.post("/portfolios", json={"name": "Async Portfolio", "description": "asyncpg"})
+            assert response.status_code == 201, response.json()
+            portfolio_id = response.json()["id"]
+
+            response = client.put(f"/portfolios/{portfolio_id}", json={"name": "Renamed Portfolio"})
+            assert response.status_code == 200, response.json()
+            assert response.json()["name"] == "Renamed Portfolio"
+            assert [p["id"] for p in client.get("/portfolios").json()] == [portfolio_id]
+
+            response = client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": "AAPL", "num_shares": 10, "average_cost": 150.0})
+            assert response.status_code == 201, response.json()
+            holding_id = response.json()["id"]
+
+            response = client.put(f"/portfolios/{portfolio_id}/holdings/{holding_id}", json={"num_shares": 12})
+            assert response.status_code == 200, response.json()
+            assert response.json()["num_shares"] == 12
+            holdings = client.get(f"/portfolios/{portfolio_id}/holdings").json()
+            assert [(h["id"], h["num_shares"]) for h in holdings] == [(holding_id, 12)]
+
+            assert client.delete(f"/portfolios/{portfolio_id}/holdings/{holding_id}").status_code == 204
+            assert client.get(f"/portfolios/{portfolio_id}/holdings").json() == []
+
+            response = client.put("/users/me", json={"first_name": "Renamed"})
+            assert response.status_code == 200, response.json()
+            assert response.json()["first_name"] == "Renamed"
+            assert client.get("/users/me").json()["first_name"] == "Renamed"
+
+            assert client.delete(f"/portfolios/{portfolio_id}").status_code == 204
+            assert client.get("/portfolios").json() == []
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text("DELETE FROM users WHERE id = :id"), {"id": user_id})
+        engine.dispose()
@@ -0,0 +1,61 @@
+# Test the analysis executor admission control
+
+# run executor test: python -m pytest tests/test_executor.py
+
+import asyncio
+import threading
+import pytest
+from unittest.mock import MagicMock
+from concurrent.futures.process import BrokenProcessPool
+from app.services import executor as executor_module
+from app.services.executor import AnalysisExecutor, AnalysisQueueFullError, run_optimizers
+
+
+# 1- One running and one queued request fit, the next one is rejected straight away
+def test_executor_rejects_when_queue_is_full():
+    executor = AnalysisExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        second = asyncio.ensure_future(executor.run(lambda: "done"))
+        await asyncio.sleep(0.05)
+        assert executor.stats()["running"] == 1
+        assert executor.stats()["queued"] == 1
+
+        with pytest.raises(AnalysisQueueFullError):
+            await executor.run(lambda: None)
+
+        release.set()
+        return await first, await second
+
+    assert asyncio.run(scenario()) == (True, "done")
+    stats = executor.stats()
+    assert (stats["running"], stats["queued"], stats["completed"], stats["rejected"]) == (0, 0, 2, 1)
+    executor.shutdown()
+
+
+# 2- A full queue turns into 503 with Retry-After on the analysis routes
+def test_analysis_route_returns_503_when_busy(authenticated_client, monkeypatch):
+    busy_executor = AnalysisExecutor(max_workers=1, max_queue=0)
+    busy_executor.running = 1
+    monkeypatch.setattr("app.routers.analysis.analysis_executor", busy_executor)
+
+    portfolio_id = authenticated_client.post("/portfolios", json={"name": "Busy Portfolio"}).json()["id"]
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/analyze")
+
+    assert response.status_code == 503, f"Expected 503, got {response.status_code} : {response.json()}"
+    assert response.headers["Retry-After"] == "5"
+    assert authenticated_client.get("/metrics").status_code == 200
+    busy_executor.shutdown()
+
+
+# 3- A broken optimizer pool is dropped and the optimizers run in process instead
+def test_run_optimizers_falls_back_when_pool_is_broken(monkeypatch):
+    broken_pool = MagicMock(**{"submit.side_effect": BrokenProcessPool("A process in the process pool was terminated abruptly")})
+    monkeypatch.setattr(executor_module.settings, "optimizer_processes", 2)
+    monkeypatch.setattr(executor_module, "_optimizer_pool", broken_pool)
+
+    assert run_optimizers([(pow, (2, 3)), (max, (1, 5))]) == [8, 5]
+    broken_pool.shutdown.assert_called_once()
+    assert executor_module._optimizer_pool is None
@@ -1,6 +1,14 @@
 # Test holdings
 
 # run auth test: python -m pytest tests/test_holdings.py
+import csv
+import io
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from unittest.mock import patch
+from app.config import settings
+from app.services.market_data import SyntheticProvider
 
 # 1- Create a test to ensure holding was created sucessfully
 # First create a portfolio to add the holdings
@@ -40,3 +48,101 @@ def test_get_holdings_by_id(authenticated_client):
     response = authenticated_client.get(f"/portfolios/{portfolio_id}/holdings")
     assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
 
+
+
+# 3- Create a test to make sure a missing average cost is filled with the current price
+def test_holding_without_average_cost(authenticated_client, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    create_response = authenticated_client.post(
+        "/portfolios", json= {
+            "name": "Quote Portfolio",
+            "description": "Average cost from the market data provider"
+        }
+    )
+    portfolio_id = create_response.json()["id"]
+
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/holdings",
+        json={
+            "ticker": "JNJ", "num_shares": 7
+        }
+    )
+    assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+    assert response.json()["average_cost"] > 0
+
+
+
+# 4- Create a test to import holdings from CSV and JSON files
+def test_import_holdings(authenticated_client, authenticated_client_2, monkeypatch):
+    monkeypatch.setattr(settings, "market_data_provider", "synthetic")
+    create_response = authenticated_client.post(
+        "/portfolios", json= {
+            "name": "Imported Portfolio",
+            "description": "Holdings from a brokerage export"
+        }
+    )
+    portfolio_id = create_response.json()["id"]
+
+    csv_file = "ticker,num_shares,average_cost\nAAPL,10,150.5\nMSFT,5,\nGOOG,not-a-number,100\nAAPL,2,\n"
+    with patch("app.services.market_data.SyntheticProvider.get_quotes", autospec=True, side_effect=SyntheticProvider.get_quotes) as mock_quotes:
+        response = authenticated_client.post(f"/portfolios/{portfolio_id}/holdings/import",
+                                             files={"file": ("holdings.csv", csv_file, "text/csv")})
+    assert response.status_code == 201, f"Expected 201, got {response.status_code} : {response.json()}"
+    result = response.json()
+    assert result["imported"] == 3
+    assert [new_holding["ticker"] for new_holding in result["holdings"]] == ["AAPL", "MSFT", "AAPL"]
+    assert result["holdings"][0]["average_cost"] == 150.5
+    assert all(new_holding["average_cost"] > 0 for new_holding in result["holdings"])
+    assert [(error["row"], error["ticker"]) for error in result["errors"]] == [(3, "GOOG")]
+    # Missing costs are looked up once for all tickers
+    assert mock_quotes.call_count == 1
+    assert mock_quotes.call_args.args[1] == ["AAPL", "MSFT"]
+
+    json_file = json.dumps([{"ticker": "JNJ", "num_shares": 3, "average_cost": 55}, {"num_shares": 1}, "NVDA"])
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/holdings/import",
+                                         files={"file": ("holdings.json", json_file, "application/json")})
+    assert response.status_code == 201
+    assert response.json()["imported"] == 1
+    assert [error["row"] for error in response.json()["errors"]] == [2, 3]
+    assert len(authenticated_client.get(f"/portfolios/{portfolio_id}/holdings").json()) == 4
+
+    # Unreadable files and other users are refused
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/holdings/import", files={"file": ("holdings.csv", "symbol,shares\nAAPL,1\n", "text/csv")})
+    assert response.status_code == 400
+    response = authenticated_client.post(f"/portfolios/{portfolio_id}/holdings/import", files={"file": ("holdings.json", "{", "application/json")})
+    assert response.status_code == 400
+    response = authenticated_client_2.post(f"/portfolios/{portfolio_id}/holdings/import", files={"file": ("holdings.csv", csv_file, "text/csv")})
+    assert response.status_code == 403
+
+
+
+# 5- Create a test to export holdings as CSV, Arrow and Parquet
+def test_export_holdings(authenticated_client, authenticated_client_2):
+    portfolio_ids = []
+    for name, tickers in (("Export A", ["AAPL", "MSFT"]), ("Export B", ["JNJ"])):
+        portfolio_id = authenticated_client.post("/portfolios", json={"name": name, "description": "Export"}).json()["id"]
+        for ticker in tickers:
+            authenticated_client.post(f"/portfolios/{portfolio_id}/holdings", json={"ticker": ticker, "num_shares": 2.5, "average_cost": 10})
+        portfolio_ids.append(portfolio_id)
+
+    response = authenticated_client.get(f"/portfolios/{portfolio_ids[0]}/holdings/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["ticker"] for row in rows] == ["AAPL", "MSFT"]
+    assert float(rows[0]["num_shares"]) == 2.5
+
+    response = authenticated_client.get("/portfolios/holdings/export?format=arrow")
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column("ticker").to_pylist() == ["AAPL", "MSFT", "JNJ"]
+    assert table.column("portfolio_id").to_pylist() == [portfolio_ids[0]] * 2 + [portfolio_ids[1]]
+
+    response = authenticated_client.get("/portfolios/holdings/export?format=parquet")
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column("average_cost").to_pylist() == [10.0] * 3
+
+    # A user without portfolios gets an empty file, other users' portfolios are refused
+    assert pa.ipc.open_stream(authenticated_client_2.get("/portfolios/holdings/export?format=arrow").content).read_all().num_rows == 0
+    assert authenticated_client_2.get(f"/portfolios/{portfolio_ids[0]}/holdings/export").status_code == 403
+    assert authenticated_client.get(f"/portfolios/{portfolio_ids[0]}/holdings/export?format=json").status_code == 422
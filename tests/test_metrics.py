@@ -0,0 +1,90 @@
+# Test the NumPy metrics kernel
+
+# run metrics test: python -m pytest tests/test_metrics.py
+
+import numpy as np
+import pandas as pd
+from app.services.metrics import daily_returns, asset_metrics, annualized_covariance, tail_risk, rolling_metrics
+from scipy.stats import norm
+
+
+# Reference: the pandas calculations the analysis service used before the NumPy kernel
+def pandas_metrics(prices, risk_free_rate):
+    prices = prices.dropna(how="all")
+    returns = prices.ffill().pct_change().dropna()
+    cumulative_returns = (1 + returns).cumprod().dropna()
+    annualized_volatility = returns.std() * np.sqrt(252)
+    annualized_returns = returns.mean() * 252
+    running_max = cumulative_returns.cummax()
+    return {
+        "annualized_return": annualized_returns,
+        "annualized_volatility": annualized_volatility,
+        "sharpe_ratio": (annualized_returns - risk_free_rate) / annualized_volatility,
+        "max_drawdown": ((running_max - cumulative_returns) / running_max).max(),
+        "covariance": returns.cov() * 252,
+    }
+
+
+def fake_prices(num_days, num_assets, seed=7):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0004, 0.02, size=(num_days, num_assets))
+    prices = 100 * np.cumprod(1 + returns, axis=0)
+    dates = pd.bdate_range("2024-01-01", periods=num_days)
+    return pd.DataFrame(prices, index=dates, columns=[f"T{i}" for i in range(num_assets)])
+
+
+# 1- The kernel must match the pandas results
+def test_kernel_matches_pandas():
+    prices = fake_prices(252, 50)
+    expected = pandas_metrics(prices, 0.03)
+
+    returns = daily_returns(prices.to_numpy())
+    metrics = asset_metrics(returns, 0.03)
+
+    for name in ["annualized_return", "annualized_volatility", "sharpe_ratio", "max_drawdown"]:
+        np.testing.assert_allclose(metrics[name], expected[name].to_numpy(), rtol=1e-9, atol=1e-12, err_msg=name)
+    np.testing.assert_allclose(annualized_covariance(returns), expected["covariance"].to_numpy(), rtol=1e-9, atol=1e-12)
+
+
+# 2- Missing prices are handled the same way as pandas (forward filled, leading gaps dropped)
+def test_kernel_matches_pandas_with_missing_prices():
+    prices = fake_prices(252, 10)
+    prices.iloc[:5, 3] = np.nan   # ticker listed later than the others
+    prices.iloc[100, 6] = np.nan  # missing day in the middle
+    expected = pandas_metrics(prices, 0.03)
+
+    metrics = asset_metrics(daily_returns(prices.to_numpy()), 0.03)
+
+    for name in ["annualized_return", "annualized_volatility", "sharpe_ratio", "max_drawdown"]:
+        np.testing.assert_allclose(metrics[name], expected[name].to_numpy(), rtol=1e-9, atol=1e-12, err_msg=name)
+
+
+
+# 3- Historical VaR/CVaR must match the sorted returns, parametric VaR the normal quantile
+def test_tail_risk_matches_sorted_returns():
+    returns = daily_returns(fake_prices(504, 20).to_numpy())
+    risk = tail_risk(returns, confidence_levels=(0.95, 0.99))
+
+    sorted_returns = np.sort(returns, axis=0)
+    for level, suffix in [(0.95, "95"), (0.99, "99")]:
+        tail_size = int(np.floor((len(returns) - 1) * (1 - level))) + 1
+        np.testing.assert_allclose(risk[f"historical_var_{suffix}"], -np.quantile(returns, 1 - level, axis=0), rtol=1e-12)
+        np.testing.assert_allclose(risk[f"historical_cvar_{suffix}"], -sorted_returns[:tail_size].mean(axis=0), rtol=1e-12)
+        expected_var = -norm.ppf(1 - level, loc=returns.mean(axis=0), scale=returns.std(axis=0, ddof=1))
+        np.testing.assert_allclose(risk[f"parametric_var_{suffix}"], expected_var, rtol=1e-10)
+
+
+# 4- Rolling metrics must match the pandas rolling windows
+def test_rolling_metrics_match_pandas():
+    returns = daily_returns(fake_prices(252, 15).to_numpy())
+    rolling = rolling_metrics(returns, [21, 63, 126], 0.03)
+
+    df = pd.DataFrame(returns)
+    growth = (1 + df).cumprod()
+    for window in [21, 63, 126]:
+        volatility = df.rolling(window).std() * np.sqrt(252)
+        sharpe_ratio = (df.rolling(window).mean() * 252 - 0.03) / volatility
+        drawdown = 1 - growth / growth.rolling(window).max()
+        np.testing.assert_allclose(rolling[window]["volatility"], volatility.to_numpy(), rtol=1e-9)
+        np.testing.assert_allclose(rolling[window]["sharpe_ratio"], sharpe_ratio.to_numpy(), rtol=1e-8)
+        np.testing.assert_allclose(rolling[window]["drawdown"], drawdown.to_numpy(), rtol=1e-9, atol=1e-15)
@@ -0,0 +1,88 @@
+# Test the portfolio optimizers
+
+# run optimization test: python -m pytest tests/test_optimization.py
+
+import numpy as np
+from unittest.mock import patch
+from scipy.optimize import minimize
+from app.services import analysis_service
+from app.services.analysis_service import optimize_sharpe, optimize_min_volatility, warm_start_weights, compute_efficient_frontier
+from app.services.optimization import QPSolveError
+
+
+def fake_inputs(num_assets, seed=11):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0006, 0.02, size=(252, num_assets)) + rng.normal(0, 0.01, size=(252, 1))
+    return returns.mean(axis=0) * 252, np.cov(returns, rowvar=False) * 252
+
+
+# Reference: plain SLSQP with finite differences, the way the optimizers used to work
+def slsqp_reference(objective, num_assets):
+    result = minimize(objective, np.ones(num_assets) / num_assets, method='SLSQP',
+                      bounds=[(0, 1)] * num_assets, constraints={'type': 'eq', 'fun': lambda w: np.sum(w) - 1})
+    return result.x
+
+
+# 1- The Sharpe optimizer must reach at least the Sharpe ratio of the reference
+def test_optimize_sharpe_matches_reference():
+    annualized_returns, covariance = fake_inputs(40)
+    sharpe = lambda w: (w @ annualized_returns - 0.03) / np.sqrt(w @ covariance @ w)
+
+    weights, stats = optimize_sharpe(annualized_returns, covariance, 0.03)
+    reference = slsqp_reference(lambda w: -sharpe(w), 40)
+
+    assert abs(weights.sum() - 1) < 1e-8 and weights.min() >= 0
+    assert sharpe(weights) >= sharpe(reference) - 1e-6
+    assert stats["iterations"] > 0
+
+
+# 2- The minimum volatility optimizer must reach at most the volatility of the reference
+def test_optimize_min_volatility_matches_reference():
+    annualized_returns, covariance = fake_inputs(40)
+    volatility = lambda w: np.sqrt(w @ covariance @ w)
+
+    weights, stats = optimize_min_volatility(annualized_returns, covariance)
+    reference = slsqp_reference(volatility, 40)
+
+    assert abs(weights.sum() - 1) < 1e-8 and weights.min() >= 0
+    assert volatility(weights) <= volatility(reference) + 1e-6
+    assert stats["iterations"] > 0
+
+
+# 3- Warm start weights keep the previous allocation and give new tickers an equal share
+def test_warm_start_weights_partial_match():
+    weights = warm_start_weights(["AAPL", "MSFT", "NVDA", "TSLA"], {"AAPL": 0.6, "MSFT": 0.4, "GOOGL": 0.2})
+    np.testing.assert_allclose(weights, np.array([0.6, 0.4, 0.25, 0.25]) / 1.5)
+    assert warm_start_weights(["TSLA"], {"AAPL": 1.0}) is None
+
+
+# 4- A warm start must land on the same optimum as a cold start
+def test_warm_start_reaches_same_optimum():
+    annualized_returns, covariance = fake_inputs(60)
+    cold_weights, _ = optimize_min_volatility(annualized_returns, covariance)
+    warm_weights, _ = optimize_min_volatility(annualized_returns, covariance, initial_weights=np.ones(60) / 60)
+    np.testing.assert_allclose(warm_weights, cold_weights, atol=1e-8)
+
+
+# 5- A frontier target that does not converge is left out instead of returning its unoptimized start
+def test_frontier_leaves_out_failed_points():
+    annualized_returns, covariance = fake_inputs(20)
+    solve = analysis_service.solve_min_variance_qp
+    target_solves = []
+
+    def failing_solve(covariance, A, b, **kwargs):
+        if len(b) == 2:
+            target_solves.append(b[1])
+            if len(target_solves) == 3:
+                raise QPSolveError("Active-set solver did not converge")
+        return solve(covariance, A, b, **kwargs)
+
+    with patch("app.services.analysis_service.solve_min_variance_qp", side_effect=failing_solve):
+        frontier = compute_efficient_frontier(annualized_returns, covariance, 0.03, num_points=10)
+
+    complete = compute_efficient_frontier(annualized_returns, covariance, 0.03, num_points=10)
+    assert len(frontier["weights"]) == 9
+    assert not np.isclose(frontier["expected_returns"], target_solves[2]).any()
+    # The other points are the same minimum variance portfolios as without the failure
+    kept = [i for i, expected_return in enumerate(complete["expected_returns"]) if not np.isclose(expected_return, target_solves[2])]
+    np.testing.assert_allclose(frontier["volatilities"], complete["volatilities"][kept], rtol=1e-8)
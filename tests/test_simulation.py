@@ -0,0 +1,63 @@
+# Test the Monte Carlo simulation engine
+
+# run simulation test: python -m pytest tests/test_simulation.py
+
+import numpy as np
+from app.services.simulation import simulate_portfolio, BLOCK_PATHS
+
+
+def fake_inputs(num_assets, seed=3):
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(0, 0.05, size=(num_assets, num_assets))
+    covariance = factors @ factors.T + 0.02 * np.eye(num_assets)
+    annualized_returns = rng.uniform(0.0, 0.15, num_assets)
+    return np.ones(num_assets) / num_assets, annualized_returns, covariance
+
+
+# Reference: every path kept in memory, percentiles taken with np.percentile
+def full_paths(weights, annualized_returns, covariance, initial_value, num_paths, horizon_days, seed):
+    generators = [np.random.Generator(np.random.SFC64(child)) for child in np.random.SeedSequence(seed).spawn(-(-num_paths // BLOCK_PATHS))]
+    daily_covariance = covariance / 252
+    ridge = 1e-12 * np.trace(daily_covariance) / len(weights)
+    cholesky = np.linalg.cholesky(daily_covariance + ridge * np.eye(len(weights)))
+    growth = np.ones((num_paths, len(weights)))
+    values = []
+    for _ in range(horizon_days):
+        draws = np.vstack([rng.standard_normal((min(BLOCK_PATHS, num_paths - i * BLOCK_PATHS), len(weights))) for i, rng in enumerate(generators)])
+        growth *= draws @ cholesky.T + annualized_returns / 252 + 1
+        values.append(initial_value * growth @ weights)
+    return np.array(values)
+
+
+# 1- Histogram percentiles must match the percentiles of the full set of paths
+def test_simulation_matches_full_paths():
+    weights, annualized_returns, covariance = fake_inputs(8)
+    result = simulate_portfolio(weights, annualized_returns, covariance, 1000, num_paths=5000, horizon_days=60, percentiles=[5, 50, 95], seed=11)
+    values = full_paths(weights, annualized_returns, covariance, 1000, 5000, 60, seed=11)
+
+    for percentile in [5, 50, 95]:
+        np.testing.assert_allclose(result["percentiles"][percentile], np.percentile(values, percentile, axis=1), rtol=1e-3)
+    np.testing.assert_allclose(result["expected_values"], values.mean(axis=1), rtol=1e-10)
+    assert result["probability_of_loss"] == (values[-1] < 1000).mean()
+
+
+# 2- Small chunks give the same result, only the memory used changes
+def test_simulation_chunks_do_not_change_result():
+    weights, annualized_returns, covariance = fake_inputs(5)
+    single = simulate_portfolio(weights, annualized_returns, covariance, 1000, num_paths=3000, horizon_days=20, seed=5)
+    chunked = simulate_portfolio(weights, annualized_returns, covariance, 1000, num_paths=3000, horizon_days=20, seed=5, chunk_bytes=3 * 8 * 5 * BLOCK_PATHS)
+
+    np.testing.assert_allclose(chunked["expected_values"], single["expected_values"], rtol=1e-12)
+    for percentile, values in single["percentiles"].items():
+        np.testing.assert_allclose(chunked["percentiles"][percentile], values, rtol=1e-12)
+
+
+# 3- A drawn seed is returned as a signed 64 bit integer and repeats the run
+def test_simulation_returns_repeatable_seed():
+    weights, annualized_returns, covariance = fake_inputs(3)
+    first = simulate_portfolio(weights, annualized_returns, covariance, 1000, num_paths=500, horizon_days=5)
+    assert 0 <= first["seed"] < 2 ** 63
+
+    repeated = simulate_portfolio(weights, annualized_returns, covariance, 1000, num_paths=500, horizon_days=5, seed=first["seed"])
+    for percentile, values in first["percentiles"].items():
+        np.testing.assert_array_equal(repeated["percentiles"][percentile], values)
@@ -0,0 +1,71 @@
+# Tests for the user profile and the authenticated user cache
+
+# run users test: python -m pytest tests/test_users.py
+
+import asyncio
+from unittest.mock import patch
+import redis.asyncio as aioredis
+from app.config import settings
+from app.crud.user import get_user_by_email
+from app.services.user_cache import UserCache, user_cache
+from app.schemas.user import CurrentUser
+
+
+# 1- Create a test to make sure repeated requests resolve the user from the cache
+def test_current_user_cached(authenticated_client):
+    with patch("app.oauth2.get_user_by_email", wraps=get_user_by_email) as mock_lookup:
+        for _ in range(3):
+            response = authenticated_client.get("/users/me")
+            assert response.status_code == 200, f"Expected 200, got {response.status_code} : {response.json()}"
+    assert response.json()["email"] == "user1@example.com"
+    assert mock_lookup.call_count == 1
+    assert user_cache.stats()["hits"] == 2
+    assert authenticated_client.get("/metrics").json()["user_cache"]["misses"] == 1
+
+
+# 2- Create a test to make sure a profile update is visible straight away
+def test_update_invalidates_cached_user(authenticated_client):
+    authenticated_client.get("/users/me")
+    response = authenticated_client.put("/users/me", json={"first_name": "Jane"})
+    assert response.status_code == 200
+    assert asyncio.run(user_cache.get("user1@example.com")) is None
+    assert authenticated_client.get("/users/me").json()["first_name"] == "Jane"
+
+
+# 3- Create a test for the expiry and the size bound of the memory cache
+def test_user_cache_expiry_and_size():
+    cache = UserCache(ttl=60, max_entries=2)
+
+    async def scenario():
+        for user_id in range(3):
+            await cache.put(CurrentUser(id=user_id, email=f"user{user_id}@example.com"))
+        assert await cache.get("user0@example.com") is None
+        assert (await cache.get("user2@example.com")).id == 2
+
+        with patch("app.services.user_cache.time.monotonic", return_value=10 ** 9):
+            assert await cache.get("user2@example.com") is None
+        assert await UserCache(ttl=0, max_entries=2).get("user2@example.com") is None
+
+    asyncio.run(scenario())
+    assert cache.stats()["hit_rate"] == round(1 / 3, 4)
+    assert cache.stats()["entries"] == 1
+
+
+# 4- Create a test for the Redis backend (the rate limiter's Redis), shared between two caches like two workers would
+def test_user_cache_redis_backend():
+    async def scenario():
+        first, second = [UserCache(ttl=60, max_entries=10, redis_factory=lambda: aioredis.Redis(host=settings.redis_host, port=int(settings.redis_port)))
+                         for _ in range(2)]
+        try:
+            await first.put(CurrentUser(id=7, email="shared@example.com", first_name="Ann"))
+            assert (await second.get("shared@example.com")).first_name == "Ann"
+            await second.invalidate("shared@example.com")
+            assert await first.get("shared@example.com") is None
+        finally:
+            await first.close()
+            await second.close()
+        return first.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["backend"] == "redis"
+    assert "entries" not in stats